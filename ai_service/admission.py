@@ -0,0 +1,273 @@
+"""
+Admission Control Module
+Bounded, fair waiting room in front of the model: a fixed number of
+requests run at once, the rest wait per client and priority class, and
+requests that would wait too long are turned away with a Retry-After hint
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque, Counter as CounterDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from metrics import registry, Counter, Histogram, REQUEST_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", "0"))  # Requests running at once (0 = one full batch per worker)
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))  # Requests allowed to wait
+ADMISSION_BULK_QUEUE_SIZE = int(os.getenv("ADMISSION_BULK_QUEUE_SIZE", "16"))  # Of which bulk requests
+ADMISSION_CLIENT_QUEUE_SIZE = int(os.getenv("ADMISSION_CLIENT_QUEUE_SIZE", "8"))  # Of which from one client
+DEFAULT_SERVICE_SECONDS = float(os.getenv("ADMISSION_DEFAULT_SERVICE_SECONDS", "30"))  # Until measured
+SERVICE_TIME_SMOOTHING = 0.2  # Weight of the newest sample in the service-time average
+
+# Priority classes, served strictly in this order
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+rejected_total = registry.register(Counter(
+    "admission_rejected",
+    "Requests turned away with 429 by admission control, by kind and reason",
+    ["kind", "reason"]
+))
+wait_seconds = registry.register(Histogram(
+    "admission_wait_seconds",
+    "Time admitted requests waited for a slot, by priority class",
+    ["priority"],
+    buckets=REQUEST_BUCKETS
+))
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be queued; retry_after is in whole seconds"""
+
+    def __init__(self, message: str, retry_after: int, reason: str):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+@dataclass
+class _Waiter:
+    client_id: str
+    priority: str
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+class AdmissionTicket:
+    """An admitted request's slot; release() it when the request is done"""
+
+    def __init__(self, controller: "AdmissionController", kind: str, queued_seconds: float):
+        self.kind = kind
+        self.queued_seconds = queued_seconds
+        self._controller = controller
+        self._admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self, record: bool = True):
+        """
+        Free the slot (idempotent)
+
+        Args:
+            record: Count the time held towards the measured service time
+                    (skip for requests answered from a cache)
+        """
+        if self._released:
+            return
+        self._released = True
+        held = time.monotonic() - self._admitted_at
+        self._controller._release(self.kind, held if record else None)
+
+class AdmissionController:
+    """
+    Admission queue for the generation endpoints
+
+    At most max_active admitted requests run at once. Others wait in a
+    bounded queue with one FIFO per client and priority class: interactive
+    requests go before bulk ones, and within a class clients take turns,
+    so one client's burst does not delay everybody else.
+
+    A request is rejected straight away when the queue, the bulk share of
+    it or the client's share of it is full. The Retry-After estimate is the
+    number of "rounds" of max_active requests ahead of it times the
+    measured (smoothed) service time of its kind.
+
+    All methods run on the event loop thread.
+    """
+
+    def __init__(
+        self,
+        max_active: int,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        bulk_queue_size: int = ADMISSION_BULK_QUEUE_SIZE,
+        client_queue_size: int = ADMISSION_CLIENT_QUEUE_SIZE
+    ):
+        """
+        Args:
+            max_active: Requests admitted at the same time
+            queue_size: Requests allowed to wait
+            bulk_queue_size: Waiting bulk requests allowed
+            client_queue_size: Waiting requests allowed per client
+        """
+        self.max_active = max(1, max_active)
+        self.queue_size = max(0, queue_size)
+        self.bulk_queue_size = max(0, bulk_queue_size)
+        self.client_queue_size = max(1, client_queue_size)
+
+        self._active = 0
+        self._queues = {priority: OrderedDict() for priority in PRIORITIES}  # client -> deque of waiters
+        self._waiting = CounterDict()  # priority -> waiting requests
+        self._client_waiting = CounterDict()  # client -> waiting requests
+        self._service_seconds = {}  # kind -> smoothed seconds per admitted request
+
+        # Statistics
+        self._admitted = 0
+        self._rejected = CounterDict()
+
+    def _waiting_ahead(self, priority: str) -> int:
+        """Queued requests that would be served before a new one of this priority"""
+        return sum(self._waiting[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+
+    def service_seconds(self, kind: str) -> float:
+        return self._service_seconds.get(kind, DEFAULT_SERVICE_SECONDS)
+
+    def estimate_wait(self, kind: str, priority: str = PRIORITY_INTERACTIVE) -> float:
+        """Seconds until a request queued now would start running"""
+        if self._active < self.max_active and not self._waiting_ahead(priority):
+            return 0.0
+        rounds = math.ceil((self._waiting_ahead(priority) + 1) / self.max_active)
+        return rounds * self.service_seconds(kind)
+
+    def _reject(self, kind: str, priority: str, reason: str, message: str):
+        self._rejected[reason] += 1
+        rejected_total.inc(kind=kind, reason=reason)
+        retry_after = max(1, math.ceil(self.estimate_wait(kind, priority)))
+        logger.info(f"Rejected {priority} {kind} request ({reason}), retry after {retry_after}s")
+        raise AdmissionRejected(message, retry_after, reason)
+
+    async def acquire(self, client_id: str, priority: str, kind: str) -> AdmissionTicket:
+        """
+        Wait for a slot
+
+        Args:
+            client_id: Caller identity used for fair sharing
+            priority: PRIORITY_INTERACTIVE or PRIORITY_BULK
+            kind: Work kind ("txt2img", "img2img"), for the service-time estimate
+
+        Returns:
+            AdmissionTicket to release when the request is done
+
+        Raises:
+            ValueError: If the priority is unknown
+            AdmissionRejected: If the request cannot be queued
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Invalid priority. Available: {', '.join(PRIORITIES)}")
+
+        if self._active < self.max_active and not self._waiting_ahead(PRIORITIES[-1]):
+            self._active += 1
+            return self._ticket(kind, 0.0, priority)
+
+        if self._waiting_ahead(PRIORITIES[-1]) >= self.queue_size:
+            self._reject(kind, priority, "queue_full", "Server is busy, try again later")
+        if priority == PRIORITY_BULK and self._waiting[PRIORITY_BULK] >= self.bulk_queue_size:
+            self._reject(kind, priority, "bulk_queue_full", "Too many bulk requests are waiting, try again later")
+        if self._client_waiting[client_id] >= self.client_queue_size:
+            self._reject(kind, priority, "client_limit", "Too many of your requests are waiting, try again later")
+
+        waiter = _Waiter(client_id, priority, asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(client_id, deque()).append(waiter)
+        self._waiting[priority] += 1
+        self._client_waiting[client_id] += 1
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.cancelled():
+                self._remove(waiter)
+            else:
+                self._release(kind, None)  # Admitted just as the caller gave up
+            raise
+
+        # _release() counted the slot as active when it handed it over
+        return self._ticket(kind, time.monotonic() - waiter.enqueued_at, priority)
+
+    def _ticket(self, kind: str, queued_seconds: float, priority: str) -> AdmissionTicket:
+        self._admitted += 1
+        wait_seconds.observe(queued_seconds, priority=priority)
+        return AdmissionTicket(self, kind, queued_seconds)
+
+    def _remove(self, waiter: _Waiter):
+        """Take a waiter that gave up out of its queue"""
+        clients = self._queues[waiter.priority]
+        waiters = clients.get(waiter.client_id)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del clients[waiter.client_id]
+        self._forget(waiter)
+
+    def _forget(self, waiter: _Waiter):
+        self._waiting[waiter.priority] -= 1
+        self._client_waiting[waiter.client_id] -= 1
+        if not self._client_waiting[waiter.client_id]:
+            del self._client_waiting[waiter.client_id]
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Highest priority class first; within it, clients take turns"""
+        for priority in PRIORITIES:
+            clients = self._queues[priority]
+            if not clients:
+                continue
+            client_id, waiters = clients.popitem(last=False)
+            waiter = waiters.popleft()
+            if waiters:
+                clients[client_id] = waiters  # Back of the line for this client's next request
+            self._forget(waiter)
+            return waiter
+        return None
+
+    def _release(self, kind: str, held_seconds: Optional[float]):
+        if held_seconds is not None:
+            previous = self._service_seconds.get(kind)
+            self._service_seconds[kind] = held_seconds if previous is None else (
+                SERVICE_TIME_SMOOTHING * held_seconds + (1 - SERVICE_TIME_SMOOTHING) * previous
+            )
+
+        self._active -= 1
+        while self._active < self.max_active:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._active += 1
+            waiter.future.set_result(None)
+
+    def queue_depths(self) -> dict:
+        """Waiting requests per priority class"""
+        return {priority: self._waiting[priority] for priority in PRIORITIES}
+
+    def get_stats(self) -> dict:
+        """
+        Get admission statistics
+
+        Returns:
+            Dictionary with limits, active and waiting requests, measured
+            service times, admitted and rejected counters
+        """
+        return {
+            "max_active": self.max_active,
+            "queue_size": self.queue_size,
+            "bulk_queue_size": self.bulk_queue_size,
+            "client_queue_size": self.client_queue_size,
+            "active": self._active,
+            "waiting": self.queue_depths(),
+            "waiting_clients": len(self._client_waiting),
+            "service_seconds": {kind: round(seconds, 2) for kind, seconds in self._service_seconds.items()},
+            "admitted": self._admitted,
+            "rejected": dict(self._rejected),
+        }
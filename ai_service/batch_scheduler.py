@@ -0,0 +1,338 @@
+"""
+Cross-Request Micro-Batching Scheduler
+Collects /generate-image prompts that arrive close together and runs them
+as one batched Stable Diffusion call, then fans the images back out
+"""
+
+import os
+import time
+import queue
+import threading
+import logging
+from collections import deque, Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuration (overridable via environment)
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS", "100"))  # How long to wait for more prompts
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "4"))  # Max prompts per UNet batch
+STATS_SAMPLE_SIZE = 1000  # Number of recent wait times kept for percentiles
+
+class GenerationCancelled(Exception):
+    """Raised by run_batch when every item of a batch asked to stop before the last step"""
+
+@dataclass
+class BatchItem:
+    """A single queued generation request waiting to join a batch"""
+    prompt: str
+    negative_prompt: Optional[str] = None
+    seed: Optional[int] = None
+    filename: Optional[str] = None
+    step_callback: Optional[Callable] = None
+    settings: Optional[Hashable] = None  # Only items with equal settings share a batch
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+class BatchScheduler:
+    """
+    Micro-batching scheduler for text-to-image generation
+
+    A single background thread owns the pipeline. It blocks until the first
+    prompt arrives, keeps collecting prompts for up to `window_ms` (or until
+    `max_batch_size` is reached), runs them together through `run_batch`,
+    and resolves each caller's Future with its own result.
+
+    Prompts with different settings (steps, resolution, ...) cannot share a
+    UNet pass; they are held back in arrival order for a later batch.
+
+    Items submitted together with submit_group (e.g. several variations of
+    one prompt) always run in the same batch: a group that does not fit in
+    the current batch waits for the next one, and a group larger than
+    `max_batch_size` runs as a batch of its own.
+
+    With `max_concurrent_batches` > 1 (e.g. one per inference worker
+    process), up to that many batches run at once; a new batch is only
+    collected when a slot is free, so prompts keep accumulating meanwhile.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[..., List[str]],
+        window_ms: int = BATCH_WINDOW_MS,
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_concurrent_batches: int = 1
+    ):
+        """
+        Args:
+            run_batch: Callable taking per-item lists as keyword arguments
+                       (prompts, negative_prompts, seeds, filenames,
+                       step_callbacks) plus the batch's shared `settings`,
+                       and returning one result per prompt
+            window_ms: Collection window after the first prompt arrives
+            max_batch_size: Maximum number of prompts per batch
+            max_concurrent_batches: Batches allowed to run at the same time
+        """
+        self.run_batch = run_batch
+        self.window_seconds = max(0, window_ms) / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(self.max_concurrent_batches)
+        self._executor = None
+        self._deferred = deque()  # Items held back because their settings differed
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+
+        # Statistics
+        self._batches_run = 0
+        self._items_processed = 0
+        self._items_failed = 0
+        self._batch_sizes = Counter()
+        self._wait_times = deque(maxlen=STATS_SAMPLE_SIZE)
+        self._batch_durations = deque(maxlen=STATS_SAMPLE_SIZE)
+
+    def start(self):
+        """Start the background batching thread (idempotent)"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            if self.max_concurrent_batches > 1 and self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_concurrent_batches,
+                    thread_name_prefix="batch-runner"
+                )
+            self._thread = threading.Thread(
+                target=self._worker_loop,
+                name="batch-scheduler",
+                daemon=True
+            )
+            self._thread.start()
+        logger.info(
+            f"✓ Batch scheduler started (window={self.window_seconds * 1000:.0f}ms, "
+            f"max_batch_size={self.max_batch_size}, concurrent={self.max_concurrent_batches})"
+        )
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the background thread after the current batch finishes"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        self._queue.put(None)  # Wake up the worker
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def submit(
+        self,
+        prompt: str,
+        negative_prompt: Optional[str] = None,
+        seed: Optional[int] = None,
+        filename: Optional[str] = None,
+        step_callback: Optional[Callable] = None,
+        settings: Optional[Hashable] = None
+    ) -> Future:
+        """
+        Queue a prompt for the next batch
+
+        Args:
+            prompt: Refined text prompt
+            negative_prompt: Optional negative prompt for this item
+            seed: Optional seed for this item
+            filename: Optional output filename for this item
+            step_callback: Optional per-step callback for this item
+                           (e.g. to stream previews)
+            settings: Optional hashable generation settings; only items
+                      with equal settings are batched together
+
+        Returns:
+            concurrent.futures.Future resolving to the generated filename
+        """
+        if not self._running:
+            self.start()
+
+        return self.submit_group([{
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "seed": seed,
+            "filename": filename,
+            "step_callback": step_callback,
+        }], settings=settings)[0]
+
+    def submit_group(self, items: List[dict], settings: Optional[Hashable] = None) -> List[Future]:
+        """
+        Queue several prompts that must run in the same batch
+
+        Args:
+            items: One dictionary per image with the keyword arguments of
+                   submit() (prompt, negative_prompt, seed, filename,
+                   step_callback)
+            settings: Optional hashable generation settings shared by the group
+
+        Returns:
+            One Future per item, in the same order
+        """
+        if not self._running:
+            self.start()
+
+        group = [BatchItem(settings=settings, **item) for item in items]
+        if group:
+            self._queue.put(group)
+        return [item.future for item in group]
+
+    def _collect_batch(self) -> List[BatchItem]:
+        """Block for the first group, then gather more until the window closes"""
+        if self._deferred:
+            first = self._deferred.popleft()
+        else:
+            first = self._queue.get()
+            if first is None:
+                return []
+
+        batch = list(first)
+        settings = first[0].settings
+        deadline = first[0].enqueued_at + self.window_seconds
+        fits = lambda group: len(batch) + len(group) <= self.max_batch_size and group[0].settings == settings
+
+        # Previously deferred groups go first, if they match this batch
+        still_deferred = deque()
+        while self._deferred:
+            group = self._deferred.popleft()
+            if fits(group):
+                batch.extend(group)
+            else:
+                still_deferred.append(group)
+        self._deferred = still_deferred
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    group = self._queue.get(timeout=remaining)
+                else:
+                    # Window already closed (e.g. we were busy): take whatever is waiting
+                    group = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if group is None:
+                break
+            if not fits(group):
+                self._deferred.append(group)
+                continue
+            batch.extend(group)
+
+        return batch
+
+    def _worker_loop(self):
+        """Main loop of the batching thread"""
+        while self._running:
+            if self._executor is None:
+                batch = self._collect_batch()
+                if batch:
+                    self._run(batch)
+                continue
+
+            # Concurrent mode: only start collecting once a batch slot is free
+            self._slots.acquire()
+            batch = self._collect_batch()
+            if not batch:
+                self._slots.release()
+                continue
+            self._executor.submit(self._run_in_slot, batch)
+
+    def _run_in_slot(self, batch: List[BatchItem]):
+        try:
+            self._run(batch)
+        finally:
+            self._slots.release()
+
+    def _run(self, batch: List[BatchItem]):
+        """Run one batch and resolve every waiting Future"""
+        started_at = time.monotonic()
+
+        # Skip items whose callers have already given up
+        batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        logger.info(f"Running generation batch of {len(batch)}")
+
+        try:
+            results = self.run_batch(
+                prompts=[item.prompt for item in batch],
+                negative_prompts=[item.negative_prompt for item in batch],
+                seeds=[item.seed for item in batch],
+                filenames=[item.filename for item in batch],
+                step_callbacks=[item.step_callback for item in batch],
+                settings=batch[0].settings
+            )
+            for item, result in zip(batch, results):
+                item.future.set_result(result)
+            failed = 0
+        except Exception as e:
+            if isinstance(e, GenerationCancelled):
+                logger.info(f"Generation batch stopped: {str(e)}")
+            else:
+                logger.error(f"Generation batch failed: {str(e)}")
+            for item in batch:
+                item.future.set_exception(e)
+            failed = len(batch)
+
+        finished_at = time.monotonic()
+
+        with self._lock:
+            self._batches_run += 1
+            self._items_processed += len(batch)
+            self._items_failed += failed
+            self._batch_sizes[len(batch)] += 1
+            self._batch_durations.append(finished_at - started_at)
+            for item in batch:
+                self._wait_times.append(started_at - item.enqueued_at)
+
+    def get_stats(self) -> dict:
+        """
+        Get batching statistics
+
+        Returns:
+            Dictionary with batch-size distribution, queue wait times and throughput
+        """
+        with self._lock:
+            wait_times = sorted(self._wait_times)
+            durations = list(self._batch_durations)
+            batches_run = self._batches_run
+            items_processed = self._items_processed
+
+            return {
+                "running": self._running,
+                "window_ms": self.window_seconds * 1000,
+                "max_batch_size": self.max_batch_size,
+                "max_concurrent_batches": self.max_concurrent_batches,
+                "queue_depth": self._queue.qsize() + len(self._deferred),
+                "batches_run": batches_run,
+                "items_processed": items_processed,
+                "items_failed": self._items_failed,
+                "avg_batch_size": (items_processed / batches_run) if batches_run else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "wait_time_ms": {
+                    "avg": _mean(wait_times) * 1000,
+                    "p50": _percentile(wait_times, 50) * 1000,
+                    "p95": _percentile(wait_times, 95) * 1000,
+                    "max": (wait_times[-1] * 1000) if wait_times else 0.0,
+                },
+                "avg_batch_duration_s": _mean(durations),
+            }
+
+def _mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -0,0 +1,328 @@
+"""
+Engine Benchmark Suite
+Measures the txt2img and img2img engines over a grid of batch sizes, step
+counts, resolutions, schedulers and thread counts: latency percentiles,
+images per second and peak RSS, written as JSON to compare between commits
+
+By default it runs offline against a tiny randomly initialised
+UNet/VAE/CLIP pipeline built in memory (no downloads, seconds per run), so
+the numbers measure the service's own overhead and scaling rather than
+image quality. --model real uses the configured Stable Diffusion weights.
+Gemini is always replaced by a local stub.
+
+Usage:
+    python benchmark.py [--model tiny|real] [--kinds txt2img img2img]
+                        [--batch-sizes 1 4] [--steps 4 12] [--sizes 64 128]
+                        [--schedulers dpm++] [--threads 1 4] [--runs 3]
+                        [--output benchmarks/results.json] [--compare old.json]
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import itertools
+import subprocess
+from pathlib import Path
+
+BENCHMARK_PROMPT = "a red apple on a white table"
+IMG2IMG_STYLES = ["cartoon", "anime", "watercolor", "pencil_sketch"]
+
+# Defaults per model: the tiny model is cheap enough for larger grids
+DEFAULT_GRID = {
+    "tiny": {"batch_sizes": [1, 4], "steps": [4, 12], "sizes": [64, 128]},
+    "real": {"batch_sizes": [1], "steps": [12, 30], "sizes": [384, 512]},
+}
+
+class StubGeminiClient:
+    """Stands in for the Gemini model: returns the prompt with the required terms"""
+
+    def generate_content(self, full_prompt: str):
+        class Response:
+            text = f"{BENCHMARK_PROMPT}, clean white background, no text, no watermark, high quality"
+        return Response()
+
+def build_tiny_components() -> dict:
+    """
+    Randomly initialised Stable Diffusion components with the real
+    architecture's shape conventions (4 latent channels, 8x VAE downscale,
+    CLIP-style tokenizer), small enough to run in milliseconds on CPU
+    """
+    import torch
+    from diffusers import UNet2DConditionModel, AutoencoderKL, PNDMScheduler
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+    torch.manual_seed(0)
+
+    # Character-level vocabulary written to a temporary directory
+    vocab_dir = Path(tempfile.mkdtemp(prefix="tiny_clip_"))
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1, "!": 2}
+    for char in "abcdefghijklmnopqrstuvwxyz,.0123456789-":
+        vocab.setdefault(char, len(vocab))
+        vocab.setdefault(f"{char}</w>", len(vocab))
+    (vocab_dir / "vocab.json").write_text(json.dumps(vocab))
+    (vocab_dir / "merges.txt").write_text("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(str(vocab_dir / "vocab.json"), str(vocab_dir / "merges.txt"), model_max_length=77)
+
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        vocab_size=len(vocab), hidden_size=32, intermediate_size=64,
+        num_attention_heads=4, num_hidden_layers=2, max_position_embeddings=77,
+        bos_token_id=0, eos_token_id=1, pad_token_id=1
+    ))
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64), layers_per_block=1, sample_size=8,
+        in_channels=4, out_channels=4, cross_attention_dim=32, norm_num_groups=8,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D")
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[16, 16, 32, 32], in_channels=3, out_channels=3, latent_channels=4,
+        norm_num_groups=8,
+        down_block_types=["DownEncoderBlock2D"] * 4, up_block_types=["UpDecoderBlock2D"] * 4
+    )
+    scheduler = PNDMScheduler(
+        beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear", skip_prk_steps=True
+    )
+
+    return {
+        "unet": unet.eval(),
+        "vae": vae.eval(),
+        "text_encoder": text_encoder.eval(),
+        "tokenizer": tokenizer,
+        "scheduler": scheduler,
+        "safety_checker": None,
+        "feature_extractor": None,
+    }
+
+def use_tiny_model():
+    """Make the model registry serve the tiny components instead of loading weights"""
+    import model_registry
+    from onnx_backend import is_onnx_backend
+
+    if is_onnx_backend():
+        raise SystemExit("The tiny model only supports SD_BACKEND=pytorch")
+
+    model_registry._components = build_tiny_components()
+
+def _peak_rss_mb() -> float:
+    """Peak RSS since the last _reset_peak_rss() (process lifetime where unsupported)"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _reset_peak_rss() -> bool:
+    """Reset the kernel's peak RSS counter (Linux); False if not supported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+def _percentile(sorted_values: list, percentile: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def _summary(latencies: list, images_per_run: int) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "mean_s": round(sum(latencies) / len(latencies), 4),
+        "p50_s": round(_percentile(latencies, 50), 4),
+        "p95_s": round(_percentile(latencies, 95), 4),
+        "p99_s": round(_percentile(latencies, 99), 4),
+        "min_s": round(latencies[0], 4),
+        "images_per_second": round(images_per_run * len(latencies) / sum(latencies), 3),
+    }
+
+def _make_input_image(size: int) -> bytes:
+    """A JPEG photo stand-in: gradient with some structure, larger than the target size"""
+    from PIL import Image, ImageDraw
+
+    image = Image.linear_gradient("L").resize((size * 2, size * 2)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((size // 2, size // 2, size * 3 // 2, size * 3 // 2), fill=(200, 80, 60))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+def run_case(kind: str, batch_size: int, settings, threads: int, runs: int, warmup: int) -> dict:
+    """
+    Time one configuration end to end: prompt refinement (stubbed Gemini),
+    inference and image encoding
+
+    Returns:
+        Dictionary with the configuration, latency summary and peak RSS
+    """
+    import torch
+    from gemini_prompt import refine_prompt_with_gemini
+    from diffusion_engine import generate_images_batch
+    from img2img_engine import convert_image_to_styles
+    from latent_cache import latent_cache
+    from image_store import image_store
+
+    torch.set_num_threads(threads)
+    client = StubGeminiClient()
+    image_bytes = _make_input_image(settings.image_size)
+    styles = list(itertools.islice(itertools.cycle(IMG2IMG_STYLES), batch_size))
+
+    def run_once(seed: int):
+        if kind == "txt2img":
+            prompt = refine_prompt_with_gemini(BENCHMARK_PROMPT, client=client, use_cache=False)
+            filenames = generate_images_batch(
+                prompts=[prompt] * batch_size,
+                seeds=[seed * batch_size + index for index in range(batch_size)],
+                settings=settings
+            )
+        else:
+            latent_cache.clear()  # Measure the full decode + VAE encode path every run
+            filenames = list(convert_image_to_styles(image_bytes, styles, settings=settings).values())
+        for filename in filenames:
+            image_store.wait(filename)
+
+    for seed in range(warmup):
+        run_once(seed)
+
+    peak_reset = _reset_peak_rss()
+    latencies = []
+    for seed in range(warmup, warmup + runs):
+        started = time.perf_counter()
+        run_once(seed)
+        latencies.append(time.perf_counter() - started)
+
+    return {
+        "kind": kind,
+        "batch_size": batch_size,
+        "steps": settings.steps,
+        "image_size": settings.image_size,
+        "scheduler": settings.scheduler,
+        "threads": threads,
+        "runs": runs,
+        **_summary(latencies, len(styles) if kind == "img2img" else batch_size),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "peak_rss_scope": "case" if peak_reset else "process",
+    }
+
+def case_key(result: dict) -> tuple:
+    """Identifies a configuration across result files"""
+    return tuple(result[field] for field in ("kind", "batch_size", "steps", "image_size", "scheduler", "threads"))
+
+def compare_results(baseline: dict, current: dict) -> list:
+    """
+    Match configurations of two result files
+
+    Returns:
+        Per-configuration p50 latency and throughput ratios (current / baseline)
+    """
+    baseline_cases = {case_key(result): result for result in baseline.get("results", [])}
+    comparison = []
+    for result in current["results"]:
+        previous = baseline_cases.get(case_key(result))
+        if previous is None:
+            continue
+        comparison.append({
+            "case": dict(zip(("kind", "batch_size", "steps", "image_size", "scheduler", "threads"), case_key(result))),
+            "p50_ratio": round(result["p50_s"] / previous["p50_s"], 3),
+            "images_per_second_ratio": round(result["images_per_second"] / previous["images_per_second"], 3),
+            "peak_rss_mb_delta": round(result["peak_rss_mb"] - previous["peak_rss_mb"], 1),
+        })
+    return comparison
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _environment(model: str) -> dict:
+    import torch
+    import diffusers
+    from onnx_backend import get_backend_name
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "model": model,
+        "backend": get_backend_name(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "diffusers": diffusers.__version__,
+        "cpu_count": os.cpu_count(),
+        "machine": platform.machine(),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the txt2img and img2img engines")
+    parser.add_argument("--model", choices=list(DEFAULT_GRID), default="tiny", help="Tiny random model (offline) or real weights")
+    parser.add_argument("--kinds", nargs="+", choices=["txt2img", "img2img"], default=["txt2img", "img2img"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, help="Images per call (img2img: number of styles, max 4)")
+    parser.add_argument("--steps", nargs="+", type=int, help="Denoising steps")
+    parser.add_argument("--sizes", nargs="+", type=int, help="Square image sizes (multiples of 8)")
+    parser.add_argument("--schedulers", nargs="+", default=["dpm++"], help="Scheduler variants")
+    parser.add_argument("--threads", nargs="+", type=int, help="torch intra-op thread counts (default: all cores)")
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs per configuration")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per configuration")
+    parser.add_argument("--output", help="JSON results file (default: benchmarks/<commit>-<model>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    grid = DEFAULT_GRID[args.model]
+    batch_sizes = args.batch_sizes or grid["batch_sizes"]
+    step_counts = args.steps or grid["steps"]
+    sizes = args.sizes or grid["sizes"]
+    thread_counts = args.threads or [os.cpu_count() or 1]
+
+    output_path = Path(args.output or Path(__file__).resolve().parent / "benchmarks" / f"{_git_commit()}-{args.model}.json").resolve()
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    # Generated images, caches and calibration go to a scratch directory
+    workdir = tempfile.mkdtemp(prefix="ai_service_benchmark_")
+    os.chdir(workdir)
+    os.environ.setdefault("CALIBRATE_TIERS", "0")
+
+    from quality_tiers import QualitySettings
+
+    if args.model == "tiny":
+        use_tiny_model()
+
+    results = []
+    try:
+        for kind, batch_size, steps, size, scheduler, threads in itertools.product(
+            args.kinds, batch_sizes, step_counts, sizes, args.schedulers, thread_counts
+        ):
+            if kind == "img2img" and batch_size > len(IMG2IMG_STYLES):
+                continue
+            settings = QualitySettings(steps=steps, image_size=size, scheduler=scheduler, tier="benchmark")
+            print(
+                f"{kind}: batch {batch_size}, {steps} steps, {size}px, {scheduler}, {threads} thread(s)...",
+                file=sys.stderr
+            )
+            results.append(run_case(kind, batch_size, settings, threads, args.runs, args.warmup))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"environment": _environment(args.model), "results": results}
+    if baseline is not None:
+        report["comparison"] = {
+            "baseline_commit": baseline.get("environment", {}).get("commit"),
+            "cases": compare_results(baseline, report)
+        }
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
+    print(f"Results written to {output_path}", file=sys.stderr)
@@ -0,0 +1,100 @@
+"""
+Inference Backend Benchmark
+Compares PyTorch, ONNX Runtime and ONNX Runtime with an int8 UNet on the
+same prompts: model load time, latency percentiles and peak memory
+
+Each backend runs in its own subprocess so load time and peak RSS are not
+polluted by the previous backend.
+
+Usage:
+    python benchmark_backends.py [--runs 3] [--backends pytorch onnx onnx-int8]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+from benchmark import _peak_rss_mb, _summary
+
+# Environment for each backend (SD_BACKEND is read at import time)
+BACKEND_ENV = {
+    "pytorch": {"SD_BACKEND": "pytorch"},
+    "onnx": {"SD_BACKEND": "onnx", "ONNX_QUANTIZE_UNET": "0"},
+    "onnx-int8": {"SD_BACKEND": "onnx", "ONNX_QUANTIZE_UNET": "1"},
+}
+
+BENCHMARK_PROMPT = (
+    "A simple red apple on a white background, "
+    "professional product photography, no text, no watermark"
+)
+
+def run_single_backend(runs: int) -> dict:
+    """Benchmark the backend selected by the current environment"""
+    from PIL import Image
+    import io
+
+    from diffusion_engine import load_diffusion_model, generate_image_with_diffusion
+    from img2img_engine import load_img2img_model, convert_image_to_style
+    from onnx_backend import get_backend_name
+
+    started = time.perf_counter()
+    load_diffusion_model()
+    load_img2img_model()
+    load_time = time.perf_counter() - started
+
+    txt2img_times = []
+    for run in range(runs):
+        started = time.perf_counter()
+        generate_image_with_diffusion(BENCHMARK_PROMPT, seed=run)
+        txt2img_times.append(time.perf_counter() - started)
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (512, 512), (200, 80, 60)).save(buffer, format="PNG")
+    image_bytes = buffer.getvalue()
+
+    img2img_times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        convert_image_to_style(image_bytes, "cartoon")
+        img2img_times.append(time.perf_counter() - started)
+
+    return {
+        "backend": get_backend_name(),
+        "load_time_s": round(load_time, 2),
+        "txt2img": _summary(txt2img_times, 1),
+        "img2img": _summary(img2img_times, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+def run_benchmarks(backends: list, runs: int) -> list:
+    """Run every backend in a fresh subprocess and collect the reports"""
+    reports = []
+    for backend in backends:
+        print(f"Benchmarking {backend} ({runs} run(s))...", file=sys.stderr)
+        env = dict(os.environ, **BACKEND_ENV[backend])
+        completed = subprocess.run(
+            [sys.executable, __file__, "--single", "--runs", str(runs)],
+            env=env,
+            capture_output=True,
+            text=True
+        )
+        if completed.returncode != 0:
+            reports.append({"backend": backend, "error": completed.stderr.strip().splitlines()[-1:]})
+            continue
+        reports.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return reports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Stable Diffusion inference backends")
+    parser.add_argument("--runs", type=int, default=3, help="Generations per pipeline")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKEND_ENV), default=list(BACKEND_ENV))
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single_backend(args.runs)))
+    else:
+        print(json.dumps(run_benchmarks(args.backends, args.runs), indent=2))
@@ -0,0 +1,196 @@
+"""
+CPU Fast Path Benchmark
+Compares the default fp32 CPU path with CPU_FAST_PATH=1 (channels-last,
+torch.compile, bf16 autocast where supported) on the same prompts and
+seeds: first-call (compile) time, latency percentiles, and how close the
+fast path's images are to the baseline's (PSNR and mean absolute error)
+
+Each mode runs in its own subprocess, since the fast path is configured at
+import time. The run fails (exit code 1) if any image pair is below
+--min-psnr, so it can gate enabling the fast path on new hardware.
+
+Usage:
+    python benchmark_fastpath.py [--model tiny|real] [--runs 3]
+                                 [--modes baseline fast fast-fp32]
+                                 [--steps 20] [--size 512] [--min-psnr 25]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+from benchmark import BENCHMARK_PROMPT, StubGeminiClient, use_tiny_model, _make_input_image, _summary
+
+# Environment for each mode (the fast path settings are read at import time)
+MODE_ENV = {
+    "baseline": {"CPU_FAST_PATH": "0"},
+    "fast": {"CPU_FAST_PATH": "1"},
+    "fast-fp32": {"CPU_FAST_PATH": "1", "CPU_BF16": "0"},
+}
+BASELINE_MODE = "baseline"
+
+# Compiled artifacts persist here between benchmark runs, as they do for the service
+COMPILE_CACHE_DIR = Path(__file__).resolve().parent / "cache" / "torch_compile"
+
+def run_single_mode(model: str, kinds: list, steps: int, size: int, runs: int, image_dir: Path) -> dict:
+    """
+    Benchmark the mode selected by the current environment
+
+    Every run uses seed = run index, and each output image is copied to
+    image_dir/<kind>-<seed>.png for the similarity check.
+    """
+    import torch
+    import model_registry
+    from cpu_fastpath import apply_cpu_fast_path, get_fast_path_status
+    from quality_tiers import QualitySettings
+    from gemini_prompt import refine_prompt_with_gemini
+    from diffusion_engine import generate_image_with_diffusion
+    from img2img_engine import convert_image_to_style
+    from latent_cache import latent_cache
+    from image_store import image_store, IMAGES_DIR
+
+    if model == "tiny":
+        use_tiny_model()
+        apply_cpu_fast_path(model_registry._components)  # The registry's loader is bypassed
+
+    settings = QualitySettings(steps=steps, image_size=size, scheduler=model_registry.DEFAULT_SCHEDULER, tier="benchmark")
+    prompt = refine_prompt_with_gemini(BENCHMARK_PROMPT, client=StubGeminiClient(), use_cache=False)
+    image_bytes = _make_input_image(size)
+    image_dir.mkdir(parents=True, exist_ok=True)
+
+    def run_once(kind: str, seed: int):
+        if kind == "txt2img":
+            filename = generate_image_with_diffusion(prompt, seed=seed, settings=settings)
+        else:
+            latent_cache.clear()  # Measure the VAE encode every run
+            torch.manual_seed(seed)  # The img2img noise comes from the global generator
+            filename = convert_image_to_style(image_bytes, "cartoon", settings=settings)
+        image_store.wait(filename)
+        shutil.copyfile(IMAGES_DIR / filename, image_dir / f"{kind}-{seed}.png")
+
+    report = {"status": get_fast_path_status()}
+    for kind in kinds:
+        # The first call compiles (or loads compiled graphs from the cache)
+        started = time.perf_counter()
+        run_once(kind, 0)
+        first_call = time.perf_counter() - started
+
+        latencies = []
+        for seed in range(runs):
+            started = time.perf_counter()
+            run_once(kind, seed)
+            latencies.append(time.perf_counter() - started)
+
+        report[kind] = {"first_call_s": round(first_call, 3), **_summary(latencies, 1)}
+
+    return report
+
+def compare_images(baseline_dir: Path, candidate_dir: Path) -> dict:
+    """
+    PSNR (dB) and mean absolute error (0-255) of each image pair
+
+    Returns:
+        Dictionary with per-image scores and the worst PSNR
+    """
+    import numpy as np
+    from PIL import Image
+
+    images = {}
+    for baseline_path in sorted(baseline_dir.glob("*.png")):
+        candidate_path = candidate_dir / baseline_path.name
+        if not candidate_path.exists():
+            continue
+        reference = np.asarray(Image.open(baseline_path).convert("RGB"), dtype=np.float64)
+        candidate = np.asarray(Image.open(candidate_path).convert("RGB"), dtype=np.float64)
+        mse = float(np.mean((reference - candidate) ** 2))
+        images[baseline_path.stem] = {
+            "psnr_db": round(float(10 * np.log10(255 ** 2 / mse)), 2) if mse > 0 else float("inf"),
+            "mean_abs_error": round(float(np.mean(np.abs(reference - candidate))), 3),
+        }
+
+    return {
+        "images": images,
+        "min_psnr_db": min((scores["psnr_db"] for scores in images.values()), default=None),
+    }
+
+def run_benchmarks(args) -> dict:
+    """Run every mode in a fresh subprocess, then compare each mode's images with the baseline's"""
+    workdir = Path(tempfile.mkdtemp(prefix="ai_service_fastpath_"))
+    modes = [BASELINE_MODE] + [mode for mode in args.modes if mode != BASELINE_MODE]
+    reports = {}
+
+    try:
+        for mode in modes:
+            print(f"Benchmarking {mode} ({args.runs} run(s))...", file=sys.stderr)
+            env = dict(
+                os.environ,
+                CALIBRATE_TIERS="0",
+                TORCH_COMPILE_CACHE_DIR=os.environ.get("TORCH_COMPILE_CACHE_DIR", str(COMPILE_CACHE_DIR)),
+                **MODE_ENV[mode]
+            )
+            completed = subprocess.run(
+                [
+                    sys.executable, str(Path(__file__).resolve()), "--single",
+                    "--model", args.model, "--kinds", *args.kinds, "--steps", str(args.steps),
+                    "--size", str(args.size), "--runs", str(args.runs),
+                    "--image-dir", str(workdir / "images" / mode),
+                ],
+                env=env,
+                cwd=workdir,
+                capture_output=True,
+                text=True
+            )
+            if completed.returncode != 0:
+                reports[mode] = {"error": completed.stderr.strip().splitlines()[-1:]}
+                continue
+            reports[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+        baseline = reports.get(BASELINE_MODE, {})
+        for mode in modes[1:]:
+            if "error" in reports[mode] or "error" in baseline:
+                continue
+            similarity = compare_images(workdir / "images" / BASELINE_MODE, workdir / "images" / mode)
+            similarity["passed"] = similarity["min_psnr_db"] is not None and similarity["min_psnr_db"] >= args.min_psnr
+            reports[mode]["similarity"] = similarity
+            reports[mode]["speedup"] = {
+                kind: round(baseline[kind]["mean_s"] / reports[mode][kind]["mean_s"], 2)
+                for kind in args.kinds
+            }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return reports
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the default and fast CPU inference paths")
+    parser.add_argument("--model", choices=["tiny", "real"], default="tiny", help="Tiny random model (offline) or real weights")
+    parser.add_argument("--modes", nargs="+", choices=list(MODE_ENV), default=list(MODE_ENV))
+    parser.add_argument("--kinds", nargs="+", choices=["txt2img", "img2img"], default=["txt2img", "img2img"])
+    parser.add_argument("--steps", type=int, default=20, help="Denoising steps")
+    parser.add_argument("--size", type=int, help="Square image size (default: 64 tiny, 512 real)")
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs per pipeline")
+    parser.add_argument("--min-psnr", type=float, default=25.0, help="Lowest acceptable PSNR against the baseline (dB)")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--image-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.size = args.size or (64 if args.model == "tiny" else 512)
+
+    if args.single:
+        report = run_single_mode(args.model, args.kinds, args.steps, args.size, args.runs, Path(args.image_dir))
+        print(json.dumps(report))
+    else:
+        reports = run_benchmarks(args)
+        print(json.dumps(reports, indent=2))
+        failed = [
+            mode for mode, report in reports.items()
+            if "error" in report or not report.get("similarity", {}).get("passed", True)
+        ]
+        if failed:
+            print(f"Failed or below --min-psnr {args.min_psnr} against the baseline: {', '.join(failed)}", file=sys.stderr)
+            sys.exit(1)
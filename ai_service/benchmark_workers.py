@@ -0,0 +1,117 @@
+"""
+Worker Split Benchmark
+Measures throughput and latency of the core-partitioned inference pool for
+every workers x threads split of this machine's cores
+
+Few workers with many threads give the lowest latency per image; more
+workers with fewer threads usually give the most images per minute. The
+report shows where that trade-off lands on this host.
+
+Usage:
+    python benchmark_workers.py [--requests 16] [--quality draft] [--splits 1x32 2x16 4x8]
+"""
+
+import sys
+import json
+import time
+import argparse
+
+from worker_pool import InferenceWorkerPool, TASK_GENERATE_BATCH, get_available_cores
+from quality_tiers import get_tier_settings
+from benchmark import _percentile
+
+BENCHMARK_PROMPT = (
+    "A simple red apple on a white background, "
+    "professional product photography, no text, no watermark"
+)
+
+def default_splits(num_cores: int) -> list:
+    """(workers, threads) pairs that use every core: 1xN, 2xN/2, 4xN/4, ... down to 2 threads"""
+    splits = []
+    workers = 1
+    while workers <= num_cores and num_cores // workers >= 2:
+        splits.append((workers, num_cores // workers))
+        workers *= 2
+    return splits or [(1, num_cores)]
+
+def parse_split(text: str) -> tuple:
+    workers, threads = text.lower().split("x")
+    return int(workers), int(threads)
+
+def benchmark_split(workers: int, threads: int, num_requests: int, settings) -> dict:
+    """
+    Start a pool with this split, wait until it is warm, then submit every
+    request at once and time each one from submission to completion
+    """
+    pool = InferenceWorkerPool(num_workers=workers, threads_per_worker=threads)
+    started = time.perf_counter()
+    pool.start()
+    try:
+        pool.wait_ready()
+        load_seconds = time.perf_counter() - started
+
+        submitted_at = {}
+        futures = []
+        burst_started = time.perf_counter()
+        for index in range(num_requests):
+            submitted_at[index] = time.perf_counter()
+            futures.append(pool.submit(
+                TASK_GENERATE_BATCH,
+                prompts=[BENCHMARK_PROMPT],
+                seeds=[index],
+                settings=settings
+            ))
+
+        latencies = []
+        pending = dict(enumerate(futures))
+        while pending:
+            for index, future in list(pending.items()):
+                if future.done():
+                    future.result()  # Raise worker errors
+                    latencies.append(time.perf_counter() - submitted_at[index])
+                    del pending[index]
+            time.sleep(0.01)
+        wall_seconds = time.perf_counter() - burst_started
+    finally:
+        pool.stop()
+
+    latencies.sort()
+    return {
+        "workers": workers,
+        "threads_per_worker": threads,
+        "load_seconds": round(load_seconds, 1),
+        "images_per_minute": round(num_requests / wall_seconds * 60, 2),
+        "latency_s": {
+            "p50": round(_percentile(latencies, 50), 2),
+            "p95": round(_percentile(latencies, 95), 2),
+            "min": round(latencies[0], 2),
+        },
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the best workers x threads split")
+    parser.add_argument("--requests", type=int, default=16, help="Requests per split (submitted at once)")
+    parser.add_argument("--quality", default="draft", help="Quality tier used for every request")
+    parser.add_argument("--splits", nargs="+", type=parse_split, help="Splits as WORKERSxTHREADS")
+    args = parser.parse_args()
+
+    cores = len(get_available_cores())
+    splits = args.splits or default_splits(cores)
+    settings = get_tier_settings("txt2img", args.quality)
+
+    results = []
+    for workers, threads in splits:
+        print(f"Benchmarking {workers} worker(s) x {threads} thread(s)...", file=sys.stderr)
+        results.append(benchmark_split(workers, threads, args.requests, settings))
+
+    best_throughput = max(results, key=lambda r: r["images_per_minute"])
+    best_latency = min(results, key=lambda r: r["latency_s"]["p50"])
+
+    print(json.dumps({
+        "cores": cores,
+        "quality": args.quality,
+        "requests": args.requests,
+        "results": results,
+        "best_throughput": f"{best_throughput['workers']}x{best_throughput['threads_per_worker']}",
+        "best_latency": f"{best_latency['workers']}x{best_latency['threads_per_worker']}",
+    }, indent=2))
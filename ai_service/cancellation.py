@@ -0,0 +1,126 @@
+"""
+Cancellation Module
+Per-request cancel tokens checked by the engines between denoising steps,
+so a generation whose client disconnected (or whose job was cancelled)
+stops right away instead of running to the last step
+"""
+
+import time
+import threading
+import logging
+from typing import Callable, Optional
+
+from batch_scheduler import GenerationCancelled
+from metrics import registry, Counter
+
+logger = logging.getLogger(__name__)
+
+# Cancellation reasons (metric label values)
+REASON_CLIENT_DISCONNECT = "client_disconnect"
+REASON_JOB_CANCELLED = "job_cancelled"
+
+cancelled_requests_total = registry.register(Counter(
+    "cancelled_requests",
+    "Requests and jobs cancelled before they finished, by reason",
+    ["reason"]
+))
+cancelled_steps_total = registry.register(Counter(
+    "cancelled_denoising_steps",
+    "Denoising steps skipped because every request of a pipeline call was cancelled, by pipeline kind",
+    ["kind"]
+))
+
+class CancelToken:
+    """
+    Cancellation flag shared between a request and the pipeline running it
+
+    The request side calls cancel(); the engines read `cancelled` after
+    every denoising step. A token can also follow an external flag (e.g. the
+    job queue's cancel column, or a flag set by another process): `check`
+    is then polled at most every poll_seconds.
+    """
+
+    def __init__(
+        self,
+        check: Optional[Callable[[], bool]] = None,
+        poll_seconds: float = 0.0,
+        check_reason: str = REASON_JOB_CANCELLED
+    ):
+        """
+        Args:
+            check: Optional callable returning True once the work is cancelled elsewhere
+            poll_seconds: Minimum time between two calls of check
+            check_reason: Reason recorded when check reports the cancellation
+        """
+        self.check = check
+        self.poll_seconds = poll_seconds
+        self.check_reason = check_reason
+        self.reason = None
+
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._next_poll = 0.0
+
+    def cancel(self, reason: str = REASON_CLIENT_DISCONNECT) -> bool:
+        """
+        Cancel the work (the first reason wins)
+
+        Returns:
+            True if this call cancelled it, False if it already was
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+
+        cancelled_requests_total.inc(reason=reason)
+        logger.info(f"Request cancelled ({reason})")
+        return True
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self.check is None:
+            return False
+
+        now = time.monotonic()
+        if now < self._next_poll:
+            return False
+        self._next_poll = now + self.poll_seconds
+
+        try:
+            if self.check():
+                self.cancel(self.check_reason)
+                return True
+        except Exception as e:
+            logger.warning(f"Cancellation check failed: {str(e)}")
+        return False
+
+    def keep_going(self, step: int, total_steps: int, latents) -> bool:
+        """Step callback for generate_images_batch: stop once cancelled"""
+        return not self.cancelled
+
+def raise_if_cancelled(token: Optional[CancelToken], kind: str, completed_steps: int, total_steps: int):
+    """
+    Abort a pipeline call whose request was cancelled
+
+    Args:
+        token: The request's token (None = not cancellable)
+        kind: Pipeline kind ("txt2img" or "img2img"), for the metrics
+        completed_steps: Denoising steps done so far
+        total_steps: Denoising steps of the full run
+
+    Raises:
+        GenerationCancelled: If the token is cancelled
+    """
+    if token is not None and token.cancelled:
+        record_cancelled_steps(kind, completed_steps, total_steps)
+        raise GenerationCancelled(
+            f"{kind} cancelled ({token.reason}) at step {completed_steps}/{total_steps}"
+        )
+
+def record_cancelled_steps(kind: str, completed_steps: int, total_steps: int):
+    """Count the denoising steps a cancellation saved"""
+    cancelled_steps_total.inc(max(0, total_steps - completed_steps), kind=kind)
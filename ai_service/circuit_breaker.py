@@ -0,0 +1,101 @@
+"""
+Circuit Breaker Module
+Stops calling a failing upstream service for a cool-down period after
+repeated failures, then lets a single probe call through to test recovery
+"""
+
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Breaker states
+STATE_CLOSED = "closed"  # Calls pass through
+STATE_OPEN = "open"  # Calls are skipped until the cool-down ends
+STATE_HALF_OPEN = "half_open"  # One probe call is in flight
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the breaker is open"""
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    After failure_threshold failures in a row the breaker opens and
+    allow() returns False for cooldown_seconds. The first allow() after the
+    cool-down admits one probe: its success closes the breaker, its failure
+    opens it for another cool-down.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, cooldown_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_seconds = cooldown_seconds
+
+        self._state = STATE_CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"successes": 0, "failures": 0, "rejected": 0, "times_opened": 0}
+
+    def allow(self) -> bool:
+        """True if a call may go to the upstream now"""
+        with self._lock:
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.cooldown_seconds:
+                self._state = STATE_HALF_OPEN
+                logger.info(f"Circuit '{self.name}' half-open: probing upstream")
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._stats["successes"] += 1
+            self._consecutive_failures = 0
+            if self._state != STATE_CLOSED:
+                logger.info(f"Circuit '{self.name}' closed: upstream recovered")
+            self._state = STATE_CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._stats["failures"] += 1
+            self._consecutive_failures += 1
+            if self._state == STATE_HALF_OPEN or (
+                self._state == STATE_CLOSED and self._consecutive_failures >= self.failure_threshold
+            ):
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+                self._stats["times_opened"] += 1
+                logger.warning(
+                    f"Circuit '{self.name}' open after {self._consecutive_failures} failure(s); "
+                    f"skipping upstream for {self.cooldown_seconds:.0f}s"
+                )
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def get_stats(self) -> dict:
+        """
+        Get breaker state and counters
+
+        Returns:
+            Dictionary with state, consecutive failures, seconds until the
+            next probe (when open) and call counters
+        """
+        with self._lock:
+            retry_in = None
+            if self._state == STATE_OPEN:
+                retry_in = round(max(0.0, self.cooldown_seconds - (time.monotonic() - self._opened_at)), 1)
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "cooldown_seconds": self.cooldown_seconds,
+                "retry_in_seconds": retry_in,
+                **self._stats
+            }
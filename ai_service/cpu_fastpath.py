@@ -0,0 +1,195 @@
+"""
+CPU Fast Path Module
+Opt-in optimizations for PyTorch inference on CPU: channels-last memory
+format and torch.compile for the UNet and VAE (compiled artifacts cached on
+disk across restarts), and bfloat16 autocast where the CPU supports it;
+each piece falls back to the plain fp32 path when it is not available
+"""
+
+import os
+import logging
+import threading
+from contextlib import nullcontext
+from pathlib import Path
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CPU_FAST_PATH = os.getenv("CPU_FAST_PATH", "0") == "1"  # Opt in to the optimizations below (CPU only)
+CPU_CHANNELS_LAST = os.getenv("CPU_CHANNELS_LAST", "1") == "1"  # NHWC weights/activations for the conv layers
+CPU_TORCH_COMPILE = os.getenv("CPU_TORCH_COMPILE", "1") == "1"  # torch.compile the UNet and VAE
+CPU_BF16 = os.getenv("CPU_BF16", "auto").lower()  # auto (if the CPU has native bf16), 1 (force) or 0
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "cache"))
+COMPILE_CACHE_DIR = Path(os.getenv("TORCH_COMPILE_CACHE_DIR", str(CACHE_DIR / "torch_compile")))
+
+# Modules the fast path applies to (text encoder runs once per prompt and is cached)
+FAST_PATH_MODULES = ("unet", "vae")
+
+_state_lock = threading.Lock()
+_bf16_supported = None  # Probed once per process
+_status = {"channels_last": [], "compiled": [], "fallbacks": {}}
+
+def is_fast_path_enabled() -> bool:
+    """True if the fast path is switched on and inference runs on CPU with PyTorch"""
+    from onnx_backend import is_onnx_backend
+
+    return CPU_FAST_PATH and not is_onnx_backend() and not torch.cuda.is_available()
+
+def _record_fallback(feature: str, error: Exception):
+    with _state_lock:
+        _status["fallbacks"][feature] = str(error)
+    logger.warning(f"CPU fast path: {feature} unavailable, using the default path ({str(error)})")
+
+def bf16_autocast_supported() -> bool:
+    """
+    Whether bfloat16 autocast should be used on this CPU
+
+    With CPU_BF16=auto only CPUs with native bf16 instructions (AVX512-BF16,
+    AMX) qualify; elsewhere bf16 is emulated and slower than fp32. A small
+    autocast matmul is run once to make sure the kernels work.
+    """
+    global _bf16_supported
+
+    if _bf16_supported is not None:
+        return _bf16_supported
+
+    supported = CPU_BF16 != "0"
+    if supported and CPU_BF16 == "auto":
+        try:
+            supported = bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+        except (AttributeError, RuntimeError):
+            supported = False
+
+    if supported:
+        try:
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                probe = torch.ones(8, 8) @ torch.ones(8, 8)
+            if probe.dtype != torch.bfloat16:
+                raise RuntimeError(f"autocast produced {probe.dtype}")
+        except Exception as e:
+            _record_fallback("bf16", e)
+            supported = False
+
+    _bf16_supported = supported
+    return supported
+
+def fast_path_autocast():
+    """
+    Context manager to run pipeline calls in
+
+    bfloat16 autocast when the fast path is on and the CPU supports it,
+    otherwise a no-op.
+    """
+    if is_fast_path_enabled() and bf16_autocast_supported():
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return nullcontext()
+
+def get_fast_path_tag() -> str:
+    """
+    Suffix for cache keys and calibration hosts
+
+    The fast path changes timings and, with bf16, the exact pixels a seed
+    produces, so results and measurements from either path are kept apart.
+    """
+    if not is_fast_path_enabled():
+        return ""
+    return "+fast-bf16" if bf16_autocast_supported() else "+fast"
+
+def _configure_compile_cache():
+    """Persist Inductor's compiled kernels and FX graphs so restarts skip recompiling"""
+    COMPILE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(COMPILE_CACHE_DIR.resolve()))
+
+    import torch._dynamo
+    import torch._inductor.config as inductor_config
+
+    inductor_config.fx_graph_cache = True
+    if hasattr(inductor_config, "autograd_cache"):
+        inductor_config.autograd_cache = True
+
+    # A graph that fails to compile runs eagerly instead of failing the request
+    torch._dynamo.config.suppress_errors = True
+
+def _compile_module(module: torch.nn.Module):
+    """Compile a module in place, so the pipelines keep seeing the original class"""
+    if hasattr(module, "compile"):
+        module.compile()
+    else:
+        module.forward = torch.compile(module.forward)
+
+def apply_cpu_fast_path(components: dict) -> dict:
+    """
+    Apply the enabled optimizations to freshly loaded pipeline components
+
+    Called by the model registry after every load (weights may be evicted
+    and reloaded). Compilation is lazy: the first pipeline call of each
+    shape compiles (or reads the on-disk cache), which the warm-up covers.
+
+    Args:
+        components: Pipeline components on the CPU (modified in place)
+
+    Returns:
+        The same components dictionary
+    """
+    if not is_fast_path_enabled():
+        return components
+
+    with _state_lock:
+        _status["channels_last"] = []
+        _status["compiled"] = []
+
+    modules = {
+        name: components[name]
+        for name in FAST_PATH_MODULES
+        if isinstance(components.get(name), torch.nn.Module)
+    }
+
+    if CPU_CHANNELS_LAST:
+        for name, module in modules.items():
+            try:
+                module.to(memory_format=torch.channels_last)
+                _status["channels_last"].append(name)
+            except Exception as e:
+                _record_fallback(f"channels_last:{name}", e)
+
+    if CPU_TORCH_COMPILE:
+        try:
+            _configure_compile_cache()
+        except Exception as e:
+            _record_fallback("compile_cache", e)
+
+        for name, module in modules.items():
+            try:
+                _compile_module(module)
+                _status["compiled"].append(name)
+            except Exception as e:
+                _record_fallback(f"compile:{name}", e)
+
+    logger.info(
+        f"✓ CPU fast path: channels-last {_status['channels_last'] or 'off'}, "
+        f"compiled {_status['compiled'] or 'off'}, bf16 autocast {'on' if bf16_autocast_supported() else 'off'}"
+    )
+    return components
+
+def get_fast_path_status() -> dict:
+    """
+    Get the fast path configuration and what actually took effect
+
+    Returns:
+        Dictionary with the enabled flag, optimized modules, bf16 state,
+        compile cache directory and fallback reasons
+    """
+    enabled = is_fast_path_enabled()
+    bf16 = enabled and bf16_autocast_supported()
+    with _state_lock:
+        return {
+            "enabled": enabled,
+            "requested": CPU_FAST_PATH,
+            "channels_last": list(_status["channels_last"]),
+            "compiled": list(_status["compiled"]),
+            "bf16_autocast": bf16,
+            "compile_cache_dir": str(COMPILE_CACHE_DIR) if enabled and CPU_TORCH_COMPILE else None,
+            "fallbacks": dict(_status["fallbacks"]),
+        }
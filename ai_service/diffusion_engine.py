@@ -4,136 +4,314 @@ Generates images using open-source Stable Diffusion model
 """
 
 import torch
-from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
 from PIL import Image
 import os
-from pathlib import Path
-from datetime import datetime
+from typing import Callable, List, Optional
 import logging
+import random
+import time
+
+from model_registry import MODEL_ID, DEFAULT_SCHEDULER, get_pipeline, build_pipeline, get_device
+from onnx_backend import get_backend_name, is_onnx_pipeline, make_initial_latents
+from quality_tiers import QualitySettings, get_tier_settings, tier_calibrator
+from batch_scheduler import GenerationCancelled
+from cancellation import CancelToken, record_cancelled_steps
+from cpu_fastpath import fast_path_autocast, get_fast_path_tag, get_fast_path_status
+from embedding_cache import embedding_cache
+from result_cache import make_result_key
+from image_store import image_store, IMAGES_DIR
+from metrics import PipelineTimer
+from residency import residency
 
 logger = logging.getLogger(__name__)
 
-# Configuration
-MODEL_ID = "runwayml/stable-diffusion-v1-5"  # Free, open-source model
-IMAGES_DIR = Path("generated_images")
+# Configuration (defaults = the "standard" quality tier; requests may pick another tier)
 IMAGE_SIZE = 512  # 512x512 for performance
 NUM_INFERENCE_STEPS = 30  # Balance between quality and speed
 GUIDANCE_SCALE = 7.5  # How closely to follow the prompt
+CALIBRATION_PROMPT = "a photo of a red apple on a white table"
+
+# Negative prompt to avoid unwanted elements
+DEFAULT_NEGATIVE_PROMPT = (
+    "text, watermark, signature, logo, words, letters, typography, "
+    "low quality, blurry, distorted, deformed, ugly, bad anatomy, "
+    "extra limbs, poorly drawn, amateur"
+)
 
-# Global pipeline variable (loaded once)
-_pipeline = None
+# Per-item step callback: (step, total_steps, latents of this item) -> keep going?
+StepCallback = Callable[[int, int, torch.Tensor], bool]
 
-def load_diffusion_model():
+def load_diffusion_model(scheduler: str = DEFAULT_SCHEDULER):
     """
     Load Stable Diffusion model into memory
-    This is called once and cached for subsequent generations
+    
+    The pipeline is kept by the shared model registry (not here), so the
+    residency manager can unload it when idle; the next call reloads it.
+    The img2img pipeline reuses the same UNet, VAE and text encoder.
+    
+    Args:
+        scheduler: Scheduler variant (quality tiers may pick a non-default one)
     
     Returns:
         StableDiffusionPipeline instance
     """
-    global _pipeline
-    
-    if _pipeline is not None:
-        return _pipeline
-    
-    logger.info("Loading Stable Diffusion model (this may take a few minutes on first run)...")
-    
     try:
-        # Determine device (CUDA if available, else CPU)
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Using device: {device}")
-        
-        # Load the model
-        pipe = StableDiffusionPipeline.from_pretrained(
-            MODEL_ID,
-            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-            safety_checker=None,  # Disable for academic use
-            requires_safety_checker=False
-        )
-        
-        # Use DPM-Solver++ scheduler for faster generation
-        pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
-        
-        # Move to device
-        pipe = pipe.to(device)
-        
-        # Enable memory optimizations for CPU/low-memory systems
-        if device == "cpu":
-            pipe.enable_attention_slicing()
-        
-        _pipeline = pipe
-        logger.info("✓ Stable Diffusion model loaded successfully")
-        
-        return _pipeline
+        return get_pipeline("txt2img", scheduler)
         
     except Exception as e:
         logger.error(f"Failed to load Stable Diffusion model: {str(e)}")
         raise
 
-def generate_image_with_diffusion(prompt: str) -> str:
+def generate_images_batch(
+    prompts: List[str],
+    negative_prompts: Optional[List[Optional[str]]] = None,
+    seeds: Optional[List[Optional[int]]] = None,
+    filenames: Optional[List[Optional[str]]] = None,
+    step_callbacks: Optional[List[Optional[StepCallback]]] = None,
+    settings: Optional[QualitySettings] = None
+) -> List[str]:
     """
-    Generate an image using Stable Diffusion
+    Generate several images in a single batched Stable Diffusion call
+    
+    Each item keeps its own prompt, negative prompt and seed, so requests
+    from different users can share one UNet pass without affecting each
+    other's output.
     
     Args:
-        prompt: Refined text prompt (from Gemini)
+        prompts: Refined text prompts (one per image)
+        negative_prompts: Optional negative prompt per item
+                          (None entries use the default negative prompt)
+        seeds: Optional seed per item (None entries get a random seed)
+        filenames: Optional storage path per item (e.g. a result-cache
+                   path); None entries get a content-hash name
+        step_callbacks: Optional per-item callback called after every
+                        denoising step with that item's latents; returning
+                        False means the caller no longer wants the image
+        settings: Steps, resolution and scheduler shared by the whole batch
+                  (defaults to the "standard" tier)
         
     Returns:
-        Filename of the generated image (saved in generated_images/)
+        List of image paths relative to generated_images/, in the same order as prompts
         
-    Process:
-    1. Load model (if not already loaded)
-    2. Generate image from prompt
-    3. Save image with unique filename
-    4. Return filename
+    Raises:
+        GenerationCancelled: If every item asked to stop (the loop is aborted)
     """
     
+    residency.acquire("txt2img")  # The pipeline is not evicted while the batch runs
     try:
+        batch_size = len(prompts)
+        if batch_size == 0:
+            return []
+        
+        negative_prompts = negative_prompts or [None] * batch_size
+        seeds = seeds or [None] * batch_size
+        filenames = filenames or [None] * batch_size
+        step_callbacks = step_callbacks or [None] * batch_size
+        settings = settings or get_tier_settings("txt2img")
+        steps = settings.steps
+        image_size = settings.image_size
+        
         # Step 1: Load model
-        pipe = load_diffusion_model()
+        pipe = load_diffusion_model(settings.scheduler)
         
-        # Step 2: Generate image
-        logger.info(f"Generating image for prompt: {prompt[:100]}...")
+        # Step 2: Build per-item negative prompts and seeds
+        negative_prompts = [
+            negative_prompt or DEFAULT_NEGATIVE_PROMPT
+            for negative_prompt in negative_prompts
+        ]
+        seeds = [
+            seed if seed is not None else random.randint(0, 2**32 - 1)
+            for seed in seeds
+        ]
         
-        # Add negative prompt to avoid unwanted elements
-        negative_prompt = (
-            "text, watermark, signature, logo, words, letters, typography, "
-            "low quality, blurry, distorted, deformed, ugly, bad anatomy, "
-            "extra limbs, poorly drawn, amateur"
-        )
+        # Per-step hook: fan latents out to item callbacks, abort if nobody is left
+        timer = PipelineTimer()
+        
+        def notify_step(step, latents):
+            timer.step()
+            wanted = batch_size
+            for index, callback in enumerate(step_callbacks):
+                if callback is not None and not callback(step, steps, latents[index:index + 1]):
+                    wanted -= 1
+            if wanted == 0:
+                record_cancelled_steps("txt2img", step + 1, steps)
+                raise GenerationCancelled(f"Generation cancelled at step {step + 1}/{steps}")
         
-        # Generate the image
-        with torch.no_grad():  # Disable gradient calculation for inference
+        logger.info(f"Generating batch of {batch_size} image(s) ({settings.tier}: {steps} steps, {image_size}px)...")
+        
+        if is_onnx_pipeline(pipe):
+            # Step 3/4 (ONNX Runtime): the pipeline encodes prompts itself and
+            # takes numpy latents, so per-item seeds become per-item noise
+            def on_step(step, timestep, latents):
+                notify_step(step, torch.from_numpy(latents))
+            
             result = pipe(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                num_inference_steps=NUM_INFERENCE_STEPS,
+                prompt=prompts,
+                negative_prompt=negative_prompts,
+                num_inference_steps=steps,
                 guidance_scale=GUIDANCE_SCALE,
-                height=IMAGE_SIZE,
-                width=IMAGE_SIZE,
+                height=image_size,
+                width=image_size,
+                latents=make_initial_latents(pipe, seeds, image_size, image_size),
+                callback=on_step,
             )
+        else:
+            generators = [torch.Generator(device="cpu").manual_seed(seed) for seed in seeds]
+            
+            # Step 3: Look up text embeddings (fixed and repeated prompts skip CLIP)
+            prompt_embeds = embedding_cache.get_batch(pipe, prompts, MODEL_ID)
+            negative_prompt_embeds = embedding_cache.get_batch(pipe, negative_prompts, MODEL_ID)
+            
+            def on_step_end(pipeline, step, timestep, callback_kwargs):
+                notify_step(step, callback_kwargs["latents"])
+                return callback_kwargs
+            
+            # Step 4: Generate the images in one pass
+            with torch.no_grad(), fast_path_autocast():  # Disable gradient calculation for inference
+                result = pipe(
+                    prompt_embeds=prompt_embeds,
+                    negative_prompt_embeds=negative_prompt_embeds,
+                    num_inference_steps=steps,
+                    guidance_scale=GUIDANCE_SCALE,
+                    height=image_size,
+                    width=image_size,
+                    generator=generators,
+                    callback_on_step_end=on_step_end,
+                )
         
-        # Extract the generated image
-        image = result.images[0]
-        
-        # Step 3: Save image with unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"ai_generated_{timestamp}.png"
-        filepath = IMAGES_DIR / filename
+        timer.finish()
         
-        # Ensure directory exists
-        IMAGES_DIR.mkdir(exist_ok=True)
+        # Step 5: Hand each image to the store (content-hash name, encoded off-thread)
+        saved_filenames = [
+            image_store.save(image, prefix="ai_generated", relative_path=filename)
+            for image, filename in zip(result.images, filenames)
+        ]
         
-        # Save as PNG
-        image.save(filepath, format="PNG", optimize=True)
+        logger.info(f"✓ Batch of {batch_size} image(s) stored")
         
-        logger.info(f"✓ Image saved: {filename}")
-        
-        # Step 4: Return filename
-        return filename
+        return saved_filenames
         
+    except GenerationCancelled as e:
+        logger.info(str(e))
+        raise
+    
     except Exception as e:
-        logger.error(f"Error generating image: {str(e)}")
+        logger.error(f"Error generating image batch: {str(e)}")
         raise ValueError(f"Image generation failed: {str(e)}")
+    
+    finally:
+        residency.release("txt2img")
+
+def generate_image_with_diffusion(
+    prompt: str,
+    negative_prompt: Optional[str] = None,
+    seed: Optional[int] = None,
+    settings: Optional[QualitySettings] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> str:
+    """
+    Generate an image using Stable Diffusion
+    
+    Args:
+        prompt: Refined text prompt (from Gemini)
+        negative_prompt: Optional negative prompt (defaults to DEFAULT_NEGATIVE_PROMPT)
+        seed: Optional seed for reproducible output
+        settings: Optional quality settings (defaults to the "standard" tier)
+        cancel_token: Optional token checked after every denoising step
+        
+    Returns:
+        Path of the generated image relative to generated_images/
+        
+    Raises:
+        GenerationCancelled: If the token was cancelled before the last step
+        
+    Process:
+    1. Load model (if not already loaded)
+    2. Generate image from prompt
+    3. Store image under a content-hash name
+    4. Return its path
+    """
+    logger.info(f"Generating image for prompt: {prompt[:100]}...")
+    
+    return generate_images_batch(
+        prompts=[prompt],
+        negative_prompts=[negative_prompt],
+        seeds=[seed],
+        step_callbacks=[cancel_token.keep_going] if cancel_token is not None else None,
+        settings=settings
+    )[0]
+
+def get_result_key(
+    prompt: str,
+    seed: int,
+    negative_prompt: Optional[str] = None,
+    settings: Optional[QualitySettings] = None
+) -> str:
+    """
+    Content address of a seeded generation with the given settings
+    
+    Args:
+        prompt: Refined text prompt
+        seed: Generation seed
+        negative_prompt: Optional negative prompt (defaults to DEFAULT_NEGATIVE_PROMPT)
+        settings: Optional quality settings (defaults to the "standard" tier)
+        
+    Returns:
+        Result-cache key (hex SHA-256)
+    """
+    settings = settings or get_tier_settings("txt2img")
+    
+    # Backends produce different pixels for the same seed
+    backend = get_backend_name()
+    model_id = MODEL_ID if backend == "pytorch" else f"{MODEL_ID}@{backend}"
+    model_id += get_fast_path_tag()  # ...and so do the fp32 and bf16 CPU paths
+    
+    return make_result_key(
+        prompt=prompt,
+        negative_prompt=negative_prompt or DEFAULT_NEGATIVE_PROMPT,
+        seed=seed,
+        steps=settings.steps,
+        guidance_scale=GUIDANCE_SCALE,
+        width=settings.image_size,
+        height=settings.image_size,
+        model_id=model_id,
+        scheduler=settings.scheduler
+    )
+
+def calibrate_quality_tiers(force: bool = False):
+    """
+    Measure how long generations take on this host for every tier resolution
+    
+    Uses a private pipeline instance so it can run next to live requests.
+    A stored calibration for the same model, backend and hardware is reused
+    unless force is set.
+    
+    Args:
+        force: Re-measure even if a stored calibration exists
+    """
+    device = get_device()
+    host_key = f"{MODEL_ID}@{get_backend_name()}{get_fast_path_tag()}/{device}/{torch.get_num_threads()}threads"
+    
+    if not force and tier_calibrator.load(host_key, device):
+        return
+    
+    with residency.in_use("txt2img"):
+        pipe = build_pipeline("txt2img")
+        
+        def measure(image_size: int, steps: int) -> float:
+            started = time.perf_counter()
+            with torch.no_grad(), fast_path_autocast():
+                pipe(
+                    prompt=CALIBRATION_PROMPT,
+                    negative_prompt=DEFAULT_NEGATIVE_PROMPT,
+                    num_inference_steps=steps,
+                    guidance_scale=GUIDANCE_SCALE,
+                    height=image_size,
+                    width=image_size,
+                )
+            return time.perf_counter() - started
+        
+        tier_calibrator.calibrate(measure, host_key, device)
 
 def test_image_generation():
     """
@@ -151,6 +329,7 @@ def test_image_generation():
         print("This may take 1-3 minutes on CPU...")
         
         filename = generate_image_with_diffusion(test_prompt)
+        image_store.wait(filename)
         
         print(f"✓ Image generated successfully: {filename}")
         print(f"  Location: {IMAGES_DIR / filename}")
@@ -170,7 +349,10 @@ def get_model_info():
         "image_size": f"{IMAGE_SIZE}x{IMAGE_SIZE}",
         "inference_steps": NUM_INFERENCE_STEPS,
         "guidance_scale": GUIDANCE_SCALE,
+        "quality_tiers": tier_calibrator.get_report()["tiers"]["txt2img"],
         "device": "cuda" if torch.cuda.is_available() else "cpu",
+        "backend": get_backend_name(),
+        "cpu_fast_path": get_fast_path_status(),
         "cuda_available": torch.cuda.is_available()
     }
 
@@ -0,0 +1,135 @@
+"""
+Text Embedding Cache Module
+Caches CLIP text-encoder outputs so fixed style/negative prompts and
+repeated user prompts skip the text encoder
+"""
+
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import Iterable, List
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "256"))  # User-prompt LRU entries
+
+class PromptEmbeddingCache:
+    """
+    Two-level cache of prompt embeddings keyed by (model id, prompt text)
+
+    - Pinned entries: fixed prompts precomputed at startup, never evicted
+    - LRU entries: user prompts, bounded by max_entries
+    """
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_SIZE):
+        self.max_entries = max(0, max_entries)
+        self._pinned = {}
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def _encode(self, pipe, prompt: str) -> torch.Tensor:
+        """Run the text encoder for a single prompt"""
+        with torch.no_grad():
+            prompt_embeds, _ = pipe.encode_prompt(
+                prompt,
+                device=pipe.device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False
+            )
+        return prompt_embeds
+
+    def get(self, pipe, prompt: str, model_id: str) -> torch.Tensor:
+        """
+        Get the embedding for a prompt, encoding it on a miss
+
+        Args:
+            pipe: Any Stable Diffusion pipeline with the model's text encoder
+            prompt: Prompt text
+            model_id: Model identifier (part of the cache key)
+
+        Returns:
+            Tensor of shape (1, tokens, hidden_size)
+        """
+        key = (model_id, prompt)
+
+        with self._lock:
+            if key in self._pinned:
+                self._hits += 1
+                return self._pinned[key]
+            if key in self._lru:
+                self._hits += 1
+                self._lru.move_to_end(key)
+                return self._lru[key]
+            self._misses += 1
+
+        embeds = self._encode(pipe, prompt)
+
+        if self.max_entries > 0:
+            with self._lock:
+                self._lru[key] = embeds
+                self._lru.move_to_end(key)
+                while len(self._lru) > self.max_entries:
+                    self._lru.popitem(last=False)
+
+        return embeds
+
+    def get_batch(self, pipe, prompts: List[str], model_id: str) -> torch.Tensor:
+        """
+        Get embeddings for several prompts stacked along the batch dimension
+
+        Returns:
+            Tensor of shape (len(prompts), tokens, hidden_size)
+        """
+        return torch.cat([self.get(pipe, prompt, model_id) for prompt in prompts], dim=0)
+
+    def precompute(self, pipe, prompts: Iterable[str], model_id: str) -> int:
+        """
+        Encode fixed prompts once and pin them in the cache
+
+        Returns:
+            Number of prompts newly encoded
+        """
+        encoded = 0
+        for prompt in dict.fromkeys(prompts):  # De-duplicate, keep order
+            key = (model_id, prompt)
+            if key in self._pinned:
+                continue
+            embeds = self._encode(pipe, prompt)
+            with self._lock:
+                self._pinned[key] = embeds
+                self._lru.pop(key, None)
+            encoded += 1
+        return encoded
+
+    def clear(self):
+        """Drop every cached embedding (e.g. when the model is unloaded)"""
+        with self._lock:
+            self._pinned.clear()
+            self._lru.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Get cache statistics
+
+        Returns:
+            Dictionary with entry counts and hit/miss counters
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "pinned_entries": len(self._pinned),
+                "lru_entries": len(self._lru),
+                "max_lru_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": (self._hits / lookups) if lookups else 0.0
+            }
+
+# Shared cache used by both engines (they share one text encoder)
+embedding_cache = PromptEmbeddingCache()
@@ -4,51 +4,60 @@ Uses Google's Gemini API to intelligently refine user prompts for image generati
 """
 
 import os
-import google.generativeai as genai
+import re
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from typing import Dict, List, Optional
 import logging
 
+from prompt_cache import PromptRefinementCache, normalize_prompt
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from metrics import registry, Counter, stage_timer
+from lazy_imports import timed_import
+
 logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
-# Configure Gemini API
+# Gemini API key (checked on first use, so the service starts without it
+# and refines prompts with the rule-based fallback)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in .env file")
+GEMINI_MODEL_NAME = "gemini-pro"  # Using gemini-pro for text generation
 
-genai.configure(api_key=GEMINI_API_KEY)
+# Gemini model, created on first use by get_gemini_model()
+model = None
+_model_lock = threading.Lock()
 
-# Initialize Gemini model
-# Using gemini-pro for text generation
-model = genai.GenerativeModel('gemini-pro')
+# Latency bounds for request handling (the Gemini client has no call timeout)
+GEMINI_DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "3"))  # Fall back after this
+GEMINI_HEDGE_AFTER_SECONDS = float(os.getenv("GEMINI_HEDGE_AFTER_SECONDS", "0"))  # Second request after this (0 = off)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))  # Threads for upstream calls
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))  # Consecutive failures to open
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))  # Seconds to skip Gemini
 
-def refine_prompt_with_gemini(user_prompt: str) -> str:
-    """
-    Refine a user's image generation prompt using Gemini AI
-    
-    Purpose:
-    - Improve vague or weak prompts
-    - Add artistic style and quality constraints
-    - Ensure clean, professional design output
-    - Remove ambiguity
-    
-    Args:
-        user_prompt: Raw user input (e.g., "a cat")
-        
-    Returns:
-        Refined prompt optimized for Stable Diffusion
-        
-    Example:
-        Input: "a cat"
-        Output: "A professional photograph of a fluffy orange cat sitting elegantly, 
-                clean white background, no text, no watermark, high quality, 
-                studio lighting, printable design"
-    """
-    
-    # System instruction for Gemini
-    system_instruction = """
+# Bulk refinement: prompts per Gemini call and parallel calls per bulk request
+GEMINI_BULK_CHUNK_SIZE = int(os.getenv("GEMINI_BULK_CHUNK_SIZE", "25"))
+GEMINI_BULK_CONCURRENCY = int(os.getenv("GEMINI_BULK_CONCURRENCY", "2"))
+
+# Skips Gemini after repeated errors or deadline misses
+gemini_breaker = CircuitBreaker("gemini", GEMINI_BREAKER_FAILURES, GEMINI_BREAKER_COOLDOWN)
+
+# Dedicated threads, so calls that hang past their deadline cannot starve the server's threadpool
+_gemini_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="gemini")
+
+refinement_outcomes = registry.register(Counter(
+    "gemini_refinements",
+    "Async prompt refinements by outcome (ok incl. cache hits, hedge, timeout, error, circuit_open)",
+    ["outcome"]
+))
+
+# System instruction for Gemini
+SYSTEM_INSTRUCTION = """
 You are an expert prompt engineer for AI image generation systems.
 
 Your task is to refine user prompts to create high-quality, professional images suitable for templates and certificates.
@@ -84,37 +93,284 @@ Refined: "Professional business handshake between two people in formal attire, c
 
 Now refine the following prompt:
 """
+
+# Terms every refined prompt must contain
+REQUIRED_TERMS = ["no text", "no watermark", "high quality"]
+
+# Refinement cache (in-memory LRU + on-disk store, shared by all requests)
+prompt_cache = PromptRefinementCache()
+
+def get_gemini_model():
+    """
+    Get the Gemini model, importing and configuring the SDK on first use
     
-    try:
-        # Construct the full prompt
-        full_prompt = f"{system_instruction}\n\nUser prompt: \"{user_prompt}\"\n\nRefined prompt:"
+    Returns:
+        google.generativeai GenerativeModel
         
-        # Generate refined prompt using Gemini
-        response = model.generate_content(full_prompt)
+    Raises:
+        ValueError: If GEMINI_API_KEY is not set
+    """
+    global model
+    
+    if model is not None:
+        return model
+    
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY not found in .env file")
+    
+    with _model_lock:
+        if model is None:
+            genai = timed_import("google.generativeai")
+            genai.configure(api_key=GEMINI_API_KEY)
+            model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+            logger.info(f"✓ Gemini client configured ({GEMINI_MODEL_NAME})")
+    
+    return model
+
+def request_prompt_refinement(user_prompt: str, client=None) -> str:
+    """
+    Make one Gemini call to refine a prompt (no caching, no fallback)
+    
+    Args:
+        user_prompt: Raw user input
+        client: Object with a generate_content() method returning a response
+                with a .text attribute (defaults to get_gemini_model();
+                pass a stub to run without network access)
         
-        # Extract refined prompt from response
-        refined_prompt = response.text.strip()
+    Returns:
+        Refined prompt with the required constraint terms present
         
-        # Validation: Ensure refined prompt is not empty
-        if not refined_prompt:
-            logger.warning("Gemini returned empty response, using fallback")
-            return create_fallback_prompt(user_prompt)
+    Raises:
+        ValueError: If Gemini returns an empty response
+        Exception: Any error raised by the client
+    """
+    client = client or get_gemini_model()
+    
+    # Construct the full prompt
+    full_prompt = f"{SYSTEM_INSTRUCTION}\n\nUser prompt: \"{user_prompt}\"\n\nRefined prompt:"
+    
+    # Generate refined prompt using Gemini
+    with stage_timer("gemini_refine"):
+        response = client.generate_content(full_prompt)
+    
+    # Extract refined prompt from response
+    refined_prompt = response.text.strip()
+    
+    # Validation: Ensure refined prompt is not empty
+    if not refined_prompt:
+        logger.warning("Gemini returned empty response")
+        raise ValueError("Gemini returned an empty response")
+    
+    return ensure_required_terms(refined_prompt)
+
+def _record_outcome(call_state: Optional[dict], success: bool):
+    """Report one upstream call to the breaker, at most once per call"""
+    if call_state is not None:
+        with call_state["lock"]:
+            if call_state["recorded"]:
+                return
+            call_state["recorded"] = True
+    if success:
+        gemini_breaker.record_success()
+    else:
+        gemini_breaker.record_failure()
+
+def _new_call_state() -> dict:
+    return {"lock": threading.Lock(), "recorded": False}
+
+def call_gemini(user_prompt: str, client=None, call_state: Optional[dict] = None) -> str:
+    """
+    request_prompt_refinement behind the circuit breaker
+    
+    Errors and answers slower than GEMINI_DEADLINE_SECONDS count as failures.
+    
+    Raises:
+        ValueError: If GEMINI_API_KEY is not set (Gemini is not called)
+        CircuitOpenError: If the breaker is open (Gemini is not called)
+        Exception: Any error of the upstream call
+    """
+    # A missing API key is a configuration error, not an upstream failure
+    client = client or get_gemini_model()
+    if not gemini_breaker.allow():
+        raise CircuitOpenError("Gemini circuit is open")
+    
+    started = time.perf_counter()
+    try:
+        refined_prompt = request_prompt_refinement(user_prompt, client)
+    except Exception:
+        _record_outcome(call_state, success=False)
+        raise
+    
+    _record_outcome(call_state, success=time.perf_counter() - started <= GEMINI_DEADLINE_SECONDS)
+    return refined_prompt
+
+def ensure_required_terms(refined_prompt: str) -> str:
+    """
+    Append any of REQUIRED_TERMS missing from a refined prompt
+    
+    Args:
+        refined_prompt: Prompt returned by Gemini
         
-        # Validation: Ensure key constraints are present
-        required_terms = ["no text", "no watermark", "high quality"]
-        missing_terms = [term for term in required_terms if term.lower() not in refined_prompt.lower()]
+    Returns:
+        Prompt guaranteed to contain the required constraints
+    """
+    missing_terms = [term for term in REQUIRED_TERMS if term.lower() not in refined_prompt.lower()]
+    
+    if missing_terms:
+        logger.warning(f"Gemini output missing terms: {missing_terms}. Adding them.")
+        refined_prompt += f", {', '.join(missing_terms)}, printable design"
+    
+    return refined_prompt
+
+def refine_prompt_with_gemini(user_prompt: str, client=None, use_cache: bool = True) -> str:
+    """
+    Refine a user's image generation prompt using Gemini AI
+    
+    Purpose:
+    - Improve vague or weak prompts
+    - Add artistic style and quality constraints
+    - Ensure clean, professional design output
+    - Remove ambiguity
+    
+    Results are cached by normalized prompt (memory + disk, with TTL), and
+    concurrent requests for the same prompt share one Gemini call. Fallback
+    prompts are never cached, so a transient Gemini error is retried later.
+    
+    Args:
+        user_prompt: Raw user input (e.g., "a cat")
+        client: Optional Gemini client override (e.g. a stub for offline tests)
+        use_cache: Set False to always call Gemini
         
-        if missing_terms:
-            logger.warning(f"Gemini output missing terms: {missing_terms}. Adding them.")
-            refined_prompt += f", {', '.join(missing_terms)}, printable design"
+    Returns:
+        Refined prompt optimized for Stable Diffusion
         
-        return refined_prompt
+    Example:
+        Input: "a cat"
+        Output: "A professional photograph of a fluffy orange cat sitting elegantly, 
+                clean white background, no text, no watermark, high quality, 
+                studio lighting, printable design"
+    """
+    
+    try:
+        if not use_cache:
+            return call_gemini(user_prompt, client)
+        
+        return prompt_cache.get_or_compute(
+            user_prompt,
+            lambda: call_gemini(user_prompt, client)
+        )
+        
+    except CircuitOpenError:
+        logger.info("Gemini circuit open, using rule-based prompt refinement")
+        return create_fallback_prompt(user_prompt)
         
     except Exception as e:
         logger.error(f"Gemini API error: {str(e)}")
         logger.info("Falling back to rule-based prompt refinement")
         return create_fallback_prompt(user_prompt)
 
+def _consume_result(future: asyncio.Future):
+    """Retrieve an abandoned call's outcome so asyncio does not log it as unhandled"""
+    if not future.cancelled():
+        future.exception()
+
+async def refine_prompt_async(
+    user_prompt: str,
+    client=None,
+    deadline: float = GEMINI_DEADLINE_SECONDS,
+    hedge_after: float = GEMINI_HEDGE_AFTER_SECONDS
+) -> str:
+    """
+    Refine a prompt without blocking the event loop, within a hard deadline
+    
+    Cache hits return immediately. Otherwise Gemini is called on a dedicated
+    thread; if no answer arrives within `deadline` seconds the rule-based
+    fallback is returned. The late call keeps running and still fills the
+    cache for the next request. With `hedge_after` > 0, a second request is
+    sent if the first has not answered by then, and the first answer wins.
+    While the circuit breaker is open, Gemini is skipped entirely.
+    
+    Args:
+        user_prompt: Raw user input
+        client: Optional Gemini client override (e.g. a stub for offline tests)
+        deadline: Seconds to wait for Gemini before falling back
+        hedge_after: Seconds before sending a hedged second request (0 = off)
+        
+    Returns:
+        Refined prompt (from cache, Gemini or the fallback)
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    primary_state = _new_call_state()
+    
+    primary = asyncio.wrap_future(_gemini_executor.submit(
+        prompt_cache.get_or_compute,
+        user_prompt,
+        lambda: call_gemini(user_prompt, client, primary_state)
+    ))
+    primary.add_done_callback(_consume_result)
+    
+    pending = {primary}
+    hedged = False
+    outcome = "timeout"
+    
+    while pending:
+        remaining = started + deadline - loop.time()
+        if remaining <= 0:
+            break
+        
+        wait_seconds = remaining
+        if hedge_after > 0 and not hedged:
+            wait_seconds = min(remaining, max(0.0, started + hedge_after - loop.time()))
+        
+        done, pending = await asyncio.wait(pending, timeout=wait_seconds, return_when=asyncio.FIRST_COMPLETED)
+        
+        for task in done:
+            if task.exception() is None:
+                refinement_outcomes.inc(outcome="hedge" if task is not primary else "ok")
+                return task.result()
+            if isinstance(task.exception(), CircuitOpenError):
+                outcome = "circuit_open"
+                logger.info("Gemini circuit open, using rule-based prompt refinement")
+            else:
+                outcome = "error"
+                logger.error(f"Gemini API error: {str(task.exception())}")
+        
+        # Hedge: the first request is slow, send a second one (result cached on success)
+        if hedge_after > 0 and not hedged and pending and loop.time() - started >= hedge_after:
+            hedged = True
+            hedge = asyncio.wrap_future(_gemini_executor.submit(_hedged_request, user_prompt, client))
+            hedge.add_done_callback(_consume_result)
+            pending.add(hedge)
+    
+    if pending:
+        # Deadline passed: count it against Gemini now, even if the call later succeeds
+        _record_outcome(primary_state, success=False)
+        logger.warning(f"Gemini did not answer within {deadline:.1f}s, using rule-based prompt refinement")
+    
+    refinement_outcomes.inc(outcome=outcome)
+    return create_fallback_prompt(user_prompt)
+
+def _hedged_request(user_prompt: str, client=None) -> str:
+    """Second, independent Gemini call for a slow request; caches its answer"""
+    refined_prompt = call_gemini(user_prompt, client, _new_call_state())
+    prompt_cache.put(user_prompt, refined_prompt)
+    return refined_prompt
+
+def get_refinement_status() -> dict:
+    """
+    Deadline, hedging and circuit breaker state of Gemini refinement
+    
+    Returns:
+        Dictionary for the health endpoint
+    """
+    return {
+        "configured": bool(GEMINI_API_KEY),
+        "deadline_seconds": GEMINI_DEADLINE_SECONDS,
+        "hedge_after_seconds": GEMINI_HEDGE_AFTER_SECONDS or None,
+        "circuit": gemini_breaker.get_stats()
+    }
+
 def create_fallback_prompt(user_prompt: str) -> str:
     """
     Fallback prompt refinement if Gemini API fails
@@ -137,6 +393,149 @@ def create_fallback_prompt(user_prompt: str) -> str:
     
     return fallback
 
+# Appended to SYSTEM_INSTRUCTION for bulk calls (replaces its OUTPUT FORMAT)
+BULK_INSTRUCTION = """
+BULK MODE:
+You will receive several numbered user prompts. Refine each one independently
+following the RULES above. Ignore the OUTPUT FORMAT above and instead return
+ONLY a JSON array, one object per input, in the same order:
+[{"id": 0, "refined": "..."}, {"id": 1, "refined": "..."}]
+No explanations, no markdown, no extra text.
+"""
+
+def _parse_bulk_response(text: str) -> Dict[int, str]:
+    """
+    Extract {id: refined prompt} from a bulk response
+    
+    Tolerates markdown code fences and text around the JSON array; items
+    without an integer id or a non-empty string are skipped.
+    
+    Raises:
+        ValueError: If no JSON array can be parsed
+    """
+    match = re.search(r"\[.*\]", text, re.DOTALL)
+    if match is None:
+        raise ValueError("Gemini bulk response contains no JSON array")
+    items = json.loads(match.group(0))
+    
+    refined = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        item_id, text_value = item.get("id"), item.get("refined")
+        if isinstance(item_id, int) and isinstance(text_value, str) and text_value.strip():
+            refined[item_id] = text_value.strip()
+    return refined
+
+def request_bulk_refinement(user_prompts: List[str], client=None) -> Dict[int, str]:
+    """
+    Refine several prompts with one Gemini call (no caching, no fallback)
+    
+    Args:
+        user_prompts: Raw user inputs
+        client: Optional Gemini client override
+        
+    Returns:
+        {index in user_prompts: refined prompt with the required terms}
+        for every item Gemini answered
+        
+    Raises:
+        CircuitOpenError: If the breaker is open
+        Exception: Any client error or an unparseable response
+    """
+    client = client or get_gemini_model()
+    if not gemini_breaker.allow():
+        raise CircuitOpenError("Gemini circuit is open")
+    
+    numbered = "\n".join(f"{index}: {json.dumps(prompt)}" for index, prompt in enumerate(user_prompts))
+    full_prompt = f"{SYSTEM_INSTRUCTION}\n{BULK_INSTRUCTION}\nUser prompts:\n{numbered}\n\nJSON array:"
+    
+    try:
+        with stage_timer("gemini_refine_bulk"):
+            response = client.generate_content(full_prompt)
+        refined = _parse_bulk_response(response.text)
+    except Exception:
+        gemini_breaker.record_failure()
+        raise
+    gemini_breaker.record_success()
+    
+    return {
+        index: ensure_required_terms(text)
+        for index, text in refined.items()
+        if 0 <= index < len(user_prompts)
+    }
+
+def refine_prompts_bulk(
+    user_prompts: List[str],
+    client=None,
+    chunk_size: int = GEMINI_BULK_CHUNK_SIZE,
+    concurrency: int = GEMINI_BULK_CONCURRENCY
+) -> List[dict]:
+    """
+    Refine many prompts with few Gemini calls
+    
+    Cached prompts are answered from the cache; the rest (de-duplicated by
+    normalized text) are packed chunk_size per Gemini call, with at most
+    `concurrency` calls in flight. Every answer goes through the
+    required-terms check and is cached; items Gemini skipped, chunks that
+    failed and everything while the circuit breaker is open get the
+    rule-based fallback (not cached).
+    
+    Args:
+        user_prompts: Raw user inputs
+        client: Optional Gemini client override (e.g. a stub for offline tests)
+        chunk_size: Prompts per Gemini call
+        concurrency: Maximum parallel Gemini calls
+        
+    Returns:
+        One dictionary per input, in order: prompt, refined_prompt and
+        source ("cache", "gemini" or "fallback")
+    """
+    results = [None] * len(user_prompts)
+    
+    # Step 1: Answer from the cache, group the misses by normalized prompt
+    missing = {}  # normalized prompt -> indexes in user_prompts
+    for index, prompt in enumerate(user_prompts):
+        cached = prompt_cache.get(prompt)
+        if cached is not None:
+            results[index] = {"prompt": prompt, "refined_prompt": cached, "source": "cache"}
+        else:
+            missing.setdefault(normalize_prompt(prompt), []).append(index)
+    
+    # Step 2: One Gemini call per chunk of distinct prompts
+    distinct = [user_prompts[indexes[0]] for indexes in missing.values()]
+    chunks = [distinct[start:start + chunk_size] for start in range(0, len(distinct), max(1, chunk_size))]
+    
+    def refine_chunk(chunk: List[str]) -> Dict[int, str]:
+        try:
+            return request_bulk_refinement(chunk, client)
+        except CircuitOpenError:
+            return {}
+        except Exception as e:
+            logger.error(f"Gemini bulk refinement failed for {len(chunk)} prompt(s): {str(e)}")
+            return {}
+    
+    refined = {}
+    if chunks:
+        logger.info(f"Refining {len(distinct)} prompt(s) in {len(chunks)} Gemini call(s)...")
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(chunks)))) as executor:
+            for chunk, answers in zip(chunks, executor.map(refine_chunk, chunks)):
+                for offset, prompt in enumerate(chunk):
+                    if offset in answers:
+                        refined[normalize_prompt(prompt)] = answers[offset]
+                        prompt_cache.put(prompt, answers[offset])
+    
+    # Step 3: Fill in every missing prompt (fallback where Gemini gave nothing)
+    for key, indexes in missing.items():
+        for index in indexes:
+            prompt = user_prompts[index]
+            if key in refined:
+                results[index] = {"prompt": prompt, "refined_prompt": refined[key], "source": "gemini"}
+            else:
+                results[index] = {"prompt": prompt, "refined_prompt": create_fallback_prompt(prompt), "source": "fallback"}
+    
+    return results
+
 def test_gemini_connection():
     """
     Test function to verify Gemini API is working
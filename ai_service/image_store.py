@@ -0,0 +1,339 @@
+"""
+Generated Image Storage Module
+Collision-free, content-addressed storage for generated_images/ with
+sharded subdirectories, background encoding and retention GC
+"""
+
+import os
+import hashlib
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+
+from metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+IMAGES_DIR = Path("generated_images")
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "png").lower()  # png, webp or jpeg
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "90"))  # WebP/JPEG quality
+PNG_COMPRESS_LEVEL = 6  # zlib level; optimize=True was several times slower for ~5% smaller files
+STORE_ENCODE_WORKERS = int(os.getenv("STORE_ENCODE_WORKERS", "2"))
+STORE_MAX_MB = int(os.getenv("STORE_MAX_MB", "2048"))  # Total disk cap (0 = unlimited)
+STORE_MAX_FILES = int(os.getenv("STORE_MAX_FILES", "10000"))  # File count cap (0 = unlimited)
+STORE_GC_INTERVAL = int(os.getenv("STORE_GC_INTERVAL", "300"))  # Seconds between GC runs
+
+# Supported output formats: name -> (PIL format, extension, media type)
+FORMATS = {
+    "png": ("PNG", "png", "image/png"),
+    "webp": ("WEBP", "webp", "image/webp"),
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+}
+MEDIA_TYPES = {extension: media_type for _, extension, media_type in FORMATS.values()}
+
+class ImageStore:
+    """
+    Stores PIL images under content-hash names in sharded subdirectories
+
+    Names are derived from a SHA-256 of the pixels (or a caller-supplied
+    digest), so images finished at the same moment never overwrite each
+    other and identical images are stored once. `save` returns the relative
+    path immediately and encodes on a background thread pool; readers call
+    `wait` before serving a path that may still be pending.
+    """
+
+    def __init__(
+        self,
+        root: Path = IMAGES_DIR,
+        image_format: str = IMAGE_FORMAT,
+        encode_workers: int = STORE_ENCODE_WORKERS,
+        max_bytes: int = STORE_MAX_MB * 1024 * 1024,
+        max_files: int = STORE_MAX_FILES
+    ):
+        if image_format not in FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}. Use one of {list(FORMATS)}")
+
+        self.root = Path(root)
+        self.image_format = image_format
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, encode_workers),
+            thread_name_prefix="image-encode"
+        )
+        self._pending = {}  # relative path -> Future
+        self._lock = threading.Lock()
+        self._gc_thread = None
+        self._gc_stop = threading.Event()
+
+        self._stats = {
+            "saved": 0,
+            "deduplicated": 0,
+            "encode_errors": 0,
+            "gc_runs": 0,
+            "gc_removed_files": 0,
+            "gc_removed_bytes": 0,
+        }
+
+    # ----- Naming -----
+
+    def path_for_digest(self, digest: str, prefix: str, image_format: Optional[str] = None) -> str:
+        """
+        Relative path for a digest: <aa>/<bb>/<prefix>_<digest[:32]>.<ext>
+
+        Args:
+            digest: Hex digest (content hash or result-cache key)
+            prefix: Human-readable name prefix (e.g. "ai_generated")
+            image_format: Output format (defaults to the store's format)
+
+        Returns:
+            POSIX-style path relative to the store root
+        """
+        extension = FORMATS[image_format or self.image_format][1]
+        return f"{digest[:2]}/{digest[2:4]}/{prefix}_{digest[:32]}.{extension}"
+
+    @staticmethod
+    def content_digest(image: Image.Image) -> str:
+        """SHA-256 of an image's mode, size and raw pixels"""
+        hasher = hashlib.sha256(f"{image.mode}:{image.size}".encode("utf-8"))
+        hasher.update(image.tobytes())
+        return hasher.hexdigest()
+
+    def resolve(self, relative_path: str) -> Optional[Path]:
+        """
+        Map a relative path to a file inside the store
+
+        Returns:
+            Absolute path, or None if it escapes the root
+        """
+        root = self.root.resolve()
+        path = (root / relative_path).resolve()
+        if path == root or root not in path.parents:
+            return None
+        return path
+
+    # ----- Writing -----
+
+    def save(
+        self,
+        image: Image.Image,
+        prefix: str,
+        relative_path: Optional[str] = None,
+        image_format: Optional[str] = None
+    ) -> str:
+        """
+        Store an image, encoding it in the background
+
+        Args:
+            image: PIL image to store
+            prefix: Name prefix used when relative_path is not given
+            relative_path: Optional explicit path (e.g. from path_for_digest)
+            image_format: Output format override (png, webp, jpeg)
+
+        Returns:
+            Relative path of the stored image (may still be encoding)
+        """
+        image_format = image_format or self.image_format
+        if image_format not in FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+
+        if relative_path is None:
+            relative_path = self.path_for_digest(self.content_digest(image), prefix, image_format)
+
+        path = self.resolve(relative_path)
+        if path is None:
+            raise ValueError(f"Invalid image path: {relative_path}")
+
+        with self._lock:
+            if relative_path in self._pending or path.exists():
+                # Identical content (or same cache key) is already stored
+                self._stats["deduplicated"] += 1
+                return relative_path
+
+            future = self._executor.submit(self._encode, image, path, image_format)
+            self._pending[relative_path] = future
+
+        future.add_done_callback(lambda f: self._on_encoded(relative_path, f))
+        return relative_path
+
+    def _encode(self, image: Image.Image, path: Path, image_format: str):
+        """Encode to a temporary file and atomically move it into place"""
+        pil_format = FORMATS[image_format][0]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+
+        if pil_format == "PNG":
+            options = {"compress_level": PNG_COMPRESS_LEVEL}
+        elif pil_format == "WEBP":
+            options = {"quality": IMAGE_QUALITY, "method": 4}
+        else:
+            options = {"quality": IMAGE_QUALITY}
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+
+        try:
+            with stage_timer("image_encode"):
+                image.save(temp_path, format=pil_format, **options)
+            os.replace(temp_path, path)
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    def _on_encoded(self, relative_path: str, future: Future):
+        with self._lock:
+            self._pending.pop(relative_path, None)
+            if future.exception() is not None:
+                self._stats["encode_errors"] += 1
+                logger.error(f"Failed to encode {relative_path}: {future.exception()}")
+            else:
+                self._stats["saved"] += 1
+
+    def pending_future(self, relative_path: str) -> Optional[Future]:
+        """Future of a still-encoding image, or None if it is already on disk"""
+        with self._lock:
+            return self._pending.get(relative_path)
+
+    def wait(self, relative_path: str, timeout: Optional[float] = None):
+        """Block until a pending image has been written (no-op otherwise)"""
+        future = self.pending_future(relative_path)
+        if future is not None:
+            future.result(timeout=timeout)
+
+    def exists(self, relative_path: str) -> bool:
+        """True if the image is stored or currently being encoded"""
+        path = self.resolve(relative_path)
+        if path is None:
+            return False
+        return self.pending_future(relative_path) is not None or path.exists()
+
+    def touch(self, relative_path: str):
+        """Mark an image as recently used so retention GC keeps it longer"""
+        path = self.resolve(relative_path)
+        if path is not None:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+    def delete(self, relative_path: str) -> bool:
+        """
+        Delete a stored image
+
+        Returns:
+            True if a file was removed
+        """
+        path = self.resolve(relative_path)
+        if path is None:
+            return False
+        self.wait(relative_path)
+        try:
+            path.unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    # ----- Retention GC -----
+
+    def gc(self) -> dict:
+        """
+        Remove least-recently-used images until both caps are met
+
+        Returns:
+            Dictionary with files/bytes removed and what remains
+        """
+        files = []
+        total_bytes = 0
+
+        if self.root.exists():
+            for path in self.root.rglob("*"):
+                if not path.is_file() or path.name.startswith("."):
+                    continue
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue  # Removed concurrently
+                files.append((stat.st_mtime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+        files.sort()
+        file_count = len(files)
+        removed_files = 0
+        removed_bytes = 0
+
+        for _, size, path in files:
+            over_bytes = self.max_bytes > 0 and total_bytes > self.max_bytes
+            over_files = self.max_files > 0 and file_count > self.max_files
+            if not (over_bytes or over_files):
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total_bytes -= size
+            file_count -= 1
+            removed_files += 1
+            removed_bytes += size
+
+        with self._lock:
+            self._stats["gc_runs"] += 1
+            self._stats["gc_removed_files"] += removed_files
+            self._stats["gc_removed_bytes"] += removed_bytes
+
+        if removed_files:
+            logger.info(f"Image store GC removed {removed_files} file(s), {removed_bytes / 1024 / 1024:.1f}MB")
+
+        return {
+            "removed_files": removed_files,
+            "removed_bytes": removed_bytes,
+            "file_count": file_count,
+            "total_bytes": total_bytes
+        }
+
+    def start_gc(self, interval: float = STORE_GC_INTERVAL):
+        """Run GC now and then every `interval` seconds on a daemon thread"""
+        if self._gc_thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.gc()
+                except Exception as e:
+                    logger.error(f"Image store GC failed: {str(e)}")
+                if self._gc_stop.wait(interval):
+                    return
+
+        self._gc_stop.clear()
+        self._gc_thread = threading.Thread(target=loop, name="image-store-gc", daemon=True)
+        self._gc_thread.start()
+
+    def stop_gc(self):
+        """Stop the GC thread"""
+        self._gc_stop.set()
+        if self._gc_thread is not None:
+            self._gc_thread.join(timeout=5)
+            self._gc_thread = None
+
+    def get_stats(self) -> dict:
+        """
+        Get storage statistics
+
+        Returns:
+            Dictionary with save/dedupe/GC counters and configuration
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending_encodes"] = len(self._pending)
+        stats["format"] = self.image_format
+        stats["max_mb"] = self.max_bytes / 1024 / 1024
+        stats["max_files"] = self.max_files
+        stats["gc_removed_mb"] = round(stats.pop("gc_removed_bytes") / 1024 / 1024, 2)
+        return stats
+
+# Shared store for generated_images/
+image_store = ImageStore()
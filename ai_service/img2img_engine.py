@@ -4,132 +4,65 @@ Converts uploaded images to different artistic styles using Stable Diffusion
 """
 
 import torch
-from diffusers import StableDiffusionImg2ImgPipeline, DPMSolverMultistepScheduler
 from PIL import Image
-import io
-from pathlib import Path
-from datetime import datetime
+import threading
 import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from model_registry import MODEL_ID, DEFAULT_SCHEDULER, get_pipeline
+from styles import STYLE_PROMPTS, DENOISING_STRENGTH, get_style_info
+from onnx_backend import is_onnx_pipeline, get_backend_name
+from quality_tiers import QualitySettings, get_tier_settings
+from upload_ingest import decode_image_for_size
+from embedding_cache import embedding_cache
+from latent_cache import latent_cache, CachedUpload
+from image_store import image_store
+from metrics import PipelineTimer, stage_timer
+from residency import residency
+from batch_scheduler import GenerationCancelled
+from cancellation import CancelToken, raise_if_cancelled
+from cpu_fastpath import fast_path_autocast, get_fast_path_tag
 
 logger = logging.getLogger(__name__)
 
-# Configuration
-MODEL_ID = "runwayml/stable-diffusion-v1-5"
-IMAGES_DIR = Path("generated_images")
+# Configuration (defaults = the "standard" quality tier; requests may pick another tier)
 IMAGE_SIZE = 512  # Resize input to 512x512 for consistency
 NUM_INFERENCE_STEPS = 50  # More steps for better quality in img2img
 GUIDANCE_SCALE = 7.5
-DENOISING_STRENGTH = 0.55  # Balance between preserving structure and applying style
-
-# Global img2img pipeline variable (loaded once)
-_img2img_pipeline = None
 
-# Style-specific prompts
-STYLE_PROMPTS = {
-    "cartoon": {
-        "prompt": (
-            "cartoon illustration style, smooth outlines, flat colors, "
-            "soft shading, clean edges, vibrant colors, animated style, "
-            "professional cartoon art, high quality, no text, no watermark"
-        ),
-        "negative": (
-            "realistic, photorealistic, photograph, photo, text, watermark, "
-            "signature, logo, words, letters, typography, blurry, distorted, "
-            "low quality, ugly, deformed"
-        )
-    },
-    "anime": {
-        "prompt": (
-            "anime style illustration, clean line art, expressive features, "
-            "soft lighting, vibrant colors, studio ghibli inspired, "
-            "japanese animation style, cel shaded, high quality anime art, "
-            "no text, no watermark"
-        ),
-        "negative": (
-            "realistic, western cartoon, 3d render, text, watermark, "
-            "signature, logo, words, letters, blurry, distorted, "
-            "low quality, ugly, deformed, bad anatomy"
-        )
-    },
-    "watercolor": {
-        "prompt": (
-            "watercolor painting style, soft brush strokes, pastel colors, "
-            "artistic texture, paper texture, flowing colors, gentle blending, "
-            "artistic watercolor illustration, high quality, no text, no watermark"
-        ),
-        "negative": (
-            "photograph, digital art, sharp edges, text, watermark, "
-            "signature, logo, words, letters, blurry, distorted, "
-            "low quality, ugly, deformed"
-        )
-    },
-    "pencil_sketch": {
-        "prompt": (
-            "pencil sketch drawing, hand drawn lines, graphite texture, "
-            "black and white, paper texture, artistic sketch, detailed linework, "
-            "professional pencil art, high quality, no text, no watermark"
-        ),
-        "negative": (
-            "color, colored, photograph, digital art, text, watermark, "
-            "signature, logo, words, letters, blurry, distorted, "
-            "low quality, ugly, deformed"
-        )
-    }
-}
+# The pipeline's scheduler keeps per-run state, so conversions run one at a time
+_img2img_lock = threading.Lock()
 
-def load_img2img_model():
+def load_img2img_model(scheduler: str = DEFAULT_SCHEDULER):
     """
     Load Stable Diffusion img2img model into memory
-    This is called once and cached for subsequent conversions
+    
+    The pipeline is kept by the shared model registry (not here), so the
+    residency manager can unload it when idle; the next call reloads it.
+    The txt2img pipeline reuses the same UNet, VAE and text encoder.
+    
+    Args:
+        scheduler: Scheduler variant (quality tiers may pick a non-default one)
     
     Returns:
         StableDiffusionImg2ImgPipeline instance
     """
-    global _img2img_pipeline
-    
-    if _img2img_pipeline is not None:
-        return _img2img_pipeline
-    
-    logger.info("Loading Stable Diffusion img2img model...")
-    
     try:
-        # Determine device (CUDA if available, else CPU)
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Using device: {device}")
-        
-        # Load the img2img model
-        pipe = StableDiffusionImg2ImgPipeline.from_pretrained(
-            MODEL_ID,
-            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-            safety_checker=None,  # Disable for academic use
-            requires_safety_checker=False
-        )
-        
-        # Use DPM-Solver++ scheduler for faster generation
-        pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
-        
-        # Move to device
-        pipe = pipe.to(device)
-        
-        # Enable memory optimizations for CPU/low-memory systems
-        if device == "cpu":
-            pipe.enable_attention_slicing()
-        
-        _img2img_pipeline = pipe
-        logger.info("✓ Stable Diffusion img2img model loaded successfully")
-        
-        return _img2img_pipeline
+        return get_pipeline("img2img", scheduler)
         
     except Exception as e:
         logger.error(f"Failed to load img2img model: {str(e)}")
         raise
 
-def preprocess_image(image: Image.Image) -> Image.Image:
+def preprocess_image(image: Image.Image, image_size: int = IMAGE_SIZE) -> Image.Image:
     """
     Preprocess uploaded image for img2img conversion
     
     Args:
         image: PIL Image object
+        image_size: Edge length of the square output
         
     Returns:
         Preprocessed PIL Image (resized, RGB mode)
@@ -138,22 +71,89 @@ def preprocess_image(image: Image.Image) -> Image.Image:
     if image.mode != 'RGB':
         image = image.convert('RGB')
     
-    # Resize to 512x512 while maintaining aspect ratio
-    image.thumbnail((IMAGE_SIZE, IMAGE_SIZE), Image.Resampling.LANCZOS)
+    # Resize to image_size x image_size while maintaining aspect ratio
+    image.thumbnail((image_size, image_size), Image.Resampling.LANCZOS)
     
-    # Create a new 512x512 image with white background
-    new_image = Image.new('RGB', (IMAGE_SIZE, IMAGE_SIZE), (255, 255, 255))
+    # Create a new square image with white background
+    new_image = Image.new('RGB', (image_size, image_size), (255, 255, 255))
     
     # Paste the resized image centered
-    offset = ((IMAGE_SIZE - image.width) // 2, (IMAGE_SIZE - image.height) // 2)
+    offset = ((image_size - image.width) // 2, (image_size - image.height) // 2)
     new_image.paste(image, offset)
     
     return new_image
 
+def _prepare_input_image(image_bytes: bytes, settings: QualitySettings) -> Image.Image:
+    """Decode (reduced-size for JPEG) and square-pad an upload at the tier's size"""
+    input_image = decode_image_for_size(image_bytes, settings.image_size)
+    return preprocess_image(input_image, settings.image_size)
+
+def _encode_latents(pipe, image: Image.Image) -> torch.Tensor:
+    """
+    VAE-encode a preprocessed image to scaled initial latents
+
+    Uses the mean of the latent distribution rather than a sample, so a
+    cached encoding gives the same result as a fresh one.
+    """
+    image_tensor = pipe.image_processor.preprocess(image).to(device=pipe.device, dtype=pipe.vae.dtype)
+    latents = pipe.vae.encode(image_tensor).latent_dist.mode()
+    return (latents * pipe.vae.config.scaling_factor).to(pipe.vae.dtype)  # bf16 under the CPU fast path's autocast
+
+def _load_input(pipe, image_bytes: bytes, settings: QualitySettings) -> CachedUpload:
+    """
+    Preprocessed image and VAE latents of an upload, from the latent cache
+    when the same bytes were converted before at this size
+
+    ONNX pipelines encode the image themselves, so only the preprocessed
+    image is cached for them.
+    """
+    key = latent_cache.make_key(image_bytes, settings.image_size, f"{MODEL_ID}@{get_backend_name()}{get_fast_path_tag()}")
+    cached = latent_cache.get(key)
+    if cached is not None:
+        logger.info("Using cached preprocessed image and latents")
+        return cached
+
+    processed_image = _prepare_input_image(image_bytes, settings)
+
+    latents = None
+    if not is_onnx_pipeline(pipe):
+        with _img2img_lock, torch.no_grad(), fast_path_autocast(), stage_timer("vae_encode"):
+            latents = _encode_latents(pipe, processed_image)
+
+    return latent_cache.put(key, processed_image, latents)
+
+def _clamp_strength(strength: Optional[float]) -> float:
+    """Requested denoising strength (or the default), limited to 0.0-1.0"""
+    denoising_strength = strength if strength is not None else DENOISING_STRENGTH
+    return max(0.0, min(1.0, denoising_strength))
+
+def _step_hooks(timer: PipelineTimer, cancel_token: Optional[CancelToken], steps: int, strength: float) -> Tuple[Callable, Callable]:
+    """
+    Step callbacks that time every denoising step and abort the run once
+    the request is cancelled
+
+    Returns:
+        (callback for ONNX pipelines, callback_on_step_end for torch pipelines)
+    """
+    # img2img skips the first (1 - strength) of the schedule
+    denoising_steps = min(int(steps * strength), steps)
+
+    def on_step(step, timestep, latents):
+        timer.step()
+        raise_if_cancelled(cancel_token, "img2img", step + 1, denoising_steps)
+
+    def on_step_end(pipeline, step, timestep, callback_kwargs):
+        on_step(step, timestep, None)
+        return callback_kwargs
+
+    return on_step, on_step_end
+
 def convert_image_to_style(
     image_bytes: bytes,
     style: str = "cartoon",
-    strength: float = None
+    strength: float = None,
+    settings: Optional[QualitySettings] = None,
+    cancel_token: Optional[CancelToken] = None
 ) -> str:
     """
     Convert an uploaded image to a specific artistic style using img2img
@@ -163,27 +163,35 @@ def convert_image_to_style(
         style: Style to apply (cartoon, anime, watercolor, pencil_sketch)
         strength: Denoising strength (0.0-1.0). If None, uses default.
                  Higher = more transformation, Lower = more preservation
+        settings: Optional quality settings (defaults to the "standard" tier)
+        cancel_token: Optional token checked after every denoising step
         
     Returns:
-        Filename of the converted image (saved in generated_images/)
+        Path of the converted image relative to generated_images/
+        
+    Raises:
+        GenerationCancelled: If the token was cancelled before the last step
         
     Process:
     1. Load img2img model (if not already loaded)
     2. Preprocess input image
     3. Get style-specific prompts
     4. Apply img2img transformation
-    5. Save result with unique filename
-    6. Return filename
+    5. Store result under a content-hash name
+    6. Return its path
     """
     
+    residency.acquire("img2img")  # The pipeline is not evicted while converting
     try:
+        settings = settings or get_tier_settings("img2img")
+        
         # Step 1: Load model
-        pipe = load_img2img_model()
+        pipe = load_img2img_model(settings.scheduler)
         
-        # Step 2: Load and preprocess image
+        # Step 2: Decode (reduced-size for JPEG), preprocess and VAE-encode
+        # the image, or reuse the result of an earlier conversion
         logger.info("Preprocessing input image...")
-        input_image = Image.open(io.BytesIO(image_bytes))
-        processed_image = preprocess_image(input_image)
+        prepared = _load_input(pipe, image_bytes, settings)
         
         # Step 3: Get style prompts
         if style not in STYLE_PROMPTS:
@@ -194,71 +202,185 @@ def convert_image_to_style(
         prompt = style_config["prompt"]
         negative_prompt = style_config["negative"]
         
-        logger.info(f"Converting image to {style} style...")
+        logger.info(f"Converting image to {style} style ({settings.tier}: {settings.steps} steps, {settings.image_size}px)...")
         logger.info(f"Prompt: {prompt[:100]}...")
         
         # Step 4: Apply img2img transformation
-        # Use provided strength or default
-        denoising_strength = strength if strength is not None else DENOISING_STRENGTH
+        # Use provided strength or default, limited to the valid range
+        denoising_strength = _clamp_strength(strength)
         
-        # Ensure strength is in valid range
-        denoising_strength = max(0.0, min(1.0, denoising_strength))
+        if is_onnx_pipeline(pipe):
+            # ONNX Runtime pipelines encode the prompts themselves
+            with _img2img_lock:
+                timer = PipelineTimer()
+                on_step, on_step_end = _step_hooks(timer, cancel_token, settings.steps, denoising_strength)
+                result = pipe(
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    image=prepared.image,
+                    strength=denoising_strength,
+                    num_inference_steps=settings.steps,
+                    guidance_scale=GUIDANCE_SCALE,
+                    generator=np.random.RandomState(),
+                    callback=on_step,
+                )
+        else:
+            # Style prompts are precomputed at startup, so this normally skips CLIP
+            prompt_embeds = embedding_cache.get(pipe, prompt, MODEL_ID)
+            negative_prompt_embeds = embedding_cache.get(pipe, negative_prompt, MODEL_ID)
+            
+            with _img2img_lock, torch.no_grad(), fast_path_autocast():  # Disable gradient calculation for inference
+                # 4-channel input is taken as latents, so the pipeline skips its VAE encode
+                timer = PipelineTimer()
+                on_step, on_step_end = _step_hooks(timer, cancel_token, settings.steps, denoising_strength)
+                result = pipe(
+                    prompt_embeds=prompt_embeds,
+                    negative_prompt_embeds=negative_prompt_embeds,
+                    image=prepared.latents,
+                    strength=denoising_strength,  # How much to transform (0.0-1.0)
+                    num_inference_steps=settings.steps,
+                    guidance_scale=GUIDANCE_SCALE,
+                    callback_on_step_end=on_step_end,
+                )
         
-        with torch.no_grad():  # Disable gradient calculation for inference
-            result = pipe(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                image=processed_image,
-                strength=denoising_strength,  # How much to transform (0.0-1.0)
-                num_inference_steps=NUM_INFERENCE_STEPS,
-                guidance_scale=GUIDANCE_SCALE,
-            )
+        timer.finish()
         
         # Extract the converted image
         converted_image = result.images[0]
         
-        # Step 5: Save image with unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"cartoon_{style}_{timestamp}.png"
-        filepath = IMAGES_DIR / filename
-        
-        # Ensure directory exists
-        IMAGES_DIR.mkdir(exist_ok=True)
-        
-        # Save as PNG
-        converted_image.save(filepath, format="PNG", optimize=True)
+        # Step 5: Store image (content-hash name, encoded off-thread)
+        filename = image_store.save(converted_image, prefix=f"cartoon_{style}")
         
-        logger.info(f"✓ Image converted and saved: {filename}")
+        logger.info(f"✓ Image converted and stored: {filename}")
         
         # Step 6: Return filename
         return filename
         
+    except GenerationCancelled as e:
+        logger.info(str(e))
+        raise
+    
     except Exception as e:
         logger.error(f"Error converting image: {str(e)}")
         raise ValueError(f"Image conversion failed: {str(e)}")
-
-def get_available_styles():
-    """
-    Get list of available conversion styles
     
-    Returns:
-        List of style names
-    """
-    return list(STYLE_PROMPTS.keys())
+    finally:
+        residency.release("img2img")
 
-def get_style_info():
+def convert_image_to_styles(
+    image_bytes: bytes,
+    styles: List[str],
+    strength: float = None,
+    settings: Optional[QualitySettings] = None,
+    cancel_token: Optional[CancelToken] = None
+) -> Dict[str, str]:
     """
-    Get information about all available styles
+    Convert one uploaded image to several styles in a single batched pass
+    
+    The image is decoded, preprocessed and VAE-encoded once; every style
+    then runs as one item of the same img2img batch, so the UNet steps
+    are shared instead of repeated per style.
     
+    Args:
+        image_bytes: Raw image bytes from upload
+        styles: Styles to apply (keys of STYLE_PROMPTS); duplicates are ignored
+        strength: Denoising strength (0.0-1.0). If None, uses default.
+        settings: Optional quality settings (defaults to the "standard" tier)
+        cancel_token: Optional token checked after every denoising step
+        
     Returns:
-        Dictionary with style descriptions
+        Dictionary of style -> path of the converted image relative to generated_images/
+        
+    Raises:
+        ValueError: If no styles are given, a style is unknown or conversion fails
+        GenerationCancelled: If the token was cancelled before the last step
     """
-    return {
-        "cartoon": "Smooth cartoon illustration with flat colors and clean outlines",
-        "anime": "Japanese anime style with clean line art and expressive features",
-        "watercolor": "Soft watercolor painting with artistic brush strokes",
-        "pencil_sketch": "Hand-drawn pencil sketch in black and white"
-    }
+    styles = list(dict.fromkeys(styles))
+    if not styles:
+        raise ValueError("At least one style is required")
+    unknown = [style for style in styles if style not in STYLE_PROMPTS]
+    if unknown:
+        raise ValueError(f"Invalid style(s): {', '.join(unknown)}. Available: {', '.join(STYLE_PROMPTS)}")
+    
+    residency.acquire("img2img")  # The pipeline is not evicted while converting
+    try:
+        settings = settings or get_tier_settings("img2img")
+        
+        # Step 1: Load model
+        pipe = load_img2img_model(settings.scheduler)
+        
+        # Step 2: Decode, preprocess and VAE-encode the image once (or reuse a cached encoding)
+        logger.info("Preprocessing input image...")
+        prepared = _load_input(pipe, image_bytes, settings)
+        
+        prompts = [STYLE_PROMPTS[style]["prompt"] for style in styles]
+        negative_prompts = [STYLE_PROMPTS[style]["negative"] for style in styles]
+        denoising_strength = _clamp_strength(strength)
+        
+        logger.info(
+            f"Converting image to {len(styles)} styles ({', '.join(styles)}) in one batch "
+            f"({settings.tier}: {settings.steps} steps, {settings.image_size}px)..."
+        )
+        
+        # Step 3: Encode once and run every style as one batch
+        if is_onnx_pipeline(pipe):
+            # Given one image and N prompts, the ONNX pipeline VAE-encodes the
+            # image once and repeats its latents across the batch
+            with _img2img_lock:
+                timer = PipelineTimer()
+                on_step, on_step_end = _step_hooks(timer, cancel_token, settings.steps, denoising_strength)
+                result = pipe(
+                    prompt=prompts,
+                    negative_prompt=negative_prompts,
+                    image=prepared.image,
+                    strength=denoising_strength,
+                    num_inference_steps=settings.steps,
+                    guidance_scale=GUIDANCE_SCALE,
+                    generator=np.random.RandomState(),
+                    callback=on_step,
+                )
+        else:
+            prompt_embeds = torch.cat([embedding_cache.get(pipe, prompt, MODEL_ID) for prompt in prompts])
+            negative_prompt_embeds = torch.cat([
+                embedding_cache.get(pipe, prompt, MODEL_ID) for prompt in negative_prompts
+            ])
+            
+            with _img2img_lock, torch.no_grad(), fast_path_autocast():
+                # 4-channel input is taken as latents, so the pipeline skips its VAE encode
+                timer = PipelineTimer()
+                on_step, on_step_end = _step_hooks(timer, cancel_token, settings.steps, denoising_strength)
+                result = pipe(
+                    prompt_embeds=prompt_embeds,
+                    negative_prompt_embeds=negative_prompt_embeds,
+                    image=prepared.latents.repeat(len(styles), 1, 1, 1),
+                    strength=denoising_strength,
+                    num_inference_steps=settings.steps,
+                    guidance_scale=GUIDANCE_SCALE,
+                    callback_on_step_end=on_step_end,
+                )
+        
+        timer.finish()
+        
+        # Step 4: Store every result (content-hash names, encoded off-thread)
+        filenames = {
+            style: image_store.save(converted_image, prefix=f"cartoon_{style}")
+            for style, converted_image in zip(styles, result.images)
+        }
+        
+        logger.info(f"✓ Image converted to {len(filenames)} styles")
+        
+        return filenames
+        
+    except GenerationCancelled as e:
+        logger.info(str(e))
+        raise
+    
+    except Exception as e:
+        logger.error(f"Error converting image: {str(e)}")
+        raise ValueError(f"Image conversion failed: {str(e)}")
+    
+    finally:
+        residency.release("img2img")
 
 if __name__ == "__main__":
     # Test the module
@@ -0,0 +1,331 @@
+"""
+Durable Job Queue Module
+SQLite-backed queue for long-running generation and style-conversion jobs
+so the HTTP layer stays responsive and jobs survive a service restart
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+JOBS_DIR = Path(os.getenv("JOBS_DIR", "jobs"))
+JOBS_DB_PATH = JOBS_DIR / "jobs.db"
+JOB_INPUTS_DIR = JOBS_DIR / "inputs"  # Uploaded images waiting for conversion
+MAX_JOB_ATTEMPTS = 3  # Jobs interrupted more often than this are marked failed
+
+# Job kinds and statuses
+JOB_KIND_GENERATE = "generate_image"
+JOB_KIND_CONVERT = "convert_to_cartoon"
+JOB_KINDS = (JOB_KIND_GENERATE, JOB_KIND_CONVERT)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+FINAL_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    input_path TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+"""
+
+# Columns added after the first release, for databases created before them
+_MIGRATIONS = {
+    "cancel_requested": "ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0",
+}
+
+class JobQueue:
+    """
+    Durable FIFO job queue stored in a local SQLite database
+
+    Every method opens its own short-lived connection, so one JobQueue can be
+    shared between the FastAPI process and any number of worker processes.
+    """
+
+    def __init__(self, db_path: Path = JOBS_DB_PATH, inputs_dir: Path = JOB_INPUTS_DIR):
+        self.db_path = Path(db_path)
+        self.inputs_dir = Path(inputs_dir)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.inputs_dir.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, statement in _MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(statement)
+
+    @contextmanager
+    def _connect(self):
+        """Open an autocommit connection that is always closed afterwards"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, kind: str, params: dict, input_bytes: Optional[bytes] = None) -> str:
+        """
+        Add a job to the queue
+
+        Args:
+            kind: Job kind (generate_image or convert_to_cartoon)
+            params: JSON-serializable job parameters
+            input_bytes: Optional uploaded file, stored next to the database
+
+        Returns:
+            New job id
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        job_id = uuid.uuid4().hex
+        input_path = None
+
+        if input_bytes is not None:
+            input_path = self.inputs_dir / f"{job_id}.bin"
+            input_path.write_bytes(input_bytes)
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, params, input_path, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, STATUS_QUEUED, json.dumps(params),
+                 str(input_path) if input_path else None, time.time())
+            )
+
+        logger.info(f"Job queued: {job_id} ({kind})")
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[dict]:
+        """
+        Atomically take the oldest queued job and mark it running
+
+        Args:
+            worker_id: Identifier of the claiming worker, stored so its jobs can be
+                requeued if the worker dies
+
+        Returns:
+            Job dictionary, or None if the queue is empty
+        """
+        with self._connect() as conn:
+            # BEGIN IMMEDIATE takes the write lock, so two workers never claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+                    (STATUS_QUEUED,)
+                ).fetchone()
+
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, started_at = ?, "
+                        "attempts = attempts + 1 WHERE id = ?",
+                        (STATUS_RUNNING, worker_id, time.time(), row["id"])
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+
+        return self.get(row["id"])
+
+    def complete(self, job_id: str, result: dict):
+        """Mark a job as succeeded and store its result"""
+        self._finish(job_id, STATUS_SUCCEEDED, result=json.dumps(result))
+
+    def fail(self, job_id: str, error: str):
+        """Mark a job as failed and store the error message"""
+        self._finish(job_id, STATUS_FAILED, error=error)
+
+    def mark_cancelled(self, job_id: str, message: str):
+        """Mark a running job as cancelled once its worker stopped it"""
+        self._finish(job_id, STATUS_CANCELLED, error=message)
+
+    def cancel(self, job_id: str) -> Tuple[Optional[str], bool]:
+        """
+        Cancel a job
+
+        A queued job is cancelled right away. A running job gets its
+        cancel_requested flag set; its worker checks the flag between
+        denoising steps, stops and marks the job cancelled.
+
+        Args:
+            job_id: Job id
+
+        Returns:
+            (status after the call, or None if the job is unknown;
+            whether this call cancelled or flagged the job)
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (STATUS_CANCELLED, "Cancelled before it started", time.time(), job_id, STATUS_QUEUED)
+            )
+            if cursor.rowcount:
+                row = conn.execute("SELECT input_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row["input_path"]:
+                    Path(row["input_path"]).unlink(missing_ok=True)
+                logger.info(f"Job cancelled: {job_id} (queued)")
+                return STATUS_CANCELLED, True
+
+            cursor = conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ? AND cancel_requested = 0",
+                (job_id, STATUS_RUNNING)
+            )
+            flagged = cursor.rowcount > 0
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        if flagged:
+            logger.info(f"Job cancellation requested: {job_id} (running)")
+        return (row["status"] if row is not None else None), flagged
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        """True once DELETE /jobs/{id} asked to stop a running job"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None,
+                error: Optional[str] = None):
+        with self._connect() as conn:
+            row = conn.execute("SELECT input_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id)
+            )
+
+        # The uploaded input is no longer needed once the job is final
+        if row is not None and row["input_path"]:
+            Path(row["input_path"]).unlink(missing_ok=True)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+        Look up a job by id
+
+        Returns:
+            Job dictionary (params/result decoded), or None if unknown
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def requeue_interrupted(self) -> int:
+        """
+        Return jobs left 'running' by a previous process to the queue
+
+        Called once at startup, before any worker is started. Jobs that have
+        already been attempted MAX_JOB_ATTEMPTS times are failed instead so a
+        job that crashes its worker cannot loop forever, and jobs whose
+        cancellation was requested are marked cancelled.
+
+        Returns:
+            Number of jobs requeued
+        """
+        requeued = self._requeue_running()
+
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted job(s)")
+        return requeued
+
+    def requeue_worker_jobs(self, worker_id: str) -> int:
+        """
+        Return the running jobs of a worker that exited to the queue
+
+        Called by the job worker supervisor when a worker process dies (e.g.
+        killed out of memory) and when workers are stopped, with the same
+        attempt limit and cancellation handling as requeue_interrupted().
+
+        Args:
+            worker_id: Identifier the worker claimed its jobs with
+
+        Returns:
+            Number of jobs requeued
+        """
+        requeued = self._requeue_running(worker_id)
+
+        if requeued:
+            logger.info(f"Requeued {requeued} job(s) of {worker_id}")
+        return requeued
+
+    def _requeue_running(self, worker_id: Optional[str] = None) -> int:
+        """Requeue, fail or cancel running jobs (of one worker, or all of them)"""
+        condition = "status = ?"
+        params = (STATUS_RUNNING,)
+        if worker_id is not None:
+            condition += " AND worker = ?"
+            params += (worker_id,)
+
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                f"WHERE {condition} AND cancel_requested = 1",
+                (STATUS_CANCELLED, "Cancelled while running", time.time()) + params
+            )
+            conn.execute(
+                f"UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                f"WHERE {condition} AND attempts >= ?",
+                (STATUS_FAILED, "Job interrupted too many times", time.time()) + params + (MAX_JOB_ATTEMPTS,)
+            )
+            cursor = conn.execute(
+                f"UPDATE jobs SET status = ?, worker = NULL, started_at = NULL WHERE {condition}",
+                (STATUS_QUEUED,) + params
+            )
+            return cursor.rowcount
+
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker"""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (STATUS_QUEUED,)
+            ).fetchone()[0]
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """1-based position of a queued job, or None if it is not queued"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT created_at FROM jobs WHERE id = ? AND status = ?",
+                (job_id, STATUS_QUEUED)
+            ).fetchone()
+            if row is None:
+                return None
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at <= ?",
+                (STATUS_QUEUED, row["created_at"])
+            ).fetchone()[0]
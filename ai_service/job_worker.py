@@ -0,0 +1,254 @@
+"""
+Job Worker Module
+Dedicated worker processes that pull jobs from the durable queue and run
+the blocking Stable Diffusion pipelines outside the HTTP process
+"""
+
+import os
+import sys
+import time
+import logging
+import multiprocessing
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from job_queue import JobQueue, JOB_KIND_GENERATE, JOB_KIND_CONVERT
+from quality_tiers import QualitySettings
+from batch_scheduler import GenerationCancelled
+from cancellation import CancelToken, REASON_JOB_CANCELLED
+from worker_pool import get_available_cores
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))  # Number of worker processes
+JOB_WORKER_PRELOAD = os.getenv("JOB_WORKER_PRELOAD", "0") == "1"  # Load + warm up a private model copy per worker at start
+JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", "0"))  # torch threads per worker (0 = even split with the API process)
+POLL_INTERVAL = 0.5  # Seconds between queue polls when idle
+CANCEL_POLL_SECONDS = float(os.getenv("JOB_CANCEL_POLL_SECONDS", "1.0"))  # How often a running job checks for DELETE
+SUPERVISE_SECONDS = float(os.getenv("JOB_SUPERVISE_SECONDS", "5"))  # How often dead workers are detected and respawned
+
+def split_threads(workers: int = JOB_WORKERS) -> Tuple[int, int]:
+    """
+    Divide the cores between the API process and the job workers
+
+    Each process otherwise sizes its torch thread pool to every core, and
+    concurrent generations in the API process and the workers oversubscribe
+    the CPU.
+
+    Returns:
+        (threads for the API process, threads per job worker)
+    """
+    cores = len(get_available_cores())
+    if workers <= 0:
+        return cores, 0
+    per_worker = JOB_WORKER_THREADS or max(1, cores // (workers + 1))
+    return max(1, cores - per_worker * workers), per_worker
+
+def limit_threads(threads: int):
+    """
+    Cap this process's torch/OpenMP/MKL thread pools
+
+    The environment covers a torch import that happens later (the engines
+    are imported lazily); an already imported torch is set directly.
+    """
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    os.environ["MKL_NUM_THREADS"] = str(threads)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+
+def get_worker_id(worker_index: int, pid: int) -> str:
+    """Identifier a worker process claims jobs with"""
+    return f"worker-{worker_index}-{pid}"
+
+def execute_job(job: dict, cancel_token: Optional[CancelToken] = None) -> dict:
+    """
+    Run a single job and return its result
+
+    The engines are imported here rather than at module level so the parent
+    process never loads torch/diffusers just to start workers.
+
+    Args:
+        job: Job dictionary as returned by JobQueue.claim()
+        cancel_token: Optional token checked between denoising steps
+
+    Returns:
+        JSON-serializable result dictionary
+
+    Raises:
+        GenerationCancelled: If the token was cancelled before the last step
+    """
+    params = job["params"]
+    settings = QualitySettings(**params["settings"]) if params.get("settings") else None
+
+    if job["kind"] == JOB_KIND_GENERATE:
+        from gemini_prompt import refine_prompt_with_gemini
+        from diffusion_engine import generate_image_with_diffusion
+
+        refined_prompt = refine_prompt_with_gemini(params["prompt"])
+        image_filename = generate_image_with_diffusion(refined_prompt, settings=settings, cancel_token=cancel_token)
+
+        return {
+            "image_filename": image_filename,
+            "refined_prompt": refined_prompt,
+            "original_prompt": params["prompt"]
+        }
+
+    if job["kind"] == JOB_KIND_CONVERT:
+        from img2img_engine import convert_image_to_style
+
+        image_bytes = Path(job["input_path"]).read_bytes()
+        converted_filename = convert_image_to_style(
+            image_bytes=image_bytes,
+            style=params["style"],
+            strength=params.get("strength"),
+            settings=settings,
+            cancel_token=cancel_token
+        )
+
+        return {
+            "image_filename": converted_filename,
+            "style": params["style"],
+            "original_filename": params.get("original_filename")
+        }
+
+    raise ValueError(f"Unknown job kind: {job['kind']}")
+
+def run_worker(worker_index: int, db_path: str, inputs_dir: str, threads: int):
+    """
+    Worker process entry point: claim jobs forever and record their outcome
+
+    Args:
+        worker_index: Index of this worker (used in its id)
+        db_path: Path of the SQLite job database
+        inputs_dir: Directory holding uploaded job inputs
+        threads: torch threads for this worker
+    """
+    logging.basicConfig(level=logging.INFO)
+    limit_threads(threads)
+    worker_id = get_worker_id(worker_index, os.getpid())
+    job_queue = JobQueue(db_path=Path(db_path), inputs_dir=Path(inputs_dir))
+
+    logger.info(f"✓ Job worker started: {worker_id} ({threads} threads)")
+
+    # Opt-in: load and warm up before claiming, so a job never waits for the
+    # model load. Off by default, since every worker holds its own copy of the
+    # weights next to the API process's; otherwise the first job loads them.
+    if JOB_WORKER_PRELOAD:
+        from model_registry import preload_models
+        preload_models()
+
+    while True:
+        job = job_queue.claim(worker_id)
+
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        logger.info(f"[{worker_id}] Running job {job['id']} ({job['kind']})")
+
+        # DELETE /jobs/{id} sets a flag in the database; poll it between steps
+        cancel_token = CancelToken(
+            check=lambda job_id=job["id"]: job_queue.is_cancel_requested(job_id),
+            poll_seconds=CANCEL_POLL_SECONDS,
+            check_reason=REASON_JOB_CANCELLED
+        )
+
+        try:
+            result = execute_job(job, cancel_token)
+            job_queue.complete(job["id"], result)
+            logger.info(f"[{worker_id}] ✓ Job {job['id']} finished")
+        except GenerationCancelled as e:
+            logger.info(f"[{worker_id}] Job {job['id']} cancelled: {str(e)}")
+            job_queue.mark_cancelled(job["id"], str(e))
+        except Exception as e:
+            logger.error(f"[{worker_id}] Job {job['id']} failed: {str(e)}")
+            job_queue.fail(job["id"], str(e))
+
+def start_worker(job_queue: JobQueue, index: int, threads: int) -> multiprocessing.Process:
+    """
+    Start one job worker process
+
+    Uses the 'spawn' start method so each worker gets a clean interpreter
+    (forking a process that already holds PyTorch threads is unsafe).
+
+    Args:
+        job_queue: Queue whose database the worker should poll
+        index: Index of the worker (kept when it is respawned)
+        threads: torch threads for the worker
+
+    Returns:
+        Started process
+    """
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(
+        target=run_worker,
+        args=(index, str(job_queue.db_path), str(job_queue.inputs_dir), threads),
+        name=f"job-worker-{index}",
+        daemon=True
+    )
+    process.start()
+    return process
+
+def start_workers(job_queue: JobQueue, count: int = JOB_WORKERS) -> List[multiprocessing.Process]:
+    """
+    Start dedicated job worker processes
+
+    Args:
+        job_queue: Queue whose database the workers should poll
+        count: Number of worker processes
+
+    Returns:
+        List of started processes (position = worker index)
+    """
+    _, threads = split_threads(count)
+    workers = [start_worker(job_queue, index, threads) for index in range(count)]
+
+    logger.info(f"✓ Started {count} job worker process(es), {threads} threads each")
+    return workers
+
+def restart_dead_workers(job_queue: JobQueue, workers: List[multiprocessing.Process]) -> int:
+    """
+    Requeue the jobs of workers that died and respawn them
+
+    A worker running Stable Diffusion on CPU is typically lost to an
+    out-of-memory kill mid-job; its job would otherwise stay 'running'
+    forever. Jobs that keep killing their worker fail after MAX_JOB_ATTEMPTS.
+
+    Args:
+        job_queue: Queue the workers poll
+        workers: Worker processes as returned by start_workers() (updated in place)
+
+    Returns:
+        Number of workers respawned
+    """
+    _, threads = split_threads(len(workers))
+    restarted = 0
+
+    for index, process in enumerate(workers):
+        if process.is_alive():
+            continue
+
+        worker_id = get_worker_id(index, process.pid)
+        logger.error(f"Job worker {worker_id} exited (code {process.exitcode}), restarting it")
+        job_queue.requeue_worker_jobs(worker_id)
+        workers[index] = start_worker(job_queue, index, threads)
+        restarted += 1
+
+    return restarted
+
+def stop_workers(job_queue: JobQueue, workers: List[multiprocessing.Process], timeout: float = 5.0):
+    """
+    Stop worker processes and requeue the jobs they were running
+
+    Stop the supervisor first, or it respawns the stopped workers. Jobs
+    are only left 'running' if the whole service is killed; those are
+    requeued by JobQueue.requeue_interrupted() on the next startup.
+    """
+    for process in workers:
+        if process.is_alive():
+            process.terminate()
+    for index, process in enumerate(workers):
+        process.join(timeout=timeout)
+        if not process.is_alive():
+            job_queue.requeue_worker_jobs(get_worker_id(index, process.pid))
@@ -0,0 +1,197 @@
+"""
+Upload Latent Cache Module
+Caches the preprocessed input image and its VAE latents per uploaded file,
+so img2img retries with another style or strength skip decoding,
+preprocessing and the VAE encoder
+"""
+
+import os
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "cache"))
+LATENT_CACHE_DIR = CACHE_DIR / "latents"
+LATENT_CACHE_SIZE = int(os.getenv("LATENT_CACHE_SIZE", "32"))  # In-memory entries (~0.8MB each at 512px)
+LATENT_CACHE_DISK = os.getenv("LATENT_CACHE_DISK", "0") == "1"  # Also keep entries on disk
+LATENT_CACHE_DISK_FILES = int(os.getenv("LATENT_CACHE_DISK_FILES", "512"))  # On-disk entries
+
+@dataclass
+class CachedUpload:
+    """
+    An upload prepared for img2img
+
+    latents are the scaled VAE latents (1, 4, size/8, size/8) of image, or
+    None for backends that encode inside the pipeline (ONNX).
+    """
+    image: Image.Image
+    latents: Optional[torch.Tensor]
+
+class UploadLatentCache:
+    """
+    LRU of prepared uploads keyed by the SHA-256 of the uploaded bytes,
+    the target image size and the model
+
+    Lookups check memory first, then (if enabled) one file per entry on
+    disk; disk hits are promoted back into memory.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = LATENT_CACHE_SIZE,
+        disk_dir: Optional[Path] = LATENT_CACHE_DIR if LATENT_CACHE_DISK else None,
+        max_disk_files: int = LATENT_CACHE_DISK_FILES
+    ):
+        """
+        Args:
+            max_entries: Maximum in-memory entries (0 disables the memory tier)
+            disk_dir: Directory for the on-disk tier (None = memory only)
+            max_disk_files: Maximum on-disk entries
+        """
+        self.max_entries = max(0, max_entries)
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_disk_files = max(0, max_disk_files)
+
+        self._memory = OrderedDict()  # key -> CachedUpload
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(image_bytes: bytes, image_size: int, model_key: str) -> str:
+        """
+        Cache key of an upload
+
+        Args:
+            image_bytes: Raw uploaded bytes
+            image_size: Edge length the image is preprocessed to
+            model_key: Model and backend (latents differ between VAEs)
+        """
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return hashlib.sha256(f"{model_key}|{image_size}|{digest}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.pt"
+
+    def _remember(self, key: str, entry: CachedUpload):
+        """Insert into the memory LRU (caller holds the lock)"""
+        if self.max_entries == 0:
+            return
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[CachedUpload]:
+        path = self._disk_path(key)
+        try:
+            data = torch.load(path, map_location="cpu", weights_only=True)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Dropping unreadable latent cache file {path.name}: {str(e)}")
+            path.unlink(missing_ok=True)
+            return None
+
+        os.utime(path)  # Mark as recently used for disk eviction
+        return CachedUpload(image=Image.fromarray(data["image"].numpy()), latents=data.get("latents"))
+
+    def _write_disk(self, key: str, entry: CachedUpload):
+        data = {"image": torch.from_numpy(np.asarray(entry.image).copy())}
+        if entry.latents is not None:
+            data["latents"] = entry.latents.detach().cpu()
+
+        path = self._disk_path(key)
+        temp_path = path.with_suffix(".tmp")
+        try:
+            torch.save(data, temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not store latent cache entry: {str(e)}")
+            return
+
+        # Evict least recently used files beyond the cap
+        files = sorted(self.disk_dir.glob("*.pt"), key=lambda p: p.stat().st_mtime)
+        for stale in files[:max(0, len(files) - self.max_disk_files)]:
+            stale.unlink(missing_ok=True)
+
+    def get(self, key: str) -> Optional[CachedUpload]:
+        """
+        Look up a prepared upload
+
+        Returns:
+            CachedUpload, or None on a miss
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return entry
+
+        entry = self._read_disk(key) if self.disk_dir is not None else None
+
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, image: Image.Image, latents: Optional[torch.Tensor]) -> CachedUpload:
+        """
+        Store a prepared upload
+
+        Returns:
+            The stored CachedUpload
+        """
+        entry = CachedUpload(image=image, latents=latents)
+        with self._lock:
+            self._remember(key, entry)
+        if self.disk_dir is not None:
+            self._write_disk(key, entry)
+        return entry
+
+    def clear(self):
+        """Drop every cached upload from memory (e.g. when the model is unloaded)"""
+        with self._lock:
+            self._memory.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Get cache statistics
+
+        Returns:
+            Dictionary with entry counts and hit/miss counters
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            memory_entries = len(self._memory)
+
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        return {
+            "memory_entries": memory_entries,
+            "max_memory_entries": self.max_entries,
+            "disk_enabled": self.disk_dir is not None,
+            "disk_entries": len(list(self.disk_dir.glob("*.pt"))) if self.disk_dir is not None else 0,
+            **stats,
+            "hit_rate": (hits / lookups) if lookups else 0.0
+        }
+
+# Shared cache used by the img2img engine
+latent_cache = UploadLatentCache()
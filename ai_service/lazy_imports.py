@@ -0,0 +1,146 @@
+"""
+Lazy Import Module
+Defers the heavy imports (torch, diffusers, the engines, the Gemini SDK)
+until first use or the background warm-up, and records what each import
+cost for the startup report
+"""
+
+import os
+import sys
+import time
+import importlib
+import threading
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Imported by the background warm-up, in dependency order, so each entry's
+# time excludes the modules listed before it
+HEAVY_MODULES = [
+    "torch",
+    "diffusers",
+    "model_registry",
+    "embedding_cache",
+    "latent_cache",
+    "diffusion_engine",
+    "img2img_engine",
+    "preview",
+]
+
+_import_seconds = {}  # module -> seconds, in import order
+_lock = threading.Lock()
+_serving_after = None  # Seconds from process start until the app served
+
+def record_import(module_name: str, seconds: float):
+    """Add one import to the startup report (the first measurement wins)"""
+    with _lock:
+        _import_seconds.setdefault(module_name, round(seconds, 3))
+
+def timed_import(module_name: str):
+    """
+    Import a module, recording how long the import took
+
+    Args:
+        module_name: Dotted module name
+
+    Returns:
+        The module (without re-timing it if it was already imported)
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    record_import(module_name, time.perf_counter() - started)
+    return module
+
+def lazy_function(module_name: str, function_name: str) -> Callable:
+    """
+    Stand-in for a function of a heavy module
+
+    The module is imported on the first call, so holding the stand-in
+    costs nothing at startup.
+
+    Args:
+        module_name: Module defining the function
+        function_name: Function name
+
+    Returns:
+        Callable with the function's signature
+    """
+    def call(*args, **kwargs):
+        return getattr(timed_import(module_name), function_name)(*args, **kwargs)
+
+    call.__name__ = function_name
+    call.__qualname__ = function_name
+    call.__doc__ = f"{module_name}.{function_name} (imported on first call)"
+    return call
+
+def import_heavy_modules() -> bool:
+    """
+    Import HEAVY_MODULES (background warm-up), so the first request does
+    not pay for them
+
+    Returns:
+        True if every module imported
+    """
+    ok = True
+    for module_name in HEAVY_MODULES:
+        try:
+            timed_import(module_name)
+        except Exception as e:
+            logger.error(f"Failed to import {module_name}: {str(e)}")
+            ok = False
+    log_startup_report()
+    return ok
+
+def heavy_modules_loaded() -> List[str]:
+    """HEAVY_MODULES that are imported in this process"""
+    return [module_name for module_name in HEAVY_MODULES if module_name in sys.modules]
+
+def get_process_age_seconds() -> Optional[float]:
+    """Seconds since this process started (None where /proc is unavailable)"""
+    try:
+        with open("/proc/self/stat") as stat:
+            # Fields after the command name; starttime is field 22 overall
+            start_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime:
+            uptime_seconds = float(uptime.read().split()[0])
+        return uptime_seconds - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+def mark_serving():
+    """Record how long the process took to start serving (call from the app's startup event)"""
+    global _serving_after
+    age = get_process_age_seconds()
+    _serving_after = round(age, 2) if age is not None else None
+
+def get_import_seconds() -> Dict[str, float]:
+    """Recorded import times, in import order"""
+    with _lock:
+        return dict(_import_seconds)
+
+def get_startup_report() -> dict:
+    """
+    Startup cost of this process
+
+    Returns:
+        Dictionary with the seconds from process start until the app
+        served, the time of each recorded import and the heavy modules
+        imported so far
+    """
+    return {
+        "serving_after_seconds": _serving_after,
+        "import_seconds": get_import_seconds(),
+        "heavy_modules_loaded": heavy_modules_loaded(),
+    }
+
+def log_startup_report():
+    """Log the recorded imports, most expensive first"""
+    report = get_startup_report()
+    costs = sorted(report["import_seconds"].items(), key=lambda item: item[1], reverse=True)
+    summary = ", ".join(f"{module_name} {seconds:.2f}s" for module_name, seconds in costs)
+    logger.info(f"Startup: serving after {report['serving_after_seconds']}s; imports: {summary or 'none recorded'}")
@@ -0,0 +1,65 @@
+"""
+Model Load Status Module
+Tracks load and warm-up progress of the shared weights and each pipeline,
+without importing torch/diffusers, so health and readiness checks answer
+before the model stack is imported
+"""
+
+import os
+import threading
+
+from onnx_backend import get_backend_name
+
+# Configuration
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "1") == "1"  # Load + warm up at startup
+
+# Load progress per stage, reported by get_load_status()
+LOAD_STAGES = ["weights", "txt2img", "img2img"]
+_load_status = {
+    stage: {"state": "pending", "load_seconds": None, "warmup_seconds": None, "error": None}
+    for stage in LOAD_STAGES
+}
+_status_lock = threading.Lock()  # Never held during a load, so status reads never wait for one
+
+def set_stage_status(stage: str, **fields):
+    """Update the state/timings of one load stage"""
+    with _status_lock:
+        _load_status.setdefault(stage, {}).update(fields)
+
+def get_stage_state(stage: str) -> str:
+    """Current state of one load stage ("pending" if untracked)"""
+    with _status_lock:
+        return _load_status.get(stage, {}).get("state", "pending")
+
+def is_ready() -> bool:
+    """
+    True once the weights and every pipeline are loaded and warmed up
+
+    With PRELOAD_MODELS=0 models load lazily on first use, so the service
+    always reports ready. Stages evicted for being idle count as ready:
+    they reload on the next request.
+    """
+    if not PRELOAD_MODELS:
+        return True
+    with _status_lock:
+        return all(status["state"] in ("ready", "evicted") for status in _load_status.values())
+
+def get_load_status() -> dict:
+    """
+    Loading progress of the weights and each pipeline
+
+    Returns:
+        Dictionary with overall readiness, progress (0-1) and per-stage
+        state ("pending", "loading", "loaded", "ready", "evicted", "failed"),
+        load and warm-up times in seconds
+    """
+    with _status_lock:
+        stages = {stage: dict(status) for stage, status in _load_status.items()}
+
+    return {
+        "ready": is_ready(),
+        "preload": PRELOAD_MODELS,
+        "progress": round(sum(status["state"] == "ready" for status in stages.values()) / len(stages), 2),
+        "backend": get_backend_name(),
+        "stages": stages
+    }
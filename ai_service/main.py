@@ -3,18 +3,65 @@ AI Image Generation Service - FastAPI Backend
 Integrates Gemini prompt refinement with Stable Diffusion image generation
 """
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form
+import time
+_imports_started = time.perf_counter()  # For the startup report
+
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import Optional
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional, Tuple
 import os
-from pathlib import Path
+import asyncio
+import base64
+import json
+import random
+import threading
 import logging
 
-from gemini_prompt import refine_prompt_with_gemini
-from diffusion_engine import generate_image_with_diffusion
-from img2img_engine import convert_image_to_style, get_available_styles, get_style_info
+from gemini_prompt import refine_prompt_async, refine_prompts_bulk, get_refinement_status, get_gemini_model, prompt_cache, GEMINI_API_KEY
+from batch_scheduler import BatchScheduler, GenerationCancelled
+from admission import AdmissionController, AdmissionRejected, AdmissionTicket, ADMISSION_MAX_ACTIVE, PRIORITY_INTERACTIVE
+from cancellation import CancelToken, cancelled_requests_total, REASON_CLIENT_DISCONNECT, REASON_JOB_CANCELLED
+from styles import get_available_styles, get_style_info, get_fixed_prompts, DENOISING_STRENGTH
+from job_queue import JobQueue, JOB_KINDS, JOB_KIND_GENERATE, FINAL_STATUSES, STATUS_CANCELLED, STATUS_RUNNING
+from job_worker import start_workers, stop_workers, restart_dead_workers, split_threads, limit_threads, JOB_WORKERS, SUPERVISE_SECONDS
+from load_status import PRELOAD_MODELS, get_load_status
+from result_cache import result_cache
+from image_store import image_store, IMAGES_DIR, MEDIA_TYPES
+from upload_ingest import read_upload_limited, inspect_image_header, UploadRejected, MAX_UPLOAD_SIZE
+from onnx_backend import get_backend_name
+from quality_tiers import QualitySettings, tier_calibrator, CALIBRATE_TIERS
+from metrics import registry, Gauge, requests_total, request_errors_total, request_seconds, requests_in_flight
+from worker_pool import InferenceWorkerPool, WORKER_PROCESSES, TASK_CONVERT, TASK_CONVERT_STYLES
+from lazy_imports import (
+    timed_import,
+    lazy_function,
+    import_heavy_modules,
+    mark_serving,
+    log_startup_report,
+    get_startup_report,
+    get_import_seconds,
+    record_import,
+)
+
+# Everything above: FastAPI, pydantic and the torch-free service modules
+record_import("main", time.perf_counter() - _imports_started)
+
+# torch/diffusers are imported on first use or by the background warm-up,
+# so the API (health checks, /styles, ...) is up before the model stack
+generate_images_batch = lazy_function("diffusion_engine", "generate_images_batch")
+load_diffusion_model = lazy_function("diffusion_engine", "load_diffusion_model")
+get_result_key = lazy_function("diffusion_engine", "get_result_key")
+calibrate_quality_tiers = lazy_function("diffusion_engine", "calibrate_quality_tiers")
+convert_image_to_style = lazy_function("img2img_engine", "convert_image_to_style")
+convert_image_to_styles = lazy_function("img2img_engine", "convert_image_to_styles")
+preload_models = lazy_function("model_registry", "preload_models")
+get_memory_report = lazy_function("model_registry", "get_memory_report")
+encode_preview = lazy_function("preview", "encode_preview")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -37,25 +84,463 @@ app.add_middleware(
 )
 
 # Create generated_images directory if it doesn't exist
-IMAGES_DIR = Path("generated_images")
 IMAGES_DIR.mkdir(exist_ok=True)
 
-# Mount static files to serve generated images
-app.mount("/images", StaticFiles(directory="generated_images"), name="images")
+@app.on_event("startup")
+async def start_image_store_gc():
+    """Start retention GC for generated_images/ (disk and file-count caps)"""
+    image_store.start_gc()
+
+@app.on_event("shutdown")
+async def stop_image_store_gc():
+    """Stop retention GC"""
+    image_store.stop_gc()
+
+# Optional multi-process serving: N core-pinned workers, each with its own pipelines
+inference_pool = InferenceWorkerPool() if WORKER_PROCESSES > 0 else None
+
+# Pipelines running in this process leave the job workers' share of the cores
+# to them (set at import, before torch is loaded or any thread is started)
+if JOB_WORKERS > 0 and inference_pool is None:
+    limit_threads(split_threads(JOB_WORKERS)[0])
+
+# Micro-batching scheduler: concurrent /generate-image calls share one UNet batch
+generation_scheduler = BatchScheduler(
+    run_batch=inference_pool.run_generation_batch if inference_pool else generate_images_batch,
+    max_concurrent_batches=WORKER_PROCESSES if inference_pool else 1
+)
+
+# Admission control for the generation endpoints: by default one full batch
+# per inference worker runs at once, the rest wait (fairly) or get a 429
+admission = AdmissionController(
+    max_active=ADMISSION_MAX_ACTIVE or generation_scheduler.max_batch_size * generation_scheduler.max_concurrent_batches
+)
+
+@app.on_event("startup")
+async def start_generation_scheduler():
+    """Start the inference workers (if enabled) and the background batching thread"""
+    if inference_pool is not None:
+        inference_pool.start()
+    generation_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_generation_scheduler():
+    """Stop the background batching thread and the inference workers"""
+    generation_scheduler.stop()
+    if inference_pool is not None:
+        inference_pool.stop()
+
+# Precompute CLIP embeddings for the fixed style/negative prompts at startup
+PRECOMPUTE_EMBEDDINGS = os.getenv("PRECOMPUTE_EMBEDDINGS", "1") == "1"
+
+def precompute_fixed_embeddings():
+    """Load the text encoder and pin embeddings for every fixed prompt"""
+    from diffusion_engine import DEFAULT_NEGATIVE_PROMPT
+    from model_registry import MODEL_ID
+    from embedding_cache import embedding_cache
+    from onnx_backend import is_onnx_pipeline
+    
+    try:
+        pipe = load_diffusion_model()
+        if is_onnx_pipeline(pipe):
+            return  # ONNX Runtime pipelines encode prompts inside the pipeline
+        fixed_prompts = [DEFAULT_NEGATIVE_PROMPT] + get_fixed_prompts()
+        count = embedding_cache.precompute(pipe, fixed_prompts, MODEL_ID)
+        logger.info(f"✓ Precomputed {count} fixed prompt embedding(s)")
+    except Exception as e:
+        logger.error(f"Failed to precompute prompt embeddings: {str(e)}")
+
+def calibrate_tiers():
+    """Measure (or load) generation latency per tier resolution"""
+    try:
+        calibrate_quality_tiers()
+    except Exception as e:
+        logger.error(f"Failed to calibrate quality tiers: {str(e)}")
+
+def warm_up_models():
+    """Startup work that needs the loaded model, run one after the other"""
+    import_heavy_modules()
+    if GEMINI_API_KEY:
+        try:
+            get_gemini_model()
+        except Exception as e:
+            logger.error(f"Failed to configure Gemini: {str(e)}")
+    if PRELOAD_MODELS:
+        preload_models()
+    if PRECOMPUTE_EMBEDDINGS:
+        precompute_fixed_embeddings()
+    if CALIBRATE_TIERS:
+        calibrate_tiers()
+
+@app.on_event("startup")
+async def start_model_warmup():
+    """Import, load, warm up, precompute embeddings and calibrate in the background (model load is slow)"""
+    if inference_pool is not None:
+        return  # Each inference worker loads and warms up its own pipelines
+    if PRELOAD_MODELS or PRECOMPUTE_EMBEDDINGS or CALIBRATE_TIERS:
+        threading.Thread(
+            target=warm_up_models,
+            name="model-warmup",
+            daemon=True
+        ).start()
+
+@app.on_event("startup")
+async def report_startup():
+    """Log how long the process took to start serving and what its imports cost"""
+    mark_serving()
+    log_startup_report()
+
+# Durable job queue: long-running work is handed to dedicated worker processes
+job_queue = JobQueue()
+job_workers = []
+JOB_MAX_WAIT_SECONDS = 60  # Upper bound for GET /jobs/{id}?wait=...
+
+job_supervisor_stop = threading.Event()
+job_supervisor = None
+
+def supervise_job_workers():
+    """Respawn job workers that died and requeue the jobs they were running"""
+    while not job_supervisor_stop.wait(SUPERVISE_SECONDS):
+        try:
+            restart_dead_workers(job_queue, job_workers)
+        except Exception as e:
+            logger.error(f"Job worker supervisor failed: {str(e)}")
+
+@app.on_event("startup")
+async def start_job_workers():
+    """Requeue jobs interrupted by a previous shutdown, start the workers and their supervisor"""
+    global job_supervisor
+    
+    job_queue.requeue_interrupted()
+    if JOB_WORKERS > 0:
+        job_workers.extend(start_workers(job_queue, JOB_WORKERS))
+        job_supervisor_stop.clear()
+        job_supervisor = threading.Thread(target=supervise_job_workers, name="job-supervisor", daemon=True)
+        job_supervisor.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    """Stop the supervisor, then terminate worker processes and requeue their running jobs"""
+    global job_supervisor
+    
+    job_supervisor_stop.set()
+    if job_supervisor is not None:
+        job_supervisor.join(timeout=5)
+        job_supervisor = None
+    stop_workers(job_queue, job_workers)
+    job_workers.clear()
+
+# Metrics: request counters and latency per endpoint, queue and load gauges
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count requests and errors per route and time them until the response starts"""
+    requests_in_flight.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        requests_in_flight.dec()
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+        requests_total.inc(endpoint=endpoint, method=request.method, status=str(status))
+        if status >= 400:
+            request_errors_total.inc(endpoint=endpoint, status_class=f"{status // 100}xx")
+
+def queued_request_counts() -> dict:
+    """Requests waiting for inference, per queue"""
+    counts = {
+        ("admission",): sum(admission.queue_depths().values()),
+        ("generation_batch",): generation_scheduler.get_stats()["queue_depth"],
+        ("jobs",): job_queue.queue_depth(),
+    }
+    if inference_pool is not None:
+        workers = inference_pool.get_stats()["workers"]
+        counts[("inference_workers",)] = sum(worker["in_flight"] for worker in workers)
+    return counts
+
+def pipeline_load_seconds() -> dict:
+    """Load (and warm-up) time of each loaded pipeline stage or inference worker"""
+    return {
+        (stage, phase): status.get(f"{phase}_seconds")
+        for stage, status in current_load_status()["stages"].items()
+        for phase in ("load", "warmup")
+        if status.get(f"{phase}_seconds") is not None
+    }
+
+registry.register(Gauge(
+    "queued_requests",
+    "Requests waiting for inference (admission queue, micro-batch queue, job queue, busy inference workers)",
+    ["queue"],
+    callback=queued_request_counts
+))
+registry.register(Gauge(
+    "module_import_seconds",
+    "Seconds taken to import each timed module (heavy modules import lazily)",
+    ["module"],
+    callback=lambda: {(module_name,): seconds for module_name, seconds in get_import_seconds().items()}
+))
+registry.register(Gauge(
+    "pipeline_load_seconds",
+    "Seconds taken to load and to warm up each pipeline stage (or inference worker)",
+    ["stage", "phase"],
+    callback=pipeline_load_seconds
+))
+
+# Upload/prompt limits
+MAX_PROMPT_LENGTH = 500
+MAX_BULK_PROMPTS = 500  # Prompts per POST /refine-prompts request
+MAX_IMAGES_PER_REQUEST = int(os.getenv("MAX_IMAGES_PER_REQUEST", "4"))  # Variations per /generate-image call
+MAX_SEED = 2**32 - 1
+ALLOWED_IMAGE_TYPES = ["image/png", "image/jpeg", "image/jpg"]
+
+def validate_prompt(prompt: Optional[str]):
+    """Raise HTTP 400 if the prompt is empty or too long"""
+    if not prompt or len(prompt.strip()) == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Prompt cannot be empty"
+        )
+    
+    if len(prompt) > MAX_PROMPT_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Prompt too long. Maximum {MAX_PROMPT_LENGTH} characters."
+        )
+
+def validate_style(style: str):
+    """Raise HTTP 400 if the style is not one of STYLE_PROMPTS"""
+    available_styles = get_available_styles()
+    if style not in available_styles:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid style. Available: {', '.join(available_styles)}"
+        )
+
+def parse_styles(styles: str) -> List[str]:
+    """
+    Split a comma-separated style list, dropping duplicates
+    
+    Raises:
+        HTTPException(400) if the list is empty or has an unknown style
+    """
+    parsed = list(dict.fromkeys(style.strip() for style in styles.split(",") if style.strip()))
+    if not parsed:
+        raise HTTPException(status_code=400, detail="At least one style is required")
+    for style in parsed:
+        validate_style(style)
+    return parsed
+
+def resolve_seeds(seed: Optional[int], seeds: Optional[List[int]], num_images: Optional[int]) -> Tuple[List[int], bool]:
+    """
+    Seeds for the variations of a /generate-image request
+    
+    Explicit seeds are used as given and a single seed expands to seed,
+    seed+1, ...; otherwise random seeds are drawn here (not in the engine)
+    so they can be returned and a chosen variation reproduced.
+    
+    Returns:
+        (seeds, deterministic) where deterministic means the caller chose them
+    
+    Raises:
+        HTTPException(400) for conflicting or out-of-range seeds
+    """
+    if seeds is not None:
+        if seed is not None:
+            raise HTTPException(status_code=400, detail="Use either seed or seeds, not both")
+        if not 1 <= len(seeds) <= MAX_IMAGES_PER_REQUEST:
+            raise HTTPException(status_code=400, detail=f"Between 1 and {MAX_IMAGES_PER_REQUEST} seeds are allowed")
+        if num_images is not None and num_images != len(seeds):
+            raise HTTPException(status_code=400, detail="num_images must match the number of seeds")
+        if any(not 0 <= value <= MAX_SEED for value in seeds):
+            raise HTTPException(status_code=400, detail="Seeds must be between 0 and 2^32-1")
+        return list(seeds), True
+    
+    num_images = num_images or 1
+    if seed is not None:
+        return [(seed + index) % (MAX_SEED + 1) for index in range(num_images)], True
+    return [random.randint(0, MAX_SEED) for _ in range(num_images)], False
+
+def select_quality(
+    kind: str,
+    quality: Optional[str] = None,
+    latency_budget: Optional[float] = None,
+    strength: float = 1.0
+) -> QualitySettings:
+    """
+    Resolve a quality tier and/or latency budget to generation settings
+    
+    Raises:
+        HTTPException(400) for an unknown tier or non-positive budget
+    """
+    if latency_budget is not None and latency_budget <= 0:
+        raise HTTPException(status_code=400, detail="Latency budget must be positive")
+    try:
+        return tier_calibrator.select(kind, quality, latency_budget, strength)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+async def read_validated_upload(image: UploadFile) -> bytes:
+    """
+    Check the upload's type and size and return its bytes
+    
+    The upload is read in chunks and abandoned as soon as it passes the size
+    cap, and the image header (real format, pixel dimensions) is checked
+    before any pixels are decoded.
+    
+    Raises:
+        HTTPException(400) for wrong type, empty, oversized or
+        decompression-bomb files
+    """
+    if image.content_type not in ALLOWED_IMAGE_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed: PNG, JPG, JPEG. Got: {image.content_type}"
+        )
+    
+    try:
+        image_bytes = await read_upload_limited(image, MAX_UPLOAD_SIZE)
+        inspect_image_header(image_bytes)
+    except UploadRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return image_bytes
+
+def build_image_url(filename: str) -> str:
+    """URL of a generated image, served by GET /images/{path}"""
+    return f"http://localhost:8001/images/{filename}"
+
+CLIENT_CLOSED_REQUEST = 499  # Non-standard status (as in nginx) for requests abandoned by the client
+
+async def wait_for_disconnect(http_request: Request):
+    """
+    Return once the client has closed the connection
+    
+    Only for requests whose body was already read: receive() then yields
+    nothing but the disconnect. (Request.is_disconnected() never reports
+    it behind the metrics middleware.)
+    """
+    while (await http_request.receive())["type"] != "http.disconnect":
+        pass
+
+async def wait_unless_disconnected(
+    http_request: Request,
+    waiter,
+    cancel_token: CancelToken,
+    on_disconnect: Optional[Callable[[], object]] = None
+):
+    """
+    Await an inference result, cancelling the work if the client disconnects
+    
+    Args:
+        http_request: The client's request (body already read)
+        waiter: Awaitable producing the result
+        cancel_token: The request's token; cancelling it stops the engine
+                      after its current denoising step
+        on_disconnect: Optional extra cleanup, e.g. dropping a task that
+                       has not started yet
+        
+    Returns:
+        The awaited result
+        
+    Raises:
+        GenerationCancelled: If the client disconnected first
+    """
+    waiter = asyncio.ensure_future(waiter)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(http_request))
+    try:
+        await asyncio.wait({waiter, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnected.cancel()
+    
+    if waiter.done():
+        return waiter.result()
+    
+    cancel_token.cancel(REASON_CLIENT_DISCONNECT)
+    if on_disconnect is not None:
+        on_disconnect()
+    # The abandoned work still ends (normally with GenerationCancelled); retrieve its outcome
+    waiter.add_done_callback(lambda task: task.cancelled() or task.exception())
+    raise GenerationCancelled("Client disconnected")
+
+async def admit(http_request: Request, kind: str, priority: Optional[str]) -> AdmissionTicket:
+    """
+    Wait for an admission slot before running a pipeline
+    
+    Clients are told apart by the X-Client-ID header (or their address),
+    so fair sharing works per client rather than per connection.
+    
+    Args:
+        http_request: The client's request (body already read)
+        kind: "txt2img" or "img2img"
+        priority: "interactive" (default) or "bulk"
+        
+    Returns:
+        AdmissionTicket; release it once the request is done
+        
+    Raises:
+        HTTPException: 429 with a Retry-After header when the queue is full
+        ValueError: If the priority is unknown
+        GenerationCancelled: If the client disconnected while waiting
+    """
+    client = http_request.headers.get("X-Client-ID") or (http_request.client.host if http_request.client else "unknown")
+    acquiring = asyncio.ensure_future(admission.acquire(client, priority or PRIORITY_INTERACTIVE, kind))
+    try:
+        return await wait_unless_disconnected(http_request, acquiring, CancelToken(), on_disconnect=acquiring.cancel)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
 # Request/Response models
 class ImageGenerationRequest(BaseModel):
     prompt: str
+    # Setting a seed enables deterministic mode: identical requests return the cached image
+    seed: Optional[int] = Field(None, ge=0, le=MAX_SEED)
+    # Variations of the prompt generated in one batch; `seeds` sets one seed per
+    # variation (deterministic mode), a single `seed` expands to seed, seed+1, ...
+    num_images: Optional[int] = Field(None, ge=1, le=MAX_IMAGES_PER_REQUEST)
+    seeds: Optional[List[int]] = None
+    # Quality tier (draft/standard/high) and/or target latency in seconds;
+    # with a budget, the best tier (up to `quality`) expected to fit is used
+    quality: Optional[str] = None
+    latency_budget: Optional[float] = Field(None, gt=0)
+    # Admission priority: "interactive" (default) or "bulk"; bulk waits behind interactive
+    priority: Optional[str] = None
 
 class ImageGenerationResponse(BaseModel):
     image_url: str
     refined_prompt: str
     original_prompt: str
+    seed: Optional[int] = None
+    cached: bool = False
+    quality: Optional[dict] = None
+    images: List[dict] = []  # image_url, seed, cached per variation (image_url/seed above = the first)
 
 class CartoonConversionResponse(BaseModel):
     image_url: str
     style: str
     original_filename: str
+    quality: Optional[dict] = None
+
+class MultiStyleConversionResponse(BaseModel):
+    images: Dict[str, str]  # style -> image URL
+    styles: List[str]
+    original_filename: str
+    quality: Optional[dict] = None
+
+class BulkRefineRequest(BaseModel):
+    prompts: List[str]
+
+class BulkRefineResponse(BaseModel):
+    results: List[dict]  # prompt, refined_prompt, source (cache/gemini/fallback)
+    sources: Dict[str, int]
+
+class JobSubmissionResponse(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
 
 @app.get("/")
 async def root():
@@ -65,78 +550,204 @@ async def root():
         "service": "AI Image Generation Service",
         "endpoints": {
             "generate": "/generate-image",
+            "generate_stream": "/generate-image/stream",
+            "refine_prompts": "/refine-prompts",
             "convert": "/convert-to-cartoon",
+            "convert_styles": "/convert-to-styles",
+            "metrics": "/metrics",
             "styles": "/styles",
-            "health": "/health"
+            "health": "/health",
+            "ready": "/ready",
+            "startup": "/startup",
+            "scheduler_stats": "/scheduler/stats",
+            "jobs": "/jobs",
+            "model_memory": "/models/memory",
+            "cache_stats": "/cache/stats",
+            "quality_tiers": "/quality/tiers"
         }
     }
 
+def current_load_status() -> dict:
+    """Load status of the in-process pipelines or of the inference workers"""
+    if inference_pool is not None:
+        return inference_pool.get_load_status()
+    return get_load_status()
+
 @app.get("/health")
 async def health_check():
-    """Detailed health check"""
+    """Detailed health check (liveness; see /ready for readiness)"""
+    load_status = current_load_status()
+    stages = load_status["stages"]
+    failed = any(stage["state"] == "failed" for stage in stages.values())
+    
+    if inference_pool is not None:
+        pipelines_state = "ready" if load_status["ready"] else "loading"
+        stable_diffusion_state = img2img_state = pipelines_state
+    else:
+        stable_diffusion_state = stages["txt2img"]["state"]
+        img2img_state = stages["img2img"]["state"]
+    
     return {
-        "status": "healthy",
-        "gemini": "configured",
-        "stable_diffusion": "ready",
-        "img2img": "ready",
+        "status": "degraded" if failed else "healthy",
+        "gemini": "configured" if GEMINI_API_KEY else "missing_api_key",
+        "gemini_refinement": get_refinement_status(),
+        "stable_diffusion": stable_diffusion_state,
+        "img2img": img2img_state,
+        "backend": get_backend_name(),
         "images_directory": str(IMAGES_DIR.absolute())
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe for load balancers
+    
+    Returns 200 once the model weights and both pipelines are loaded and
+    warmed up (in every inference worker, if enabled), 503 before that.
+    The body reports progress and per-stage load/warm-up times either way.
+    """
+    load_status = current_load_status()
+    return JSONResponse(
+        status_code=200 if load_status["ready"] else 503,
+        content=load_status
+    )
+
+@app.get("/startup")
+async def startup_report():
+    """
+    Startup cost of the API process
+    
+    Returns:
+        Seconds until the app served, import time per timed module and
+        which heavy modules (torch, diffusers, engines) are imported yet
+    """
+    return {
+        "status": "success",
+        "startup": get_startup_report()
+    }
+
 @app.post("/generate-image", response_model=ImageGenerationResponse)
-async def generate_image(request: ImageGenerationRequest):
+async def generate_image(request: ImageGenerationRequest, http_request: Request):
     """
     Main endpoint for AI image generation
     
     Flow:
     1. Validate input prompt
     2. Refine prompt using Gemini API
-    3. Generate image using Stable Diffusion
-    4. Save image locally
-    5. Return image URL
+    3. Pick steps/resolution/scheduler from the quality tier or latency budget;
+       if seeds are given, reuse cached results for identical settings
+    4. Generate the remaining variations with Stable Diffusion in one batch
+    5. Return image URLs with their seeds
+    
+    With num_images > 1 the prompt is refined and encoded once, and every
+    variation runs in the same batched denoising loop (one seed each).
+    
+    Requests wait for an admission slot first; when the admission queue is
+    full the response is a 429 with Retry-After. If the client disconnects
+    while the image is queued or generating, the request is dropped from
+    its batch (or the batch stops, when nobody else is waiting for it) at
+    the next denoising step.
     
     Args:
         request: ImageGenerationRequest with prompt text
+        http_request: Raw request, watched for a client disconnect
         
     Returns:
         ImageGenerationResponse with image_url and refined_prompt
     """
+    ticket = None
     try:
-        # Step 1: Validate prompt
-        if not request.prompt or len(request.prompt.strip()) == 0:
-            raise HTTPException(
-                status_code=400,
-                detail="Prompt cannot be empty"
-            )
-        
-        if len(request.prompt) > 500:
-            raise HTTPException(
-                status_code=400,
-                detail="Prompt too long. Maximum 500 characters."
-            )
+        # Step 1: Validate prompt, resolve seeds and quality settings, wait for admission
+        validate_prompt(request.prompt)
+        seeds, deterministic = resolve_seeds(request.seed, request.seeds, request.num_images)
+        settings = select_quality("txt2img", request.quality, request.latency_budget)
+        ticket = await admit(http_request, "txt2img", request.priority)
         
-        logger.info(f"Received prompt: {request.prompt}")
+        logger.info(
+            f"Received prompt: {request.prompt} "
+            f"(quality: {settings.tier}, {settings.steps} steps, {len(seeds)} image(s))"
+        )
         
-        # Step 2: Refine prompt using Gemini
+        # Step 2: Refine prompt using Gemini (off the event loop, bounded by a deadline)
         logger.info("Refining prompt with Gemini...")
-        refined_prompt = refine_prompt_with_gemini(request.prompt)
+        refined_prompt = await refine_prompt_async(request.prompt)
         logger.info(f"Refined prompt: {refined_prompt}")
         
-        # Step 3: Generate image using Stable Diffusion
-        logger.info("Generating image with Stable Diffusion...")
-        image_filename = generate_image_with_diffusion(refined_prompt)
-        logger.info(f"Image generated: {image_filename}")
+        # Step 3: In deterministic mode, reuse previous identical results
+        image_filenames = [None] * len(seeds)
+        output_filenames = [None] * len(seeds)
+        if deterministic:
+            for index, seed in enumerate(seeds):
+                result_key = await run_in_threadpool(get_result_key, refined_prompt, seed, settings=settings)
+                image_filenames[index] = result_cache.lookup(result_key)
+                output_filenames[index] = result_cache.filename_for(result_key)
+        missing = [index for index, filename in enumerate(image_filenames) if filename is None]
         
-        # Step 4: Construct image URL
-        # This URL will be accessible via the /images static mount
-        image_url = f"http://localhost:8001/images/{image_filename}"
+        if not missing:
+            logger.info(f"Result cache hit: {', '.join(image_filenames)}")
+            ticket.release(record=False)  # Not a measure of generation time
+        else:
+            # Step 4: Generate the missing variations using Stable Diffusion
+            # They stay in one batch (one denoising loop, the prompt encoded once),
+            # which the scheduler may share with other prompts of the same window
+            logger.info(f"Generating {len(missing)} image(s) with Stable Diffusion...")
+            # keep_going only reads the token: inference workers stream no latents
+            # for it, the pool polls the token and stops the task once all its
+            # items are cancelled
+            cancel_token = CancelToken()
+            futures = generation_scheduler.submit_group(
+                [
+                    {
+                        "prompt": refined_prompt,
+                        "seed": seeds[index],
+                        "filename": output_filenames[index],
+                        "step_callback": cancel_token.keep_going,
+                    }
+                    for index in missing
+                ],
+                settings=settings
+            )
+            
+            def drop_queued():
+                for future in futures:
+                    future.cancel()  # Not in a batch yet: it never runs
+            
+            generated = await wait_unless_disconnected(
+                http_request,
+                asyncio.gather(*(asyncio.wrap_future(future) for future in futures)),
+                cancel_token,
+                on_disconnect=drop_queued
+            )
+            for index, filename in zip(missing, generated):
+                image_filenames[index] = filename
+            logger.info(f"Image(s) generated: {', '.join(generated)}")
         
-        # Step 5: Return response
+        # Step 5: Construct image URLs
+        # These URLs will be accessible via GET /images/{path}
+        images = [
+            {"image_url": build_image_url(filename), "seed": seed, "cached": index not in missing}
+            for index, (filename, seed) in enumerate(zip(image_filenames, seeds))
+        ]
+        
+        # Step 6: Return response
         return ImageGenerationResponse(
-            image_url=image_url,
+            image_url=images[0]["image_url"],
             refined_prompt=refined_prompt,
-            original_prompt=request.prompt
+            original_prompt=request.prompt,
+            seed=seeds[0],
+            cached=not missing,
+            quality=tier_calibrator.describe(settings),
+            images=images
         )
         
+    except HTTPException:
+        # Re-raise HTTP exceptions as-is
+        raise
+    
+    except GenerationCancelled as e:
+        logger.info(f"Generation abandoned: {str(e)}")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    
     except ValueError as ve:
         logger.error(f"Validation error: {str(ve)}")
         raise HTTPException(status_code=400, detail=str(ve))
@@ -147,6 +758,248 @@ async def generate_image(request: ImageGenerationRequest):
             status_code=500,
             detail=f"Failed to generate image: {str(e)}"
         )
+    
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+# Emit a latent preview every N denoising steps on the streaming endpoint
+PREVIEW_EVERY_STEPS = int(os.getenv("PREVIEW_EVERY_STEPS", "5"))
+
+def format_sse(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/generate-image/stream")
+async def generate_image_stream(
+    http_request: Request,
+    prompt: str,
+    seed: Optional[int] = None,
+    quality: Optional[str] = None,
+    latency_budget: Optional[float] = None,
+    priority: Optional[str] = None
+):
+    """
+    Generate an image while streaming progress as Server-Sent Events
+    
+    Usable directly from the browser with
+    `new EventSource("/generate-image/stream?prompt=...")`.
+    
+    Events:
+    - refined:  {"refined_prompt"}
+    - preview:  {"step", "total_steps", "image"} every PREVIEW_EVERY_STEPS steps;
+                image is a small JPEG data URL from a linear latent-to-RGB map
+    - complete: {"image_url", "refined_prompt", "original_prompt", "seed", "quality", "image"}
+                where image is the final PNG as a data URL
+    - error:    {"detail"}
+    
+    Closing the connection stops the generation at the next step (unless
+    other requests share the same batch), freeing the worker early.
+    
+    The stream waits for an admission slot like /generate-image; when the
+    admission queue is full the response is a 429 with Retry-After.
+    """
+    validate_prompt(prompt)
+    if seed is not None and not 0 <= seed <= MAX_SEED:
+        raise HTTPException(status_code=400, detail="Seed must be between 0 and 2^32-1")
+    settings = select_quality("txt2img", quality, latency_budget)
+    try:
+        ticket = await admit(http_request, "txt2img", priority)
+    except GenerationCancelled as e:
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    
+    async def event_stream():
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        cancel_token = CancelToken()
+        future = None
+        
+        def on_step(step: int, total_steps: int, latents) -> bool:
+            """Runs on the batching thread after every denoising step"""
+            if cancel_token.cancelled:
+                return False
+            if (step + 1) % PREVIEW_EVERY_STEPS == 0 and step + 1 < total_steps:
+                payload = {
+                    "step": step + 1,
+                    "total_steps": total_steps,
+                    "image": encode_preview(latents)
+                }
+                loop.call_soon_threadsafe(events.put_nowait, ("preview", payload))
+            return True
+        
+        try:
+            refined_prompt = await refine_prompt_async(prompt)
+            yield format_sse("refined", {"refined_prompt": refined_prompt})
+            
+            future = generation_scheduler.submit(
+                refined_prompt,
+                seed=seed,
+                step_callback=on_step,
+                settings=settings
+            )
+            future.add_done_callback(
+                lambda _: loop.call_soon_threadsafe(events.put_nowait, ("done", None))
+            )
+            
+            while True:
+                event, payload = await events.get()
+                if event == "done":
+                    break
+                yield format_sse(event, payload)
+            
+            image_filename = future.result()
+            await run_in_threadpool(image_store.wait, image_filename)
+            image_bytes = await run_in_threadpool(image_store.resolve(image_filename).read_bytes)
+            media_type = MEDIA_TYPES.get(image_filename.rsplit(".", 1)[-1], "image/png")
+            
+            yield format_sse("complete", {
+                "image_url": build_image_url(image_filename),
+                "refined_prompt": refined_prompt,
+                "original_prompt": prompt,
+                "seed": seed,
+                "quality": tier_calibrator.describe(settings),
+                "image": f"data:{media_type};base64," + base64.b64encode(image_bytes).decode("ascii")
+            })
+        
+        except GenerationCancelled:
+            logger.info("Streaming generation abandoned by client")
+        
+        except Exception as e:
+            logger.error(f"Error in streaming generation: {str(e)}")
+            yield format_sse("error", {"detail": f"Failed to generate image: {str(e)}"})
+        
+        finally:
+            # Runs when the client disconnects too: stop denoising for this request
+            if future is not None and not future.done():
+                cancel_token.cancel(REASON_CLIENT_DISCONNECT)
+                future.cancel()  # Not in a batch yet: it never runs
+            ticket.release()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release)  # In case the stream never started
+    )
+
+@app.post("/refine-prompts", response_model=BulkRefineResponse)
+async def refine_prompts(request: BulkRefineRequest):
+    """
+    Refine many prompts at once (e.g. for template generation runs)
+    
+    Prompts are packed into a few Gemini calls with structured (JSON)
+    output; each result is checked for the required terms, and items
+    Gemini could not refine get the rule-based fallback.
+    
+    Args:
+        request: BulkRefineRequest with up to MAX_BULK_PROMPTS prompts
+        
+    Returns:
+        BulkRefineResponse with one result per prompt, in order
+    """
+    if not request.prompts:
+        raise HTTPException(status_code=400, detail="At least one prompt is required")
+    if len(request.prompts) > MAX_BULK_PROMPTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many prompts. Maximum: {MAX_BULK_PROMPTS}. Got: {len(request.prompts)}"
+        )
+    for prompt in request.prompts:
+        validate_prompt(prompt)
+    
+    try:
+        results = await run_in_threadpool(refine_prompts_bulk, [prompt.strip() for prompt in request.prompts])
+    except Exception as e:
+        logger.error(f"Error refining prompts: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to refine prompts: {str(e)}")
+    
+    sources = {"cache": 0, "gemini": 0, "fallback": 0}
+    for result in results:
+        sources[result["source"]] += 1
+    
+    return BulkRefineResponse(results=results, sources=sources)
+
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """
+    Get admission and micro-batching statistics for /generate-image
+    
+    Returns:
+        Dictionary with admission queue state and rejections, batch sizes,
+        queue wait times and throughput counters
+    """
+    return {
+        "status": "success",
+        "admission": admission.get_stats(),
+        "batching": generation_scheduler.get_stats(),
+        "workers": inference_pool.get_stats() if inference_pool is not None else None
+    }
+
+@app.get("/models/memory")
+async def get_model_memory():
+    """
+    Report memory held by the shared Stable Diffusion weights
+    
+    Returns:
+        Per-module sizes and how much sharing saves versus one copy per pipeline
+    """
+    return {
+        "status": "success",
+        "memory": await run_in_threadpool(get_memory_report)
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Service metrics in the Prometheus text exposition format
+    
+    Stage latency histograms (Gemini refinement, diffusion, VAE encode and
+    decode, image encode), request/error counters and latency per endpoint,
+    in-flight and queued requests, pipeline load times and process RSS.
+    
+    Rendering runs the gauge callbacks (SQLite job-queue depth, RSS read),
+    so it happens off the event loop.
+    """
+    body = await run_in_threadpool(registry.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.get("/quality/tiers")
+async def get_quality_tiers():
+    """
+    Get the quality tiers and their expected latency on this host
+    
+    Returns:
+        Tier settings, latency estimates and the calibration table
+    """
+    return {
+        "status": "success",
+        "quality": tier_calibrator.get_report()
+    }
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Get hit/miss statistics for the service's caches
+    
+    Returns:
+        Dictionary of per-cache statistics
+    """
+    # The tensor caches live in torch-importing modules (imported off the event loop)
+    embedding_cache = (await run_in_threadpool(timed_import, "embedding_cache")).embedding_cache
+    latent_cache = (await run_in_threadpool(timed_import, "latent_cache")).latent_cache
+    
+    return {
+        "status": "success",
+        "caches": {
+            "prompt_embeddings": embedding_cache.get_stats(),
+            "prompt_refinement": prompt_cache.get_stats(),
+            "generated_images": result_cache.get_stats(),
+            "image_store": image_store.get_stats(),
+            "upload_latents": latent_cache.get_stats()
+        }
+    }
 
 @app.get("/styles")
 async def get_styles():
@@ -169,9 +1022,13 @@ async def get_styles():
 
 @app.post("/convert-to-cartoon", response_model=CartoonConversionResponse)
 async def convert_to_cartoon(
+    http_request: Request,
     image: UploadFile = File(..., description="Image file to convert"),
     style: str = Form("cartoon", description="Style to apply: cartoon, anime, watercolor, pencil_sketch"),
-    strength: Optional[float] = Form(None, description="Denoising strength (0.0-1.0, default: 0.55)")
+    strength: Optional[float] = Form(None, description="Denoising strength (0.0-1.0, default: 0.55)"),
+    quality: Optional[str] = Form(None, description="Quality tier: draft, standard, high"),
+    latency_budget: Optional[float] = Form(None, description="Target latency in seconds"),
+    priority: Optional[str] = Form(None, description="Admission priority: interactive (default) or bulk")
 ):
     """
     Convert an uploaded image to cartoon/artistic style using Stable Diffusion img2img
@@ -183,73 +1040,193 @@ async def convert_to_cartoon(
     4. Save converted image
     5. Return image URL
     
+    Waits for an admission slot like /generate-image (429 with Retry-After
+    when the queue is full). A client disconnect stops the conversion at
+    the next denoising step.
+    
     Args:
+        http_request: Raw request, watched for a client disconnect
         image: Uploaded image file (PNG, JPG, JPEG)
         style: Style to apply (cartoon, anime, watercolor, pencil_sketch)
         strength: Optional denoising strength (0.0-1.0)
+        quality: Optional quality tier (draft, standard, high)
+        latency_budget: Optional target latency in seconds
+        priority: Optional admission priority (interactive, bulk)
         
     Returns:
         CartoonConversionResponse with image_url and style info
     """
+    ticket = None
     try:
-        # Step 1: Validate file type
-        allowed_types = ["image/png", "image/jpeg", "image/jpg"]
-        if image.content_type not in allowed_types:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid file type. Allowed: PNG, JPG, JPEG. Got: {image.content_type}"
-            )
-        
-        # Validate file size (max 10MB)
-        max_size = 10 * 1024 * 1024  # 10MB
-        image_bytes = await image.read()
-        
-        if len(image_bytes) > max_size:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large. Maximum size: 10MB. Got: {len(image_bytes) / 1024 / 1024:.2f}MB"
-            )
-        
-        if len(image_bytes) == 0:
-            raise HTTPException(
-                status_code=400,
-                detail="Empty file uploaded"
-            )
+        # Step 1: Validate file type and size (max 10MB)
+        image_bytes = await read_validated_upload(image)
         
         logger.info(f"Received image: {image.filename} ({len(image_bytes)} bytes)")
         logger.info(f"Style: {style}, Strength: {strength}")
         
-        # Step 2: Validate style
-        available_styles = get_available_styles()
-        if style not in available_styles:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid style. Available: {', '.join(available_styles)}"
-            )
+        # Step 2: Validate style, resolve quality settings and wait for admission
+        validate_style(style)
+        effective_strength = strength if strength is not None else DENOISING_STRENGTH
+        settings = select_quality("img2img", quality, latency_budget, effective_strength)
+        ticket = await admit(http_request, "img2img", priority)
         
-        # Step 3: Convert image using img2img
+        # Step 3: Convert image using img2img (blocking, kept off the event loop)
         logger.info(f"Converting image to {style} style...")
-        converted_filename = convert_image_to_style(
-            image_bytes=image_bytes,
-            style=style,
-            strength=strength
-        )
+        cancel_token = CancelToken()
+        if inference_pool is not None:
+            future = inference_pool.submit(
+                TASK_CONVERT,
+                image_bytes=image_bytes,
+                style=style,
+                strength=strength,
+                settings=settings
+            )
+            converted_filename = await wait_unless_disconnected(
+                http_request,
+                asyncio.wrap_future(future),
+                cancel_token,
+                on_disconnect=lambda: inference_pool.cancel(future)
+            )
+        else:
+            converted_filename = await wait_unless_disconnected(
+                http_request,
+                run_in_threadpool(
+                    convert_image_to_style,
+                    image_bytes=image_bytes,
+                    style=style,
+                    strength=strength,
+                    settings=settings,
+                    cancel_token=cancel_token
+                ),
+                cancel_token
+            )
         logger.info(f"Image converted: {converted_filename}")
         
         # Step 4: Construct image URL
-        image_url = f"http://localhost:8001/images/{converted_filename}"
+        image_url = build_image_url(converted_filename)
         
         # Step 5: Return response
         return CartoonConversionResponse(
             image_url=image_url,
             style=style,
-            original_filename=image.filename
+            original_filename=image.filename,
+            quality=tier_calibrator.describe(settings, effective_strength)
         )
         
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
     
+    except GenerationCancelled as e:
+        logger.info(f"Conversion abandoned: {str(e)}")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    
+    except ValueError as ve:
+        logger.error(f"Validation error: {str(ve)}")
+        raise HTTPException(status_code=400, detail=str(ve))
+    
+    except Exception as e:
+        logger.error(f"Error converting image: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to convert image: {str(e)}"
+        )
+    
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+@app.post("/convert-to-styles", response_model=MultiStyleConversionResponse)
+async def convert_to_styles(
+    http_request: Request,
+    image: UploadFile = File(..., description="Image file to convert"),
+    styles: str = Form(
+        "cartoon,anime,watercolor,pencil_sketch",
+        description="Comma-separated styles to apply (default: all)"
+    ),
+    strength: Optional[float] = Form(None, description="Denoising strength (0.0-1.0, default: 0.55)"),
+    quality: Optional[str] = Form(None, description="Quality tier: draft, standard, high"),
+    latency_budget: Optional[float] = Form(None, description="Target latency in seconds"),
+    priority: Optional[str] = Form(None, description="Admission priority: interactive (default) or bulk")
+):
+    """
+    Convert one uploaded image to several styles in a single batched img2img pass
+    
+    The image is decoded and VAE-encoded once and every style is one item
+    of the same batch, which is much cheaper than one /convert-to-cartoon
+    call per style. Admission and disconnect handling are the same as for
+    /convert-to-cartoon.
+    
+    Args:
+        http_request: Raw request, watched for a client disconnect
+        image: Uploaded image file (PNG, JPG, JPEG)
+        styles: Comma-separated styles (cartoon, anime, watercolor, pencil_sketch)
+        strength: Optional denoising strength (0.0-1.0)
+        quality: Optional quality tier (draft, standard, high)
+        latency_budget: Optional target latency in seconds (for the whole batch's tier choice)
+        priority: Optional admission priority (interactive, bulk)
+        
+    Returns:
+        MultiStyleConversionResponse with one image URL per style
+    """
+    ticket = None
+    try:
+        # Step 1: Validate file type and size (max 10MB)
+        image_bytes = await read_validated_upload(image)
+        
+        # Step 2: Validate styles, resolve quality settings and wait for admission
+        style_list = parse_styles(styles)
+        effective_strength = strength if strength is not None else DENOISING_STRENGTH
+        settings = select_quality("img2img", quality, latency_budget, effective_strength)
+        ticket = await admit(http_request, "img2img", priority)
+        
+        logger.info(f"Received image: {image.filename} ({len(image_bytes)} bytes), styles: {', '.join(style_list)}")
+        
+        # Step 3: Convert to every style in one batch (blocking, kept off the event loop)
+        cancel_token = CancelToken()
+        if inference_pool is not None:
+            future = inference_pool.submit(
+                TASK_CONVERT_STYLES,
+                image_bytes=image_bytes,
+                styles=style_list,
+                strength=strength,
+                settings=settings
+            )
+            filenames = await wait_unless_disconnected(
+                http_request,
+                asyncio.wrap_future(future),
+                cancel_token,
+                on_disconnect=lambda: inference_pool.cancel(future)
+            )
+        else:
+            filenames = await wait_unless_disconnected(
+                http_request,
+                run_in_threadpool(
+                    convert_image_to_styles,
+                    image_bytes=image_bytes,
+                    styles=style_list,
+                    strength=strength,
+                    settings=settings,
+                    cancel_token=cancel_token
+                ),
+                cancel_token
+            )
+        
+        # Step 4: Return every image URL
+        return MultiStyleConversionResponse(
+            images={style: build_image_url(filename) for style, filename in filenames.items()},
+            styles=style_list,
+            original_filename=image.filename,
+            quality=tier_calibrator.describe(settings, effective_strength)
+        )
+        
+    except HTTPException:
+        raise
+    
+    except GenerationCancelled as e:
+        logger.info(f"Conversion abandoned: {str(e)}")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    
     except ValueError as ve:
         logger.error(f"Validation error: {str(ve)}")
         raise HTTPException(status_code=400, detail=str(ve))
@@ -260,17 +1237,175 @@ async def convert_to_cartoon(
             status_code=500,
             detail=f"Failed to convert image: {str(e)}"
         )
+    
+    finally:
+        if ticket is not None:
+            ticket.release()
 
-@app.delete("/images/{filename}")
+@app.post("/jobs", response_model=JobSubmissionResponse, status_code=202)
+async def submit_job(
+    kind: str = Form(..., description="Job kind: generate_image or convert_to_cartoon"),
+    prompt: Optional[str] = Form(None, description="Prompt text (generate_image)"),
+    image: Optional[UploadFile] = File(None, description="Image file to convert (convert_to_cartoon)"),
+    style: str = Form("cartoon", description="Style to apply (convert_to_cartoon)"),
+    strength: Optional[float] = Form(None, description="Denoising strength (convert_to_cartoon)"),
+    quality: Optional[str] = Form(None, description="Quality tier: draft, standard, high"),
+    latency_budget: Optional[float] = Form(None, description="Target latency in seconds")
+):
+    """
+    Queue an image generation or style conversion job
+    
+    The job is stored in the durable queue and picked up by a worker process,
+    so this returns immediately. Poll GET /jobs/{job_id} for the result.
+    
+    Returns:
+        JobSubmissionResponse with job_id and status URL
+    """
+    if kind not in JOB_KINDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid job kind. Available: {', '.join(JOB_KINDS)}"
+        )
+    
+    if kind == JOB_KIND_GENERATE:
+        validate_prompt(prompt)
+        settings = select_quality("txt2img", quality, latency_budget)
+        params = {"prompt": prompt}
+        input_bytes = None
+    else:
+        if image is None:
+            raise HTTPException(status_code=400, detail="An image file is required")
+        input_bytes = await read_validated_upload(image)
+        validate_style(style)
+        settings = select_quality(
+            "img2img",
+            quality,
+            latency_budget,
+            strength if strength is not None else DENOISING_STRENGTH
+        )
+        params = {
+            "style": style,
+            "strength": strength,
+            "original_filename": image.filename
+        }
+    
+    # Settings are resolved here, where the host calibration is loaded
+    params["settings"] = asdict(settings)
+    
+    job_id = await run_in_threadpool(job_queue.enqueue, kind, params, input_bytes)
+    
+    return JobSubmissionResponse(
+        job_id=job_id,
+        status="queued",
+        status_url=f"/jobs/{job_id}"
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Get the status and result of a queued job
+    
+    Args:
+        job_id: Id returned by POST /jobs
+        wait: Optional long-poll time in seconds (max 60); returns as soon
+              as the job finishes or the wait expires
+        
+    Returns:
+        Job status, queue position, timestamps and (when finished) result or error
+    """
+    deadline = time.monotonic() + max(0.0, min(wait, JOB_MAX_WAIT_SECONDS))
+    
+    while True:
+        job = await run_in_threadpool(job_queue.get, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        
+        if job["status"] in FINAL_STATUSES or time.monotonic() >= deadline:
+            break
+        
+        await asyncio.sleep(0.5)
+    
+    result = job["result"]
+    if result and result.get("image_filename"):
+        result["image_url"] = build_image_url(result["image_filename"])
+    
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "queue_position": await run_in_threadpool(job_queue.queue_position, job_id),
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "cancel_requested": bool(job["cancel_requested"]),
+        "result": result,
+        "error": job["error"]
+    }
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancel a queued or running job
+    
+    A queued job is cancelled immediately. A running job is flagged; its
+    worker stops after the current denoising step (checked every
+    JOB_CANCEL_POLL_SECONDS) and the job ends with status "cancelled".
+    
+    Args:
+        job_id: Id returned by POST /jobs
+        
+    Returns:
+        Job id and status after the call ("cancelled" or "running" while the worker stops)
+    """
+    status, changed = await run_in_threadpool(job_queue.cancel, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if status not in (STATUS_CANCELLED, STATUS_RUNNING):
+        raise HTTPException(status_code=409, detail=f"Job already finished ({status})")
+    
+    if changed:
+        cancelled_requests_total.inc(reason=REASON_JOB_CANCELLED)
+    
+    return {
+        "job_id": job_id,
+        "status": status,
+        "status_url": f"/jobs/{job_id}"
+    }
+
+@app.get("/images/{filename:path}")
+async def get_image(filename: str):
+    """
+    Serve a generated image
+    
+    Images are encoded in the background, so a freshly returned URL may
+    point at a file that is still being written; wait for it before serving.
+    """
+    path = image_store.resolve(filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    pending = image_store.pending_future(filename)
+    if pending is not None:
+        try:
+            await asyncio.wrap_future(pending)
+        except Exception:
+            raise HTTPException(status_code=500, detail="Image encoding failed")
+    
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    return FileResponse(path, media_type=MEDIA_TYPES.get(path.suffix.lstrip(".")))
+
+@app.delete("/images/{filename:path}")
 async def delete_image(filename: str):
     """Optional: Delete a generated image"""
     try:
-        image_path = IMAGES_DIR / filename
-        if image_path.exists():
-            image_path.unlink()
+        if await run_in_threadpool(image_store.delete, filename):
             return {"status": "deleted", "filename": filename}
         else:
             raise HTTPException(status_code=404, detail="Image not found")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,274 @@
+"""
+Service Metrics Module
+Counters, gauges and latency histograms rendered in the Prometheus text
+exposition format for GET /metrics
+"""
+
+import os
+import time
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+METRICS_PREFIX = "ai_service"
+
+# Bucket upper bounds (seconds): inference on CPU takes minutes, encodes take milliseconds
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+REQUEST_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    """Base class: a named metric family with a fixed set of label names"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """(suffix, formatted labels, value) for every series"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """Monotonically increasing count per label set"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [("_total", _format_labels(self.label_names, key), value) for key, value in sorted(values.items())]
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down per label set
+
+    With a callback, the gauge is read at scrape time instead: the callback
+    returns {label values tuple: value} (or a number for an unlabelled gauge).
+    """
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Iterable[str] = (),
+        callback: Optional[Callable[[], object]] = None
+    ):
+        super().__init__(name, documentation, label_names)
+        self._values = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                logger.warning(f"Could not read gauge {self.name}: {str(e)}")
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+
+        return [
+            ("", _format_labels(self.label_names, key), value)
+            for key, value in sorted(values.items())
+            if value is not None
+        ]
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets per label set"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Iterable[str] = (),
+        buckets: Iterable[float] = STAGE_BUCKETS
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 2))
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block (also when it raises)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+
+        samples = []
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names + ("le",), key + (_format_value(bound),))
+                samples.append(("_bucket", bucket_labels, cumulative))
+            labels = _format_labels(self.label_names, key)
+            samples.append(("_sum", labels, values[-1]))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+class MetricsRegistry:
+    """Ordered collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+def get_process_rss_bytes() -> int:
+    """Current resident set size of this process (0 where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+# Shared registry and the service's metrics
+registry = MetricsRegistry()
+
+stage_seconds = registry.register(Histogram(
+    "stage_duration_seconds",
+    "Duration of pipeline stages (gemini_refine, gemini_refine_bulk, diffusion, vae_encode, vae_decode, image_encode, worker_task)",
+    ["stage"]
+))
+requests_total = registry.register(Counter(
+    "http_requests",
+    "HTTP requests by endpoint, method and status code",
+    ["endpoint", "method", "status"]
+))
+request_errors_total = registry.register(Counter(
+    "http_request_errors",
+    "HTTP requests that ended with a 4xx or 5xx status, by endpoint",
+    ["endpoint", "status_class"]
+))
+request_seconds = registry.register(Histogram(
+    "http_request_duration_seconds",
+    "Time until the response headers were ready, by endpoint",
+    ["endpoint"],
+    buckets=REQUEST_BUCKETS
+))
+requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being handled"
+))
+registry.register(Gauge(
+    "process_resident_memory_bytes",
+    "Resident memory of the API process",
+    callback=get_process_rss_bytes
+))
+
+@contextmanager
+def stage_timer(stage: str):
+    """Record the duration of a pipeline stage in stage_duration_seconds"""
+    with stage_seconds.time(stage=stage):
+        yield
+
+class PipelineTimer:
+    """
+    Splits one diffusers pipeline call into "diffusion" (prompt handling and
+    denoising) and "vae_decode" time, using the per-step callback to mark
+    the end of the last denoising step
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last_step_at = None
+
+    def step(self):
+        """Call from the pipeline's step callback"""
+        self.last_step_at = time.perf_counter()
+
+    def on_step_end(self, pipeline, step, timestep, callback_kwargs):
+        """Ready-made callback_on_step_end for torch pipelines"""
+        self.step()
+        return callback_kwargs
+
+    def finish(self):
+        """Call once the pipeline returned its images"""
+        ended = time.perf_counter()
+        if self.last_step_at is None:
+            stage_seconds.observe(ended - self.started, stage="diffusion")
+            return
+        stage_seconds.observe(self.last_step_at - self.started, stage="diffusion")
+        stage_seconds.observe(ended - self.last_step_at, stage="vae_decode")
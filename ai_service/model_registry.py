@@ -0,0 +1,347 @@
+"""
+Shared Model Registry
+Loads the Stable Diffusion weights once and builds the txt2img and img2img
+pipelines from the same UNet, VAE and text encoder modules
+"""
+
+import os
+import time
+import threading
+import torch
+from PIL import Image
+from diffusers import (
+    StableDiffusionPipeline,
+    StableDiffusionImg2ImgPipeline,
+    DPMSolverMultistepScheduler,
+)
+import logging
+
+from onnx_backend import (
+    is_onnx_backend,
+    get_backend_name,
+    load_onnx_components,
+    build_onnx_pipeline,
+    get_onnx_model_files_mb,
+)
+from load_status import LOAD_STAGES, set_stage_status, get_stage_state
+from residency import residency, release_freed_memory, MODEL_CPU_OFFLOAD
+from cpu_fastpath import apply_cpu_fast_path, fast_path_autocast, get_fast_path_status
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MODEL_ID = "runwayml/stable-diffusion-v1-5"  # Free, open-source model
+WARMUP_IMAGE_SIZE = int(os.getenv("WARMUP_IMAGE_SIZE", "512"))  # Match real requests to prime allocators
+
+# Pipeline classes built on top of the shared components
+PIPELINE_CLASSES = {
+    "txt2img": StableDiffusionPipeline,
+    "img2img": StableDiffusionImg2ImgPipeline,
+}
+
+# Scheduler variants (all DPM-Solver++), selectable per quality tier
+DEFAULT_SCHEDULER = "dpm++"
+SCHEDULER_OPTIONS = {
+    "dpm++": {},
+    "dpm++_karras": {"use_karras_sigmas": True},  # Finer spacing at low noise, better detail
+}
+
+# Shared components (loaded once) and the pipelines built from them
+_components = None
+_pipelines = {}
+
+# Loading is single-flight: concurrent first callers wait for one load
+_load_lock = threading.RLock()
+
+def get_device() -> str:
+    """Device used for inference (CUDA if available, else CPU)"""
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def load_shared_components() -> dict:
+    """
+    Load the Stable Diffusion weights into memory once
+
+    With SD_BACKEND=onnx the weights are ONNX Runtime sessions instead of
+    torch modules (exported and cached on first use).
+
+    Returns:
+        Dictionary of pipeline components (unet, vae, text_encoder, tokenizer, ...)
+    """
+    global _components
+
+    if _components is not None:
+        return _components
+
+    with _load_lock:
+        if _components is not None:
+            return _components  # Loaded by a concurrent caller while we waited
+
+        reloading = get_stage_state("weights") == "evicted"
+        set_stage_status("weights", state="loading", error=None)
+        started = time.perf_counter()
+
+        try:
+            if is_onnx_backend():
+                components = load_onnx_components(MODEL_ID)
+            else:
+                logger.info("Loading Stable Diffusion weights (this may take a few minutes on first run)...")
+
+                device = get_device()
+                logger.info(f"Using device: {device}")
+
+                pipe = StableDiffusionPipeline.from_pretrained(
+                    MODEL_ID,
+                    torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+                    safety_checker=None,  # Disable for academic use
+                    requires_safety_checker=False
+                )
+                if MODEL_CPU_OFFLOAD and device == "cuda":
+                    # Each submodule moves to the GPU only while it runs
+                    pipe.enable_model_cpu_offload()
+                else:
+                    pipe = pipe.to(device)
+
+                # Opt-in channels-last / torch.compile / bf16 path on CPU
+                components = apply_cpu_fast_path(dict(pipe.components))
+                logger.info("✓ Stable Diffusion weights loaded")
+        except Exception as e:
+            set_stage_status("weights", state="failed", error=str(e))
+            raise
+
+        _components = components
+        if reloading:
+            residency.record_reload()
+        residency.start()
+        set_stage_status("weights", state="ready", load_seconds=round(time.perf_counter() - started, 2))
+
+    return _components
+
+def build_pipeline(kind: str, scheduler: str = DEFAULT_SCHEDULER):
+    """
+    Build a new pipeline on the shared weights with a fresh scheduler
+
+    Unlike get_pipeline, the result is not cached; use it for work that
+    must not share scheduler state with request handling (e.g. calibration).
+
+    Args:
+        kind: "txt2img" or "img2img"
+        scheduler: Scheduler variant from SCHEDULER_OPTIONS
+
+    Returns:
+        StableDiffusionPipeline or StableDiffusionImg2ImgPipeline instance
+    """
+    if kind not in PIPELINE_CLASSES:
+        raise ValueError(f"Unknown pipeline kind: {kind}")
+    if scheduler not in SCHEDULER_OPTIONS:
+        raise ValueError(f"Unknown scheduler: {scheduler}")
+
+    components = dict(load_shared_components())
+
+    # Use DPM-Solver++ scheduler for faster generation
+    base_scheduler = components["pipeline"].scheduler if is_onnx_backend() else components["scheduler"]
+    scheduler_instance = DPMSolverMultistepScheduler.from_config(
+        base_scheduler.config,
+        **SCHEDULER_OPTIONS[scheduler]
+    )
+
+    if is_onnx_backend():
+        return build_onnx_pipeline(kind, components, scheduler_instance)
+
+    components["scheduler"] = scheduler_instance
+    pipe = PIPELINE_CLASSES[kind](**components, requires_safety_checker=False)
+
+    # Enable memory optimizations for CPU/low-memory systems
+    if get_device() == "cpu":
+        pipe.enable_attention_slicing()
+
+    return pipe
+
+def get_pipeline(kind: str, scheduler: str = DEFAULT_SCHEDULER):
+    """
+    Get a pipeline that shares its weights with every other pipeline
+
+    Each pipeline gets its own scheduler instance, because schedulers keep
+    per-run state (step index, model outputs) and must not be shared.
+
+    Args:
+        kind: "txt2img" or "img2img"
+        scheduler: Scheduler variant from SCHEDULER_OPTIONS
+
+    Returns:
+        StableDiffusionPipeline or StableDiffusionImg2ImgPipeline instance
+    """
+    key = kind if scheduler == DEFAULT_SCHEDULER else f"{kind}:{scheduler}"
+    residency.touch(key)
+    pipe = _pipelines.get(key)
+    if pipe is not None:
+        return pipe
+
+    with _load_lock:
+        if key in _pipelines:
+            return _pipelines[key]
+
+        track = key in LOAD_STAGES
+        reloading = track and get_stage_state(key) == "evicted"
+        if track:
+            set_stage_status(key, state="loading", error=None)
+        started = time.perf_counter()
+
+        try:
+            pipe = build_pipeline(kind, scheduler)
+        except Exception as e:
+            if track:
+                set_stage_status(key, state="failed", error=str(e))
+            raise
+
+        _pipelines[key] = pipe
+        if track:
+            # A reloaded pipeline was warmed up before its eviction
+            set_stage_status(
+                key,
+                state="ready" if reloading else "loaded",
+                load_seconds=round(time.perf_counter() - started, 2)
+            )
+        logger.info(f"✓ {key} pipeline ready (shared weights, {get_backend_name()} backend)")
+
+    return pipe
+
+def evict_pipeline(key: str) -> bool:
+    """
+    Drop a pipeline, and the shared weights once no pipeline is left
+
+    Called by the residency manager for idle pipelines; the next
+    get_pipeline() reloads them. Skipped while a load is in progress.
+
+    Args:
+        key: Pipeline key ("txt2img", "img2img" or "<kind>:<scheduler>")
+
+    Returns:
+        True if the pipeline was dropped
+    """
+    global _components
+
+    if not _load_lock.acquire(blocking=False):
+        return False
+    try:
+        if _pipelines.pop(key, None) is None:
+            return False
+        residency.forget(key)
+        if key in LOAD_STAGES:
+            set_stage_status(key, state="evicted")
+
+        if not _pipelines and _components is not None and not residency.any_in_use():
+            _components = None
+            set_stage_status("weights", state="evicted")
+            logger.info("Shared Stable Diffusion weights unloaded (no pipeline left)")
+    finally:
+        _load_lock.release()
+
+    release_freed_memory()
+    return True
+
+residency.set_evictor(evict_pipeline)
+
+def warm_up_pipeline(kind: str):
+    """
+    Run one tiny inference so the first real request does not pay for
+    kernel selection, allocator growth and lazy initialisation
+
+    Uses a private pipeline instance (same weights) so a request arriving
+    meanwhile never shares scheduler state with the warm-up run.
+
+    Args:
+        kind: "txt2img" or "img2img"
+    """
+    with residency.in_use(kind):
+        get_pipeline(kind)
+        pipe = build_pipeline(kind)
+        started = time.perf_counter()
+
+        options = {"prompt": "warm-up", "num_inference_steps": 2, "guidance_scale": 7.5}
+        if kind == "img2img":
+            options["image"] = Image.new("RGB", (WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE), (255, 255, 255))
+            options["strength"] = 0.5
+        else:
+            options["height"] = options["width"] = WARMUP_IMAGE_SIZE
+
+        with torch.no_grad(), fast_path_autocast():  # Also compiles the fast path's graphs
+            pipe(**options)
+
+    set_stage_status(kind, state="ready", warmup_seconds=round(time.perf_counter() - started, 2))
+    logger.info(f"✓ {kind} pipeline warmed up")
+
+def preload_models(kinds: tuple = ("txt2img", "img2img")):
+    """
+    Load the weights and every pipeline, then warm each one up
+
+    Safe to call while requests are already loading models: loading is
+    single-flight, so the work is never done twice.
+
+    Returns:
+        True if every pipeline is loaded and warm
+    """
+    for kind in kinds:
+        try:
+            warm_up_pipeline(kind)
+        except Exception as e:
+            logger.error(f"Failed to preload {kind} pipeline: {str(e)}")
+            set_stage_status(kind, state="failed", error=str(e))
+            return False
+    return True
+
+def _module_bytes(module: torch.nn.Module) -> int:
+    """Size of a module's parameters and buffers in bytes"""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+def get_memory_report() -> dict:
+    """
+    Report how much memory sharing the weights saves
+
+    Compares the resident size of the shared modules with what the loaded
+    pipelines would hold if each had its own copy (the previous behaviour).
+
+    Returns:
+        Dictionary with per-module sizes and shared vs. unshared totals (MB)
+    """
+    if _components is None:
+        return {
+            "loaded": False,
+            "residency": residency.get_stats(),
+            "backend": get_backend_name(),
+            "cpu_fast_path": get_fast_path_status(),
+            "pipelines": [],
+            "modules_mb": {},
+            "shared_total_mb": 0.0,
+            "unshared_total_mb": 0.0,
+            "saved_mb": 0.0
+        }
+
+    to_mb = lambda num_bytes: round(num_bytes / 1024 / 1024, 1)
+
+    if is_onnx_backend():
+        # ONNX weights live in the Runtime sessions; report their size on disk
+        modules_mb = get_onnx_model_files_mb(_components)
+    else:
+        modules_mb = {
+            name: to_mb(_module_bytes(component))
+            for name, component in _components.items()
+            if isinstance(component, torch.nn.Module)
+        }
+    shared_total = sum(modules_mb.values())
+    # Scheduler variants ("txt2img:dpm++_karras") never had weights of their
+    # own; before sharing, only txt2img and img2img each held a copy
+    kinds = {key.split(":", 1)[0] for key in _pipelines}
+    unshared_total = shared_total * max(1, len(kinds))
+
+    return {
+        "loaded": True,
+        "residency": residency.get_stats(),
+        "backend": get_backend_name(),
+        "cpu_fast_path": get_fast_path_status(),
+        "pipelines": sorted(_pipelines.keys()),
+        "modules_mb": modules_mb,
+        "shared_total_mb": round(shared_total, 1),
+        "unshared_total_mb": round(unshared_total, 1),
+        "saved_mb": round(unshared_total - shared_total, 1)
+    }
@@ -0,0 +1,208 @@
+"""
+ONNX Runtime Backend Module
+Optional CPU inference backend: exports the Stable Diffusion text encoder,
+UNet and VAE to ONNX once, caches the artifacts locally and runs them with
+ONNX Runtime (optionally with a dynamically int8-quantized UNet)
+
+Requires the optional packages: pip install "optimum[onnxruntime]"
+"""
+
+import os
+import shutil
+import logging
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SD_BACKEND = os.getenv("SD_BACKEND", "pytorch").lower()  # pytorch or onnx
+ONNX_CACHE_DIR = Path(os.getenv("ONNX_CACHE_DIR", "cache/onnx"))
+ONNX_QUANTIZE_UNET = os.getenv("ONNX_QUANTIZE_UNET", "0") == "1"
+ONNX_PROVIDER = "CPUExecutionProvider"
+EXPORT_COMPLETE_MARKER = ".export_complete"
+
+def is_onnx_backend() -> bool:
+    """True if the service is configured to run on ONNX Runtime"""
+    return SD_BACKEND == "onnx"
+
+def get_backend_name() -> str:
+    """Backend identifier: pytorch, onnx or onnx-int8"""
+    if not is_onnx_backend():
+        return "pytorch"
+    return "onnx-int8" if ONNX_QUANTIZE_UNET else "onnx"
+
+def is_onnx_pipeline(pipe) -> bool:
+    """True if a pipeline object comes from optimum.onnxruntime"""
+    return type(pipe).__module__.startswith("optimum.")
+
+def _import_optimum():
+    """Import the optional ONNX dependencies with a helpful error"""
+    try:
+        from optimum.onnxruntime import (
+            ORTStableDiffusionPipeline,
+            ORTStableDiffusionImg2ImgPipeline,
+        )
+    except ImportError as e:
+        raise ImportError(
+            "SD_BACKEND=onnx requires optimum and onnxruntime: "
+            "pip install \"optimum[onnxruntime]\""
+        ) from e
+    return ORTStableDiffusionPipeline, ORTStableDiffusionImg2ImgPipeline
+
+def get_model_dir(model_id: str, quantized: bool = False) -> Path:
+    """Local directory holding the exported ONNX model"""
+    variant = "int8" if quantized else "fp32"
+    return ONNX_CACHE_DIR / model_id.replace("/", "--") / variant
+
+def _is_complete(model_dir: Path) -> bool:
+    return (model_dir / EXPORT_COMPLETE_MARKER).exists()
+
+def export_onnx_model(model_id: str) -> Path:
+    """
+    Export a Stable Diffusion model to ONNX (once) and cache it on disk
+
+    The export is written to a temporary directory and renamed into place,
+    so an interrupted export is never mistaken for a finished one.
+
+    Args:
+        model_id: Hugging Face model id or local diffusers directory
+
+    Returns:
+        Directory containing text_encoder/, unet/, vae_decoder/, vae_encoder/
+    """
+    model_dir = get_model_dir(model_id)
+    if _is_complete(model_dir):
+        return model_dir
+
+    ORTStableDiffusionPipeline, _ = _import_optimum()
+
+    logger.info(f"Exporting {model_id} to ONNX (one-time, may take several minutes)...")
+    temp_dir = model_dir.with_name(model_dir.name + ".tmp")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    pipe = ORTStableDiffusionPipeline.from_pretrained(model_id, export=True)
+    pipe.save_pretrained(temp_dir)
+    (temp_dir / EXPORT_COMPLETE_MARKER).touch()
+
+    shutil.rmtree(model_dir, ignore_errors=True)
+    temp_dir.rename(model_dir)
+
+    logger.info(f"✓ ONNX export cached at {model_dir}")
+    return model_dir
+
+def quantize_onnx_unet(model_id: str) -> Path:
+    """
+    Create (once) a copy of the exported model with an int8 UNet
+
+    Uses ONNX Runtime dynamic quantization: weights are stored as int8 and
+    activations are quantized on the fly, which needs no calibration data.
+
+    Returns:
+        Directory of the quantized model
+    """
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantized_dir = get_model_dir(model_id, quantized=True)
+    if _is_complete(quantized_dir):
+        return quantized_dir
+
+    fp32_dir = export_onnx_model(model_id)
+
+    logger.info("Quantizing ONNX UNet to int8...")
+    temp_dir = quantized_dir.with_name(quantized_dir.name + ".tmp")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # Everything except the UNet is reused as-is
+    shutil.copytree(fp32_dir, temp_dir, ignore=shutil.ignore_patterns("unet", EXPORT_COMPLETE_MARKER))
+    (temp_dir / "unet").mkdir()
+    for config_file in (fp32_dir / "unet").glob("*.json"):
+        shutil.copy(config_file, temp_dir / "unet" / config_file.name)
+
+    quantize_dynamic(
+        model_input=fp32_dir / "unet" / "model.onnx",
+        model_output=temp_dir / "unet" / "model.onnx",
+        weight_type=QuantType.QInt8,
+        use_external_data_format=True  # The fp32 UNet exceeds the 2GB protobuf limit
+    )
+    (temp_dir / EXPORT_COMPLETE_MARKER).touch()
+
+    shutil.rmtree(quantized_dir, ignore_errors=True)
+    temp_dir.rename(quantized_dir)
+
+    logger.info(f"✓ Quantized ONNX model cached at {quantized_dir}")
+    return quantized_dir
+
+def load_onnx_components(model_id: str) -> dict:
+    """
+    Load the ONNX Runtime txt2img pipeline, exporting/quantizing if needed
+
+    Returns:
+        Dictionary with the txt2img pipeline under "pipeline" plus the
+        directory it was loaded from under "model_dir"
+    """
+    ORTStableDiffusionPipeline, _ = _import_optimum()
+
+    model_dir = quantize_onnx_unet(model_id) if ONNX_QUANTIZE_UNET else export_onnx_model(model_id)
+
+    pipe = ORTStableDiffusionPipeline.from_pretrained(model_dir, provider=ONNX_PROVIDER)
+    logger.info(f"✓ ONNX Runtime sessions loaded ({get_backend_name()})")
+
+    return {"pipeline": pipe, "model_dir": model_dir}
+
+def build_onnx_pipeline(kind: str, components: dict, scheduler):
+    """
+    Build a txt2img or img2img ONNX pipeline on the same inference sessions
+
+    Args:
+        kind: "txt2img" or "img2img"
+        components: Result of load_onnx_components()
+        scheduler: Scheduler instance owned by the new pipeline
+
+    Returns:
+        ORTStableDiffusionPipeline or ORTStableDiffusionImg2ImgPipeline
+    """
+    ORTStableDiffusionPipeline, ORTStableDiffusionImg2ImgPipeline = _import_optimum()
+    base = components["pipeline"]
+    pipeline_class = ORTStableDiffusionPipeline if kind == "txt2img" else ORTStableDiffusionImg2ImgPipeline
+
+    return pipeline_class(
+        vae_decoder_session=base.vae_decoder.session,
+        text_encoder_session=base.text_encoder.session,
+        unet_session=base.unet.session,
+        config=dict(base._internal_dict),
+        tokenizer=base.tokenizer,
+        scheduler=scheduler,
+        vae_encoder_session=base.vae_encoder.session if base.vae_encoder is not None else None,
+        model_save_dir=components["model_dir"]
+    )
+
+def get_onnx_model_files_mb(components: dict) -> dict:
+    """Size on disk of each exported sub-model (ONNX graph + external weights)"""
+    sizes = {}
+    model_dir = Path(components["model_dir"])
+    for sub_model_dir in sorted(path for path in model_dir.iterdir() if path.is_dir()):
+        if not (sub_model_dir / "model.onnx").exists():
+            continue  # tokenizer/, scheduler/
+        total = sum(f.stat().st_size for f in sub_model_dir.iterdir() if f.is_file() and f.suffix != ".json")
+        sizes[sub_model_dir.name] = round(total / 1024 / 1024, 1)
+    return sizes
+
+def make_initial_latents(pipe, seeds: List[int], height: int, width: int) -> np.ndarray:
+    """
+    Build per-item initial noise for a batched ONNX call
+
+    ONNX pipelines take a single numpy RandomState, so per-item seeds are
+    honoured by drawing each item's latents from its own RandomState.
+
+    Returns:
+        float32 array of shape (len(seeds), 4, height / f, width / f)
+    """
+    scale = pipe.vae_scale_factor
+    shape = (4, height // scale, width // scale)
+    return np.stack([
+        np.random.RandomState(seed).standard_normal(shape).astype(np.float32)
+        for seed in seeds
+    ])
@@ -0,0 +1,57 @@
+"""
+Latent Preview Module
+Cheap RGB previews of in-progress Stable Diffusion latents, used to
+stream step-by-step progress without running the VAE decoder
+"""
+
+import io
+import base64
+
+import torch
+from PIL import Image
+
+# Configuration
+PREVIEW_SIZE = 256  # Preview edge length in pixels
+PREVIEW_QUALITY = 70  # JPEG quality of streamed previews
+
+# Linear approximation of the SD 1.x VAE decoder: each latent channel's
+# contribution to R, G and B (4 x 3). Good enough to show composition and
+# colour at ~0.1% of the cost of a real decode.
+LATENT_RGB_FACTORS = torch.tensor([
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+])
+
+def latents_to_image(latents: torch.Tensor, size: int = PREVIEW_SIZE) -> Image.Image:
+    """
+    Approximate the decoded image for a single latent
+
+    Args:
+        latents: Tensor of shape (1, 4, h, w) or (4, h, w)
+        size: Edge length of the returned preview
+
+    Returns:
+        PIL RGB image of size x size
+    """
+    if latents.dim() == 4:
+        latents = latents[0]
+
+    factors = LATENT_RGB_FACTORS.to(device=latents.device, dtype=latents.dtype)
+    rgb = torch.einsum("chw,cr->hwr", latents, factors)
+    rgb = ((rgb + 1.0) / 2.0).clamp(0, 1).mul(255).byte().cpu().numpy()
+
+    image = Image.fromarray(rgb, mode="RGB")
+    return image.resize((size, size), Image.Resampling.BILINEAR)
+
+def encode_preview(latents: torch.Tensor, size: int = PREVIEW_SIZE) -> str:
+    """
+    Build a data URL with a JPEG preview of the latents
+
+    Returns:
+        "data:image/jpeg;base64,..." string
+    """
+    buffer = io.BytesIO()
+    latents_to_image(latents, size).save(buffer, format="JPEG", quality=PREVIEW_QUALITY)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
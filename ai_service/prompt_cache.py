@@ -0,0 +1,235 @@
+"""
+Prompt Refinement Cache Module
+Two-tier (memory LRU + on-disk SQLite) cache for Gemini prompt refinement
+with TTL expiry and single-flight deduplication of concurrent misses
+"""
+
+import os
+import time
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "cache"))
+PROMPT_CACHE_DB = CACHE_DIR / "prompt_cache.db"
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "1024"))  # In-memory entries
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", str(7 * 24 * 3600)))  # Seconds
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Normalize a prompt for use as a cache key
+
+    "A  Cat!" and "a cat" refine to the same thing, so case, surrounding
+    punctuation and repeated whitespace are ignored.
+    """
+    return " ".join(prompt.lower().split()).strip(" .,!?;:\"'")
+
+class PromptRefinementCache:
+    """
+    Cache of refined prompts keyed by the normalized user prompt
+
+    Lookups check the in-memory LRU first, then the SQLite store. Concurrent
+    misses for the same key share a single upstream call (single-flight).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = PROMPT_CACHE_SIZE,
+        ttl_seconds: float = PROMPT_CACHE_TTL,
+        db_path: Optional[Path] = PROMPT_CACHE_DB
+    ):
+        """
+        Args:
+            max_entries: Maximum in-memory entries
+            ttl_seconds: Age after which an entry is treated as missing
+            db_path: SQLite file for the on-disk tier (None = memory only)
+        """
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.db_path = Path(db_path) if db_path else None
+
+        self._memory = OrderedDict()  # key -> (refined_prompt, created_at)
+        self._inflight = {}  # key -> Future shared by concurrent callers
+        self._lock = threading.Lock()
+
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "deduplicated": 0,
+            "upstream_calls": 0,
+            "upstream_errors": 0,
+        }
+
+        if self.db_path is not None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS prompt_cache ("
+                    "key TEXT PRIMARY KEY, refined_prompt TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _is_fresh(self, created_at: float) -> bool:
+        return (time.time() - created_at) < self.ttl_seconds
+
+    def _remember(self, key: str, refined_prompt: str, created_at: float):
+        """Insert into the memory tier (caller holds the lock)"""
+        if self.max_entries == 0:
+            return
+        self._memory[key] = (refined_prompt, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, prompt: str) -> Optional[str]:
+        """
+        Look up a refined prompt
+
+        Returns:
+            Cached refined prompt, or None on a miss or expired entry
+        """
+        key = normalize_prompt(prompt)
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._is_fresh(entry[1]):
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+
+        if self.db_path is not None:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute(
+                        "SELECT refined_prompt, created_at FROM prompt_cache WHERE key = ?",
+                        (key,)
+                    ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Prompt cache read failed: {str(e)}")
+                row = None
+
+            if row is not None and self._is_fresh(row[1]):
+                with self._lock:
+                    self._remember(key, row[0], row[1])
+                    self._stats["disk_hits"] += 1
+                return row[0]
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, prompt: str, refined_prompt: str):
+        """Store a refined prompt in both tiers"""
+        key = normalize_prompt(prompt)
+        created_at = time.time()
+
+        with self._lock:
+            self._remember(key, refined_prompt, created_at)
+
+        if self.db_path is not None:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO prompt_cache (key, refined_prompt, created_at) "
+                        "VALUES (?, ?, ?)",
+                        (key, refined_prompt, created_at)
+                    )
+            except sqlite3.Error as e:
+                logger.warning(f"Prompt cache write failed: {str(e)}")
+
+    def get_or_compute(self, prompt: str, compute: Callable[[], str]) -> str:
+        """
+        Return the cached refinement or compute it exactly once
+
+        If another thread is already computing the same key, wait for its
+        result instead of making a second upstream call. Exceptions from
+        `compute` propagate to every waiting caller and nothing is cached.
+
+        Args:
+            prompt: User prompt
+            compute: Zero-argument callable performing the upstream call
+
+        Returns:
+            Refined prompt
+        """
+        cached = self.get(prompt)
+        if cached is not None:
+            return cached
+
+        key = normalize_prompt(prompt)
+
+        with self._lock:
+            # Another caller may have filled the cache since our lookup
+            entry = self._memory.get(key)
+            if entry is not None and self._is_fresh(entry[1]):
+                return entry[0]
+
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self._stats["deduplicated"] += 1
+
+        if not is_owner:
+            return future.result()
+
+        try:
+            with self._lock:
+                self._stats["upstream_calls"] += 1
+            refined_prompt = compute()
+            self.put(prompt, refined_prompt)
+            future.set_result(refined_prompt)
+            return refined_prompt
+        except Exception as e:
+            with self._lock:
+                self._stats["upstream_errors"] += 1
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def clear(self):
+        """Remove every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+        if self.db_path is not None:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM prompt_cache")
+
+    def get_stats(self) -> dict:
+        """
+        Get cache statistics
+
+        Returns:
+            Dictionary with hit/miss counters, hit rate and entry count
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = (hits / lookups) if lookups else 0.0
+        stats["ttl_seconds"] = self.ttl_seconds
+        return stats
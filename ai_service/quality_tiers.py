@@ -0,0 +1,295 @@
+"""
+Quality Tiers Module
+Maps a requested quality tier (draft/standard/high) or latency budget to
+concrete generation settings (steps, resolution, scheduler) using a
+per-host calibration table measured at startup
+"""
+
+import os
+import json
+import time
+import threading
+import logging
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CACHE_DIR = Path(os.getenv("CACHE_DIR", "cache"))
+CALIBRATION_FILE = CACHE_DIR / "calibration.json"
+CALIBRATE_TIERS = os.getenv("CALIBRATE_TIERS", "1") == "1"  # Measure the host at startup
+DEFAULT_TIER = "standard"
+MIN_STEPS = 4  # Fewest steps a latency budget may shrink a generation to
+CALIBRATION_STEPS = (2, 6)  # Two step counts to separate per-step from fixed cost
+
+# Uncalibrated per-step estimate at 512x512 (seconds) until the host is measured
+FALLBACK_STEP_SECONDS = {"cuda": 0.05, "cpu": 1.5}
+
+# Tiers in increasing quality (and cost) order
+TIER_ORDER = ["draft", "standard", "high"]
+
+@dataclass(frozen=True)
+class QualitySettings:
+    """
+    Concrete settings for one generation
+
+    Requests with equal settings can share a UNet batch; the tier name is
+    informational and not part of equality.
+    """
+    steps: int
+    image_size: int
+    scheduler: str
+    tier: str = field(default=DEFAULT_TIER, compare=False)
+
+# Per-pipeline tier tables. "standard" matches the previous fixed settings.
+# img2img only runs `steps * strength` denoising steps, hence the higher counts.
+QUALITY_TIERS = {
+    "txt2img": {
+        "draft": QualitySettings(steps=12, image_size=384, scheduler="dpm++", tier="draft"),
+        "standard": QualitySettings(steps=30, image_size=512, scheduler="dpm++", tier="standard"),
+        "high": QualitySettings(steps=50, image_size=512, scheduler="dpm++_karras", tier="high"),
+    },
+    "img2img": {
+        "draft": QualitySettings(steps=20, image_size=384, scheduler="dpm++", tier="draft"),
+        "standard": QualitySettings(steps=50, image_size=512, scheduler="dpm++", tier="standard"),
+        "high": QualitySettings(steps=75, image_size=512, scheduler="dpm++_karras", tier="high"),
+    },
+}
+
+def get_tier_settings(kind: str, tier: str = DEFAULT_TIER) -> QualitySettings:
+    """
+    Settings of a named tier
+
+    Raises:
+        ValueError: If the pipeline kind or tier is unknown
+    """
+    if kind not in QUALITY_TIERS:
+        raise ValueError(f"Unknown pipeline kind: {kind}")
+    if tier not in QUALITY_TIERS[kind]:
+        raise ValueError(f"Invalid quality tier. Available: {', '.join(TIER_ORDER)}")
+    return QUALITY_TIERS[kind][tier]
+
+class TierCalibrator:
+    """
+    Latency model of the host: seconds per denoising step and fixed
+    overhead (text encoder, VAE decode, ...) for every tier resolution
+
+    Measurements are persisted per model/backend/device/CPU count, so the
+    host is only measured once.
+    """
+
+    def __init__(self, calibration_file: Path = CALIBRATION_FILE):
+        self.calibration_file = Path(calibration_file)
+        self._table = {}  # image_size -> {"step_s", "overhead_s"}
+        self._host_key = None
+        self._device = "cpu"
+        self._calibrated_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def resolutions() -> list:
+        """Every resolution used by a tier"""
+        return sorted({
+            settings.image_size
+            for tiers in QUALITY_TIERS.values()
+            for settings in tiers.values()
+        })
+
+    def _read_file(self) -> dict:
+        try:
+            return json.loads(self.calibration_file.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, host_key: str, device: str) -> bool:
+        """
+        Load a previous calibration of this host
+
+        Returns:
+            True if a stored calibration covers every tier resolution
+        """
+        entry = self._read_file().get(host_key)
+        with self._lock:
+            self._host_key = host_key
+            self._device = device
+            if not entry:
+                return False
+            table = {int(size): values for size, values in entry["table"].items()}
+            if not set(self.resolutions()) <= set(table):
+                return False
+            self._table = table
+            self._calibrated_at = entry.get("calibrated_at")
+        logger.info(f"✓ Loaded quality tier calibration for {host_key}")
+        return True
+
+    def calibrate(self, measure: Callable[[int, int], float], host_key: str, device: str):
+        """
+        Measure every tier resolution and persist the result
+
+        Args:
+            measure: Callable (image_size, steps) -> seconds of a full
+                     generation (text encoding, denoising and decoding)
+            host_key: Identifies model, backend and hardware
+            device: "cuda" or "cpu"
+        """
+        logger.info("Calibrating quality tiers (short test generations)...")
+        low_steps, high_steps = CALIBRATION_STEPS
+
+        # Warm-up: first runs pay one-off allocation and kernel selection costs
+        measure(min(self.resolutions()), 1)
+
+        table = {}
+        for image_size in self.resolutions():
+            low = measure(image_size, low_steps)
+            high = measure(image_size, high_steps)
+            step_s = max(1e-3, (high - low) / (high_steps - low_steps))
+            overhead_s = max(0.0, low - low_steps * step_s)
+            table[image_size] = {"step_s": round(step_s, 4), "overhead_s": round(overhead_s, 4)}
+            logger.info(f"  {image_size}x{image_size}: {step_s:.3f}s/step + {overhead_s:.2f}s overhead")
+
+        with self._lock:
+            self._table = table
+            self._host_key = host_key
+            self._device = device
+            self._calibrated_at = time.time()
+
+        stored = self._read_file()
+        stored[host_key] = {"table": table, "calibrated_at": self._calibrated_at}
+        try:
+            self.calibration_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.calibration_file.with_suffix(".tmp")
+            temp_path.write_text(json.dumps(stored, indent=2))
+            os.replace(temp_path, self.calibration_file)
+        except OSError as e:
+            logger.warning(f"Could not store calibration: {str(e)}")
+
+        logger.info("✓ Quality tiers calibrated")
+
+    def export_state(self) -> dict:
+        """Calibration as a picklable dict (to hand from a worker process to the API process)"""
+        with self._lock:
+            return {
+                "table": dict(self._table),
+                "host_key": self._host_key,
+                "device": self._device,
+                "calibrated_at": self._calibrated_at
+            }
+
+    def restore_state(self, state: dict):
+        """Adopt a calibration produced by export_state()"""
+        with self._lock:
+            self._table = {int(size): values for size, values in state["table"].items()}
+            self._host_key = state["host_key"]
+            self._device = state["device"]
+            self._calibrated_at = state["calibrated_at"]
+
+    @property
+    def calibrated(self) -> bool:
+        with self._lock:
+            return bool(self._table)
+
+    def _costs(self, image_size: int) -> Dict[str, float]:
+        """Per-step and fixed cost at a resolution (measured or fallback)"""
+        with self._lock:
+            if image_size in self._table:
+                return self._table[image_size]
+            device = self._device
+
+        step_s = FALLBACK_STEP_SECONDS.get(device, FALLBACK_STEP_SECONDS["cpu"]) * (image_size / 512) ** 2
+        return {"step_s": step_s, "overhead_s": 3 * step_s}
+
+    def estimate_seconds(self, settings: QualitySettings, strength: float = 1.0) -> float:
+        """
+        Predicted latency of one generation with these settings
+
+        Args:
+            settings: Generation settings
+            strength: img2img denoising strength (only that fraction of steps runs)
+        """
+        costs = self._costs(settings.image_size)
+        denoising_steps = max(1, int(settings.steps * strength))
+        return costs["overhead_s"] + denoising_steps * costs["step_s"]
+
+    def select(
+        self,
+        kind: str,
+        tier: Optional[str] = None,
+        latency_budget: Optional[float] = None,
+        strength: float = 1.0
+    ) -> QualitySettings:
+        """
+        Choose settings for a request
+
+        Without a budget the requested tier (default "standard") is used.
+        With a budget, the best tier up to the requested one (default
+        "high") whose estimate fits is chosen; if even "draft" is too slow,
+        its step count is cut to fit (not below MIN_STEPS).
+
+        Args:
+            kind: "txt2img" or "img2img"
+            tier: Optional tier name
+            latency_budget: Optional target latency in seconds
+            strength: img2img denoising strength
+
+        Returns:
+            QualitySettings
+        """
+        if latency_budget is None:
+            return get_tier_settings(kind, tier or DEFAULT_TIER)
+
+        max_tier = tier or TIER_ORDER[-1]
+        get_tier_settings(kind, max_tier)  # Validate
+        candidates = TIER_ORDER[:TIER_ORDER.index(max_tier) + 1]
+
+        for name in reversed(candidates):
+            settings = QUALITY_TIERS[kind][name]
+            if self.estimate_seconds(settings, strength) <= latency_budget:
+                return settings
+
+        # Nothing fits: shrink the cheapest tier's step count
+        draft = QUALITY_TIERS[kind][TIER_ORDER[0]]
+        costs = self._costs(draft.image_size)
+        affordable = (latency_budget - costs["overhead_s"]) / (costs["step_s"] * max(strength, 1e-3))
+        steps = min(draft.steps, max(MIN_STEPS, int(affordable)))
+        return QualitySettings(
+            steps=steps,
+            image_size=draft.image_size,
+            scheduler=draft.scheduler,
+            tier=draft.tier
+        )
+
+    def describe(self, settings: QualitySettings, strength: float = 1.0) -> dict:
+        """Settings plus latency estimate, for API responses"""
+        return {
+            **asdict(settings),
+            "estimated_seconds": round(self.estimate_seconds(settings, strength), 2)
+        }
+
+    def get_report(self) -> dict:
+        """
+        Tier tables with current estimates and calibration status
+
+        Returns:
+            Dictionary for GET /quality/tiers
+        """
+        with self._lock:
+            table = {str(size): dict(values) for size, values in self._table.items()}
+            host_key = self._host_key
+            calibrated_at = self._calibrated_at
+
+        return {
+            "calibrated": bool(table),
+            "host": host_key,
+            "calibrated_at": calibrated_at,
+            "calibration": table,
+            "default_tier": DEFAULT_TIER,
+            "tiers": {
+                kind: {name: self.describe(settings) for name, settings in tiers.items()}
+                for kind, tiers in QUALITY_TIERS.items()
+            }
+        }
+
+# Shared calibration for the service
+tier_calibrator = TierCalibrator()
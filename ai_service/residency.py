@@ -0,0 +1,227 @@
+"""
+Model Residency Module
+Tracks when each pipeline was last used and evicts idle pipelines (and,
+once none is left, the shared weights) after an idle timeout or when the
+process grows past a memory limit; evicted models reload on next use
+"""
+
+import os
+import gc
+import time
+import ctypes
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Callable, List
+
+from metrics import get_process_rss_bytes
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MODEL_IDLE_SECONDS = float(os.getenv("MODEL_IDLE_SECONDS", "0"))  # Evict pipelines unused this long (0 = never)
+MODEL_RSS_LIMIT_MB = int(os.getenv("MODEL_RSS_LIMIT_MB", "0"))  # Evict LRU pipelines above this RSS (0 = no limit)
+RESIDENCY_CHECK_SECONDS = float(os.getenv("RESIDENCY_CHECK_SECONDS", "30"))  # How often the monitor looks
+MODEL_CPU_OFFLOAD = os.getenv("MODEL_CPU_OFFLOAD", "0") == "1"  # CUDA: keep each submodule on the GPU only while it runs
+
+def release_freed_memory():
+    """Collect garbage and hand freed heap pages back to the OS (glibc only)"""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+class ResidencyManager:
+    """
+    Last-use and in-use bookkeeping for resident pipelines
+
+    Work that runs a pipeline holds a lease (acquire/release or in_use) for
+    its pipeline kind, so a pipeline is never evicted mid-request, and the
+    shared weights stay loaded while any lease is held. A monitor thread evicts
+    pipelines idle for idle_seconds, and while RSS is above
+    rss_limit_bytes evicts the least recently used idle pipelines first.
+    The evict callback drops the pipeline (and the shared weights when no
+    pipeline is left); loading again goes through the registry's
+    single-flight loader.
+    """
+
+    def __init__(
+        self,
+        idle_seconds: float = MODEL_IDLE_SECONDS,
+        rss_limit_mb: int = MODEL_RSS_LIMIT_MB,
+        check_seconds: float = RESIDENCY_CHECK_SECONDS
+    ):
+        """
+        Args:
+            idle_seconds: Evict pipelines unused for this long (0 = never)
+            rss_limit_mb: Evict while the process RSS is above this (0 = no limit)
+            check_seconds: Monitor interval
+        """
+        self.idle_seconds = idle_seconds
+        self.rss_limit_bytes = rss_limit_mb * 1024 * 1024
+        self.check_seconds = max(1.0, check_seconds)
+
+        self._evict = None  # Callable[[str], bool], set by the model registry
+        self._last_used = {}  # pipeline key -> monotonic time of last use
+        self._leases = {}  # pipeline kind -> requests currently using it
+        self._lock = threading.RLock()  # Held across eviction, so no lease starts meanwhile
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"idle_evictions": 0, "memory_evictions": 0, "reloads": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.idle_seconds > 0 or self.rss_limit_bytes > 0
+
+    def set_evictor(self, evict: Callable[[str], bool]):
+        """
+        Register the callback that unloads one pipeline key
+
+        It runs with the manager's lock held, so it must not block on a
+        model load (return False instead) and returns True if it evicted.
+        """
+        self._evict = evict
+
+    def touch(self, key: str):
+        """Mark a pipeline as used now"""
+        with self._lock:
+            self._last_used[key] = time.monotonic()
+
+    def forget(self, key: str):
+        """Stop tracking an evicted pipeline"""
+        with self._lock:
+            self._last_used.pop(key, None)
+
+    def record_reload(self):
+        with self._lock:
+            self._stats["reloads"] += 1
+
+    def acquire(self, kind: str):
+        """Take a lease on every pipeline of a kind ("txt2img" or "img2img"); pair with release()"""
+        with self._lock:
+            self._leases[kind] = self._leases.get(kind, 0) + 1
+
+    def release(self, kind: str):
+        """Return a lease; the kind's pipelines count as used now"""
+        now = time.monotonic()
+        with self._lock:
+            self._leases[kind] -= 1
+            for key in self._last_used:
+                if key.split(":", 1)[0] == kind:
+                    self._last_used[key] = now
+
+    @contextmanager
+    def in_use(self, kind: str):
+        """Hold a lease on a pipeline kind for the with-block"""
+        self.acquire(kind)
+        try:
+            yield
+        finally:
+            self.release(kind)
+
+    def any_in_use(self) -> bool:
+        """True while any pipeline kind is leased"""
+        with self._lock:
+            return any(self._leases.values())
+
+    def _evictable(self) -> List[str]:
+        """Tracked pipelines without a lease, least recently used first (caller holds the lock)"""
+        idle = [key for key in self._last_used if not self._leases.get(key.split(":", 1)[0])]
+        return sorted(idle, key=self._last_used.get)
+
+    def _try_evict(self, key: str, reason: str) -> bool:
+        with self._lock:
+            if self._leases.get(key.split(":", 1)[0]) or key not in self._last_used:
+                return False  # Picked up by a request meanwhile
+            idle_for = time.monotonic() - self._last_used[key]
+
+            if not self._evict(key):
+                return False
+            self._stats[f"{reason}_evictions"] += 1
+
+        logger.info(f"Evicted {key} pipeline ({reason}, idle {idle_for:.0f}s)")
+        return True
+
+    def check(self) -> int:
+        """
+        Evict idle pipelines, then LRU pipelines while over the memory limit
+
+        Returns:
+            Number of pipelines evicted
+        """
+        if self._evict is None:
+            return 0
+
+        evicted = 0
+        if self.idle_seconds > 0:
+            now = time.monotonic()
+            with self._lock:
+                expired = [key for key in self._evictable() if now - self._last_used[key] >= self.idle_seconds]
+            for key in expired:
+                evicted += self._try_evict(key, "idle")
+
+        if self.rss_limit_bytes > 0:
+            while get_process_rss_bytes() > self.rss_limit_bytes:
+                with self._lock:
+                    candidates = self._evictable()
+                if not candidates or not self._try_evict(candidates[0], "memory"):
+                    break
+                evicted += 1
+                release_freed_memory()
+
+        return evicted
+
+    def _run(self):
+        while not self._stop.wait(self.check_seconds):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Model residency check failed: {str(e)}")
+
+    def start(self):
+        """Start the monitor thread (no-op if already running or nothing is configured)"""
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-residency", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"✓ Model residency monitor started (idle={self.idle_seconds or 'off'}s, "
+            f"rss_limit={self.rss_limit_bytes // (1024 * 1024) or 'off'}MB)"
+        )
+
+    def stop(self):
+        self._stop.set()
+
+    def get_stats(self) -> dict:
+        """
+        Get residency state
+
+        Returns:
+            Dictionary with limits, per-pipeline idle time and lease count,
+            eviction and reload counters
+        """
+        now = time.monotonic()
+        with self._lock:
+            pipelines = {
+                key: {
+                    "idle_seconds": round(now - last_used, 1),
+                    "in_use": self._leases.get(key.split(":", 1)[0], 0)
+                }
+                for key, last_used in self._last_used.items()
+            }
+            stats = dict(self._stats)
+
+        return {
+            "enabled": self.enabled,
+            "idle_timeout_seconds": self.idle_seconds or None,
+            "rss_limit_mb": self.rss_limit_bytes // (1024 * 1024) or None,
+            "rss_mb": round(get_process_rss_bytes() / 1024 / 1024, 1),
+            "cpu_offload": MODEL_CPU_OFFLOAD,
+            "pipelines": pipelines,
+            **stats
+        }
+
+# Shared manager for this process's pipelines
+residency = ResidencyManager()
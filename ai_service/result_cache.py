@@ -0,0 +1,111 @@
+"""
+Generated Image Result Cache
+Content-addressed cache for deterministic (seeded) generations, stored in
+the image store so retention GC bounds its size
+"""
+
+import json
+import hashlib
+import threading
+import logging
+from typing import Optional
+
+from image_store import ImageStore, image_store
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+CACHED_FILENAME_PREFIX = "ai_cached"
+
+def make_result_key(
+    prompt: str,
+    negative_prompt: str,
+    seed: int,
+    steps: int,
+    guidance_scale: float,
+    width: int,
+    height: int,
+    model_id: str,
+    scheduler: str
+) -> str:
+    """
+    Build the content address of a deterministic generation
+
+    Every input that changes the output pixels is part of the key, so two
+    requests with the same key produce the same image.
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    payload = json.dumps(
+        {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "seed": seed,
+            "steps": steps,
+            "guidance_scale": guidance_scale,
+            "width": width,
+            "height": height,
+            "model_id": model_id,
+            "scheduler": scheduler,
+        },
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    """
+    Maps result keys to images in the image store
+
+    The stored path is derived from the key, so the cache needs no index: a
+    hit is simply an existing (or still-encoding) image. Hits refresh the
+    file's modification time, which retention GC uses as its LRU clock;
+    disk and file-count limits are enforced by the image store's GC.
+    """
+
+    def __init__(self, store: ImageStore = image_store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def filename_for(self, key: str) -> str:
+        """Relative path in the image store for a result key"""
+        return self.store.path_for_digest(key, CACHED_FILENAME_PREFIX)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """
+        Find a previously generated image for this key
+
+        Returns:
+            Relative path in the image store, or None on a miss
+        """
+        filename = self.filename_for(key)
+
+        if self.store.exists(filename):
+            self.store.touch(filename)  # Mark as recently used
+            with self._lock:
+                self._hits += 1
+            return filename
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def get_stats(self) -> dict:
+        """
+        Get cache statistics
+
+        Returns:
+            Dictionary with hit/miss counters
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": (self._hits / lookups) if lookups else 0.0
+            }
+
+# Shared cache of seeded generations
+result_cache = ResultCache()
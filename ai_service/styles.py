@@ -0,0 +1,97 @@
+"""
+Conversion Styles Module
+Style prompts for img2img conversion, kept free of torch/diffusers imports
+so the API can list and validate styles before the models are loaded
+"""
+
+# Default denoising strength (requests may override it)
+DENOISING_STRENGTH = 0.55  # Balance between preserving structure and applying style
+
+# Style-specific prompts
+STYLE_PROMPTS = {
+    "cartoon": {
+        "prompt": (
+            "cartoon illustration style, smooth outlines, flat colors, "
+            "soft shading, clean edges, vibrant colors, animated style, "
+            "professional cartoon art, high quality, no text, no watermark"
+        ),
+        "negative": (
+            "realistic, photorealistic, photograph, photo, text, watermark, "
+            "signature, logo, words, letters, typography, blurry, distorted, "
+            "low quality, ugly, deformed"
+        )
+    },
+    "anime": {
+        "prompt": (
+            "anime style illustration, clean line art, expressive features, "
+            "soft lighting, vibrant colors, studio ghibli inspired, "
+            "japanese animation style, cel shaded, high quality anime art, "
+            "no text, no watermark"
+        ),
+        "negative": (
+            "realistic, western cartoon, 3d render, text, watermark, "
+            "signature, logo, words, letters, blurry, distorted, "
+            "low quality, ugly, deformed, bad anatomy"
+        )
+    },
+    "watercolor": {
+        "prompt": (
+            "watercolor painting style, soft brush strokes, pastel colors, "
+            "artistic texture, paper texture, flowing colors, gentle blending, "
+            "artistic watercolor illustration, high quality, no text, no watermark"
+        ),
+        "negative": (
+            "photograph, digital art, sharp edges, text, watermark, "
+            "signature, logo, words, letters, blurry, distorted, "
+            "low quality, ugly, deformed"
+        )
+    },
+    "pencil_sketch": {
+        "prompt": (
+            "pencil sketch drawing, hand drawn lines, graphite texture, "
+            "black and white, paper texture, artistic sketch, detailed linework, "
+            "professional pencil art, high quality, no text, no watermark"
+        ),
+        "negative": (
+            "color, colored, photograph, digital art, text, watermark, "
+            "signature, logo, words, letters, blurry, distorted, "
+            "low quality, ugly, deformed"
+        )
+    }
+}
+
+def get_fixed_prompts():
+    """
+    Get every style prompt and negative prompt (for embedding precomputation)
+    
+    Returns:
+        List of prompt strings
+    """
+    return [
+        text
+        for style_config in STYLE_PROMPTS.values()
+        for text in (style_config["prompt"], style_config["negative"])
+    ]
+
+def get_available_styles():
+    """
+    Get list of available conversion styles
+    
+    Returns:
+        List of style names
+    """
+    return list(STYLE_PROMPTS.keys())
+
+def get_style_info():
+    """
+    Get information about all available styles
+    
+    Returns:
+        Dictionary with style descriptions
+    """
+    return {
+        "cartoon": "Smooth cartoon illustration with flat colors and clean outlines",
+        "anime": "Japanese anime style with clean line art and expressive features",
+        "watercolor": "Soft watercolor painting with artistic brush strokes",
+        "pencil_sketch": "Hand-drawn pencil sketch in black and white"
+    }
@@ -0,0 +1,147 @@
+"""
+Upload Ingestion Module
+Bounded, chunked reading of image uploads with header-only validation and
+reduced-size decoding, so large phone photos and decompression bombs are
+rejected or shrunk before they cost full-resolution memory and CPU
+"""
+
+import io
+import os
+import math
+import logging
+from dataclasses import dataclass
+
+from fastapi import UploadFile
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Bytes read per chunk
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))  # ~50MP covers current phone cameras
+MAX_IMAGE_DIMENSION = 16384  # Longest edge in pixels
+ALLOWED_IMAGE_FORMATS = {"PNG", "JPEG"}  # Detected from the file header, not the client's content type
+
+class UploadRejected(ValueError):
+    """Raised when an upload is too large, not an allowed image, or a decompression bomb"""
+
+@dataclass
+class ImageHeader:
+    """Format and size read from an image header without decoding pixels"""
+    format: str
+    width: int
+    height: int
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+async def read_upload_limited(upload: UploadFile, max_bytes: int = MAX_UPLOAD_SIZE) -> bytes:
+    """
+    Read an upload in chunks, stopping as soon as it exceeds max_bytes
+
+    Args:
+        upload: FastAPI UploadFile
+        max_bytes: Size cap in bytes
+
+    Returns:
+        The upload's bytes
+
+    Raises:
+        UploadRejected: If the upload is empty or larger than max_bytes
+    """
+    declared_size = getattr(upload, "size", None)
+    if declared_size is not None and declared_size > max_bytes:
+        raise UploadRejected(
+            f"File too large. Maximum size: {max_bytes / 1024 / 1024:.0f}MB. "
+            f"Got: {declared_size / 1024 / 1024:.2f}MB"
+        )
+
+    buffer = bytearray()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        if len(buffer) > max_bytes:
+            raise UploadRejected(
+                f"File too large. Maximum size: {max_bytes / 1024 / 1024:.0f}MB"
+            )
+
+    if not buffer:
+        raise UploadRejected("Empty file uploaded")
+
+    return bytes(buffer)
+
+def inspect_image_header(image_bytes: bytes) -> ImageHeader:
+    """
+    Check format and dimensions from the header only (no pixel decoding)
+
+    Raises:
+        UploadRejected: For unreadable data, a disallowed format or
+                        dimensions over the pixel / edge limits
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:  # Lazy: reads the header only
+            header = ImageHeader(format=image.format, width=image.width, height=image.height)
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(f"Image rejected as a decompression bomb: {str(e)}")
+    except Exception:
+        raise UploadRejected("Uploaded file is not a readable image")
+
+    if header.format not in ALLOWED_IMAGE_FORMATS:
+        raise UploadRejected(f"Invalid image format. Allowed: PNG, JPEG. Got: {header.format}")
+
+    if header.width <= 0 or header.height <= 0:
+        raise UploadRejected("Image has no pixels")
+
+    if max(header.width, header.height) > MAX_IMAGE_DIMENSION or header.pixels > MAX_IMAGE_PIXELS:
+        raise UploadRejected(
+            f"Image dimensions too large: {header.width}x{header.height} "
+            f"(max {MAX_IMAGE_PIXELS / 1_000_000:.0f} megapixels)"
+        )
+
+    return header
+
+def decode_image_for_size(image_bytes: bytes, target_size: int) -> Image.Image:
+    """
+    Decode an image at (close to) the size it will be used at
+
+    JPEGs are decoded with libjpeg's DCT scaling (1/2, 1/4 or 1/8), picking
+    the smallest scale that still covers target_size, so a 12MP photo never
+    exists in memory at full resolution. EXIF orientation is applied, since
+    phone photos are usually stored sideways.
+
+    Args:
+        image_bytes: Validated image bytes (see inspect_image_header)
+        target_size: Edge length the image will be thumbnailed to
+
+    Returns:
+        Decoded RGB PIL image whose longer edge is >= target_size (unless
+        the original is smaller)
+    """
+    header = inspect_image_header(image_bytes)
+
+    image = Image.open(io.BytesIO(image_bytes))
+    if header.format == "JPEG":
+        # Only the longer edge has to cover target_size (the image is thumbnailed into a square)
+        scale = target_size / max(header.width, header.height)
+        image.draft("RGB", (math.ceil(header.width * scale), math.ceil(header.height * scale)))
+
+    try:
+        image.load()
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(f"Image rejected as a decompression bomb: {str(e)}")
+
+    if image.size != (header.width, header.height):
+        logger.info(
+            f"Reduced JPEG decode: {header.width}x{header.height} -> {image.width}x{image.height}"
+        )
+
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    return image
@@ -0,0 +1,536 @@
+"""
+Core-Partitioned Inference Worker Pool
+Runs N inference processes, each pinned to its own slice of CPU cores with
+its own pipelines, and dispatches requests to the least-loaded worker
+
+On many-core CPUs one PyTorch process does not scale linearly with thread
+count; several smaller processes with disjoint cores usually give more
+images per minute. Use benchmark_workers.py to find the best split.
+"""
+
+import os
+import time
+import queue
+import itertools
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+from quality_tiers import tier_calibrator
+from metrics import stage_seconds
+from cancellation import CancelToken
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))  # 0 = run pipelines in the API process
+THREADS_PER_WORKER = int(os.getenv("THREADS_PER_WORKER", "0"))  # 0 = split available cores evenly
+MONITOR_INTERVAL = 1.0  # Seconds between worker liveness checks
+CANCEL_SLOTS = 64  # Shared cancel flags; task ids map to slot task_id % CANCEL_SLOTS
+
+# Task kinds understood by the workers
+TASK_GENERATE_BATCH = "generate_batch"
+TASK_CONVERT = "convert"
+TASK_CONVERT_STYLES = "convert_styles"
+
+def get_available_cores() -> List[int]:
+    """CPU cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def _is_cancel_check(callback: Optional[Callable]) -> bool:
+    """True for CancelToken.keep_going: it needs no latents, so the pool polls its token instead"""
+    return getattr(callback, "__func__", None) is CancelToken.keep_going
+
+def partition_cores(num_workers: int, threads_per_worker: int = 0) -> List[List[int]]:
+    """
+    Split the available cores into one disjoint slice per worker
+
+    Args:
+        num_workers: Number of worker processes
+        threads_per_worker: Cores per worker (0 = split evenly)
+
+    Returns:
+        List of core-id lists, one per worker
+    """
+    cores = get_available_cores()
+    if threads_per_worker <= 0:
+        threads_per_worker = max(1, len(cores) // num_workers)
+
+    if num_workers * threads_per_worker > len(cores):
+        logger.warning(
+            f"{num_workers} workers x {threads_per_worker} threads exceeds {len(cores)} cores; "
+            "slices will overlap"
+        )
+
+    return [
+        [cores[(index * threads_per_worker + offset) % len(cores)] for offset in range(threads_per_worker)]
+        for index in range(num_workers)
+    ]
+
+def _pin_to_cores(cores: List[int]):
+    """Restrict this process and PyTorch's thread pools to the given cores"""
+    threads = str(len(cores))
+    os.environ["OMP_NUM_THREADS"] = threads
+    os.environ["MKL_NUM_THREADS"] = threads
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    import torch
+    torch.set_num_threads(len(cores))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Already fixed once parallel work has started
+
+def run_inference_worker(index: int, cores: List[int], task_queue, result_queue, cancelled, calibrate: bool):
+    """
+    Worker process entry point: pin to cores, load and warm up the pipelines,
+    then run tasks until a None task arrives
+
+    `cancelled` is the pool's shared array of cancelled task ids, checked
+    before a task starts and after every denoising step.
+
+    Messages put on result_queue:
+        ("ready", index, calibration_state)
+        ("step", task_id, item_index, step, total_steps, latents ndarray)
+        ("done", task_id, result)
+        ("error", task_id, error type name, message)
+    """
+    _pin_to_cores(cores)
+    logging.basicConfig(level=logging.INFO)
+
+    from model_registry import preload_models
+    from diffusion_engine import generate_images_batch, calibrate_quality_tiers
+    from img2img_engine import convert_image_to_style, convert_image_to_styles
+    from image_store import image_store
+    from batch_scheduler import GenerationCancelled
+    from cancellation import CancelToken
+
+    logger.info(f"Inference worker {index} (pid {os.getpid()}) on cores {cores}")
+    preload_models()
+
+    # One worker measures per-request latency on its own core slice
+    calibration = None
+    if calibrate:
+        try:
+            calibrate_quality_tiers()
+            calibration = tier_calibrator.export_state()
+        except Exception as e:
+            logger.error(f"Worker {index} failed to calibrate quality tiers: {str(e)}")
+
+    result_queue.put(("ready", index, calibration))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+
+        task_id, kind, kwargs = task
+        cancel_token = CancelToken(
+            check=lambda: cancelled[task_id % CANCEL_SLOTS] == task_id,
+            check_reason="cancelled_by_api"
+        )
+
+        try:
+            if cancel_token.cancelled:
+                raise GenerationCancelled(f"Task {task_id} cancelled before it started")
+
+            if kind == TASK_GENERATE_BATCH:
+                # Forward step latents for items whose caller wants previews;
+                # every item stops once the parent cancels the task
+                stream_steps = kwargs.pop("stream_steps", None) or [False] * len(kwargs["prompts"])
+
+                def make_callback(item_index, forward):
+                    def on_step(step, total_steps, latents):
+                        if forward:
+                            result_queue.put(("step", task_id, item_index, step, total_steps, latents.cpu().numpy()))
+                        return not cancel_token.cancelled
+                    return on_step
+
+                kwargs["step_callbacks"] = [
+                    make_callback(item_index, forward)
+                    for item_index, forward in enumerate(stream_steps)
+                ]
+                filenames = generate_images_batch(**kwargs)
+                result = filenames
+            elif kind == TASK_CONVERT:
+                result = convert_image_to_style(cancel_token=cancel_token, **kwargs)
+                filenames = [result]
+            elif kind == TASK_CONVERT_STYLES:
+                result = convert_image_to_styles(cancel_token=cancel_token, **kwargs)
+                filenames = list(result.values())
+            else:
+                raise ValueError(f"Unknown task kind: {kind}")
+
+            # The API process serves the files, so they must be on disk first
+            for filename in filenames:
+                image_store.wait(filename)
+
+            result_queue.put(("done", task_id, result))
+
+        except Exception as e:
+            result_queue.put(("error", task_id, type(e).__name__, str(e)))
+
+class _WorkerHandle:
+    """Parent-side state of one worker process"""
+
+    def __init__(self, index: int, cores: List[int], process, task_queue):
+        self.index = index
+        self.cores = cores
+        self.process = process
+        self.task_queue = task_queue
+        self.ready = False
+        self.started_at = time.monotonic()
+        self.load_seconds = None  # Start until ready (load, warm-up, calibration)
+        self.in_flight = set()
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+class InferenceWorkerPool:
+    """
+    Pool of core-pinned inference processes with least-loaded dispatch
+
+    Each worker holds its own pipelines (so memory grows with the number of
+    workers) and runs one task at a time on its own cores. A listener
+    thread resolves Futures from the workers' results and forwards step
+    latents to the caller's callbacks.
+
+    A task is cancelled through a small shared-memory array of task ids
+    that the workers check between denoising steps: explicitly with
+    cancel(), or when every step callback of a generation returns False.
+    Latents are only streamed for callbacks that use them (previews); a
+    CancelToken.keep_going callback is checked in this process instead.
+    """
+
+    def __init__(self, num_workers: int = WORKER_PROCESSES, threads_per_worker: int = THREADS_PER_WORKER):
+        self.num_workers = max(1, num_workers)
+        self.core_slices = partition_cores(self.num_workers, threads_per_worker)
+
+        self._context = multiprocessing.get_context("spawn")
+        self._result_queue = None
+        self._workers = []
+        self._tasks = {}  # task_id -> (future, worker, step_callbacks, started_at)
+        self._stopped_items = {}  # task_id -> items whose step callback returned False
+        self._cancelled = None  # Shared array of cancelled task ids, created on start
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._listener = None
+        self._running = False
+        self._ready_event = threading.Event()
+
+    # ----- Lifecycle -----
+
+    def start(self):
+        """Start the worker processes and the result listener (idempotent)"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+
+        self._result_queue = self._context.Queue()
+        self._cancelled = self._context.Array("q", [-1] * CANCEL_SLOTS, lock=False)
+        for index, cores in enumerate(self.core_slices):
+            task_queue = self._context.Queue()
+            process = self._context.Process(
+                target=run_inference_worker,
+                args=(index, cores, task_queue, self._result_queue, self._cancelled, index == 0),
+                name=f"inference-worker-{index}",
+                daemon=True
+            )
+            process.start()
+            self._workers.append(_WorkerHandle(index, cores, process, task_queue))
+
+        self._listener = threading.Thread(target=self._listen, name="inference-pool-listener", daemon=True)
+        self._listener.start()
+
+        logger.info(
+            f"✓ Started {self.num_workers} inference worker(s) with "
+            f"{len(self.core_slices[0])} core(s) each"
+        )
+
+    def stop(self, timeout: float = 10.0):
+        """Ask workers to exit after their current task, then terminate stragglers"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+
+        for worker in self._workers:
+            worker.task_queue.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout=timeout)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+        if self._listener is not None:
+            self._listener.join(timeout=MONITOR_INTERVAL * 2)
+
+        self._fail_tasks([task_id for task_id in list(self._tasks)], RuntimeError("Inference pool stopped"))
+        self._workers = []
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until every worker has loaded and warmed up its pipelines"""
+        return self._ready_event.wait(timeout)
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return bool(self._workers) and all(worker.ready for worker in self._workers)
+
+    # ----- Dispatch -----
+
+    def submit(self, kind: str, step_callbacks: Optional[List[Optional[Callable]]] = None, **kwargs) -> Future:
+        """
+        Send a task to the least-loaded live worker
+
+        Args:
+            kind: TASK_GENERATE_BATCH, TASK_CONVERT or TASK_CONVERT_STYLES
+            step_callbacks: Optional per-item step callbacks (generate only);
+                            once all of them returned False the task is cancelled.
+                            CancelToken.keep_going callbacks get no latents; their
+                            tokens are polled every MONITOR_INTERVAL
+            **kwargs: Arguments of generate_images_batch / convert_image_to_style /
+                      convert_image_to_styles
+
+        Returns:
+            Future resolving to the list of filenames (generate), one filename
+            (convert) or a style -> filename dictionary (convert styles)
+        """
+        if not self._running:
+            self.start()
+
+        future = Future()
+        task_id = next(self._task_ids)
+
+        if step_callbacks:
+            kwargs["stream_steps"] = [
+                callback is not None and not _is_cancel_check(callback)
+                for callback in step_callbacks
+            ]
+
+        with self._lock:
+            candidates = [worker for worker in self._workers if worker.process.is_alive()]
+            if not candidates:
+                raise RuntimeError("No inference workers are running")
+
+            # Least loaded first; among equals prefer warm workers, then the lowest index
+            worker = min(candidates, key=lambda w: (len(w.in_flight), not w.ready, w.index))
+            worker.in_flight.add(task_id)
+            self._tasks[task_id] = (future, worker, step_callbacks or [], time.monotonic())
+
+        worker.task_queue.put((task_id, kind, kwargs))
+        return future
+
+    def cancel(self, future: Future) -> bool:
+        """
+        Cancel a task, whether it is still queued on its worker or running
+
+        The worker skips a queued task and aborts a running one after its
+        current denoising step; the Future then fails with GenerationCancelled.
+
+        Args:
+            future: Future returned by submit()
+
+        Returns:
+            True if the task was still in flight
+        """
+        with self._lock:
+            task_id = next((task_id for task_id, entry in self._tasks.items() if entry[0] is future), None)
+        if task_id is None:
+            return False
+        self._cancel_task(task_id)
+        return True
+
+    def _cancel_task(self, task_id: int):
+        self._cancelled[task_id % CANCEL_SLOTS] = task_id
+
+    def run_generation_batch(
+        self,
+        prompts: List[str],
+        negative_prompts=None,
+        seeds=None,
+        filenames=None,
+        step_callbacks=None,
+        settings=None
+    ) -> List[str]:
+        """BatchScheduler-compatible run_batch that executes on a worker process"""
+        future = self.submit(
+            TASK_GENERATE_BATCH,
+            step_callbacks=step_callbacks,
+            prompts=prompts,
+            negative_prompts=negative_prompts,
+            seeds=seeds,
+            filenames=filenames,
+            settings=settings
+        )
+        return future.result()
+
+    # ----- Results -----
+
+    def _listen(self):
+        """Resolve Futures from worker messages and watch for dead workers"""
+        while self._running or self._tasks:
+            self._poll_cancel_checks()
+            try:
+                message = self._result_queue.get(timeout=MONITOR_INTERVAL)
+            except queue.Empty:
+                self._check_workers()
+                if not self._running:
+                    return
+                continue
+
+            kind = message[0]
+
+            if kind == "ready":
+                _, index, calibration = message
+                with self._lock:
+                    worker = self._workers[index]
+                    worker.ready = True
+                    worker.load_seconds = round(time.monotonic() - worker.started_at, 2)
+                    all_ready = all(worker.ready for worker in self._workers)
+                if calibration:
+                    tier_calibrator.restore_state(calibration)
+                logger.info(f"✓ Inference worker {index} ready")
+                if all_ready:
+                    self._ready_event.set()
+
+            elif kind == "step":
+                _, task_id, item_index, step, total_steps, latents = message
+                entry = self._tasks.get(task_id)
+                if entry is None or item_index >= len(entry[2]) or entry[2][item_index] is None:
+                    continue
+                import torch
+                try:
+                    wanted = entry[2][item_index](step, total_steps, torch.from_numpy(latents))
+                except Exception as e:
+                    logger.error(f"Step callback failed: {str(e)}")
+                    continue
+
+                if wanted is False:
+                    self._stop_item(task_id, item_index, len(entry[2]))
+
+            elif kind == "done":
+                _, task_id, result = message
+                self._finish(task_id, result=result)
+
+            elif kind == "error":
+                _, task_id, error_type, error_message = message
+                self._finish(task_id, error=_rebuild_error(error_type, error_message))
+
+    def _stop_item(self, task_id: int, item_index: int, item_count: int):
+        """Same rule as in-process batches: stop once no item wants its image"""
+        stopped = self._stopped_items.setdefault(task_id, set())
+        stopped.add(item_index)
+        if len(stopped) == item_count:
+            self._cancel_task(task_id)
+
+    def _poll_cancel_checks(self):
+        """Stop items whose CancelToken.keep_going callback's token was cancelled"""
+        with self._lock:
+            tasks = [(task_id, entry[2]) for task_id, entry in self._tasks.items() if entry[2]]
+
+        for task_id, callbacks in tasks:
+            for item_index, callback in enumerate(callbacks):
+                if _is_cancel_check(callback) and callback.__self__.cancelled:
+                    self._stop_item(task_id, item_index, len(callbacks))
+
+    def _finish(self, task_id: int, result=None, error: Optional[Exception] = None):
+        with self._lock:
+            entry = self._tasks.pop(task_id, None)
+            self._stopped_items.pop(task_id, None)
+            if entry is None:
+                return
+            future, worker, _, started_at = entry
+            worker.in_flight.discard(task_id)
+            task_seconds = time.monotonic() - started_at
+            worker.busy_seconds += task_seconds
+            stage_seconds.observe(task_seconds, stage="worker_task")
+            if error is None:
+                worker.completed += 1
+            elif type(error).__name__ == "GenerationCancelled":
+                worker.cancelled += 1
+            else:
+                worker.failed += 1
+
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def _fail_tasks(self, task_ids: List[int], error: Exception):
+        for task_id in task_ids:
+            self._finish(task_id, error=error)
+
+    def _check_workers(self):
+        """Fail the in-flight tasks of workers that died"""
+        for worker in list(self._workers):
+            if self._running and not worker.process.is_alive() and (worker.in_flight or worker.ready):
+                logger.error(f"Inference worker {worker.index} exited (code {worker.process.exitcode})")
+                with self._lock:
+                    worker.ready = False
+                    task_ids = list(worker.in_flight)
+                self._fail_tasks(task_ids, RuntimeError(f"Inference worker {worker.index} exited"))
+
+    # ----- Reporting -----
+
+    def get_load_status(self) -> dict:
+        """Readiness of the pool in the same shape as model_registry.get_load_status()"""
+        with self._lock:
+            stages = {
+                f"worker-{worker.index}": {
+                    "state": "ready" if worker.ready else ("loading" if worker.process.is_alive() else "failed"),
+                    "cores": worker.cores,
+                    "load_seconds": worker.load_seconds
+                }
+                for worker in self._workers
+            }
+        ready_count = sum(stage["state"] == "ready" for stage in stages.values())
+        return {
+            "ready": bool(stages) and ready_count == len(stages),
+            "preload": True,
+            "progress": round(ready_count / len(stages), 2) if stages else 0.0,
+            "stages": stages
+        }
+
+    def get_stats(self) -> dict:
+        """
+        Get per-worker dispatch statistics
+
+        Returns:
+            Dictionary with each worker's cores, load and completed tasks
+        """
+        with self._lock:
+            return {
+                "num_workers": len(self._workers),
+                "workers": [
+                    {
+                        "index": worker.index,
+                        "pid": worker.process.pid,
+                        "alive": worker.process.is_alive(),
+                        "ready": worker.ready,
+                        "cores": worker.cores,
+                        "in_flight": len(worker.in_flight),
+                        "completed": worker.completed,
+                        "failed": worker.failed,
+                        "cancelled": worker.cancelled,
+                        "avg_task_seconds": (
+                            worker.busy_seconds / (worker.completed + worker.failed + worker.cancelled)
+                            if worker.completed + worker.failed + worker.cancelled else 0.0
+                        ),
+                    }
+                    for worker in self._workers
+                ]
+            }
+
+def _rebuild_error(error_type: str, message: str) -> Exception:
+    """Map a worker's exception back to the type the API layer handles"""
+    if error_type == "GenerationCancelled":
+        from batch_scheduler import GenerationCancelled
+        return GenerationCancelled(message)
+    return ValueError(message)